@@ -1,7 +1,15 @@
 import sys
 import random
 import time
-from copy import deepcopy
+import numpy as np
+from gauss_reduce import reduce_cluster
+from board_config import BoardConfig
+from snapshot import BoardSnapshot
+from zobrist import zobrist_keys, cell_key, FLAG
+from movelog import MoveLog
+from results_store import ResultStore, game_record
+import memprofile
+import cluster_pool
 LEFT_CLICK = 1
 RIGHT_CLICK = 3
 NSQUARES_X = 16
@@ -118,7 +126,63 @@ def backtrack_csp(i, assignment, constraints_list, results, n):
             backtrack_csp(i+1, assignment, constraints_list, results, n)
     assignment[i] = -1  
 
-def csp_cluster_solver(cluster, cluster_constraints):
+def valid_reduced_partial(assignment, rows):
+    # each pivot cell is (rhs - the row's free sum) / scale and has to come out 0 or 1
+    for scale, rhs, terms in rows:
+        assigned_sum = 0
+        lo = 0
+        hi = 0
+        for idx, a in terms:
+            val = assignment[idx]
+            if val == -1:
+                if a < 0:
+                    lo += a
+                else:
+                    hi += a
+            else:
+                assigned_sum += a * val
+        if not any(rhs - assigned_sum - hi <= v <= rhs - assigned_sum - lo for v in (0, scale)):
+            return False
+    return True
+
+def backtrack_reduced(i, assignment, rows, results, k):
+    if i == k:
+        pivots = []
+        for scale, rhs, terms in rows:
+            val = rhs - sum(a * assignment[idx] for idx, a in terms)
+            if val != 0 and val != scale:
+                return
+            pivots.append(1 if val else 0)
+        results['count'] += 1
+        for j in range(k):
+            results['free_counts'][j] += assignment[j]
+        for r, val in enumerate(pivots):
+            results['pivot_counts'][r] += val
+        return
+
+    for val in [0, 1]:
+        assignment[i] = val
+        if valid_reduced_partial(assignment, rows):
+            backtrack_reduced(i+1, assignment, rows, results, k)
+    assignment[i] = -1
+
+def csp_enumerate_component(k, rows):
+    """Backtracking count of one component of a ReducedCluster: only the k free
+    cells are branched on, the pivot cells follow from the rows"""
+    results = {
+        'count': 0,
+        'free_counts': [0]*k,
+        'pivot_counts': [0]*len(rows)
+    }
+    backtrack_reduced(0, [-1]*k, rows, results, k)
+    return results['count'], results['free_counts'], results['pivot_counts']
+
+def csp_cluster_solver(cluster, cluster_constraints, reduce=True):
+    if reduce:
+        system = reduce_cluster(cluster, cluster_constraints)
+        if system is None:
+            return {cell: 1.0 for cell in cluster}
+        return system.probabilities(csp_enumerate_component)
     n = len(cluster)
     index_map = {cell: i for i, cell in enumerate(cluster)}
     constraints_list = []
@@ -140,46 +204,219 @@ def csp_cluster_solver(cluster, cluster_constraints):
         for i, cell in enumerate(cluster):
             probs[cell] = results['bomb_counts'][i] / results['count']
         return probs
-def csp_solver(game):
+class ProbabilityMatrix:
+    """Mine probabilities of one position. probs is an (H, W) float array, NaN on
+    revealed and flagged cells; certain marks hidden cells at exactly 0 or 1.
+    clusters holds per-cluster metadata (cells, clue count, solve time) and
+    default_prob the estimate used for hidden cells off the frontier. The
+    arrays are read-only since they are shared through the cache"""
+
+    def __init__(self, probs, clusters, default_prob, key):
+        self.probs = probs
+        self.certain = (probs == 0.0) | (probs == 1.0)
+        self.clusters = clusters
+        self.default_prob = default_prob
+        self.key = key
+        probs.setflags(write=False)
+        self.certain.setflags(write=False)
+
+    def get(self, cell):
+        return float(self.probs[cell])
+
+    def safe_cells(self):
+        return [tuple(int(i) for i in cell) for cell in np.argwhere(self.probs == 0.0)]
+
+    def mine_cells(self):
+        return [tuple(int(i) for i in cell) for cell in np.argwhere(self.probs == 1.0)]
+
+    def hidden_cells(self):
+        return [tuple(int(i) for i in cell) for cell in np.argwhere(~np.isnan(self.probs))]
+
+    def safest(self):
+        """Hidden cell with the lowest mine probability (first in row-major order
+        on ties), None when nothing is hidden"""
+        if np.isnan(self.probs).all():
+            return None
+        return tuple(int(i) for i in np.unravel_index(np.nanargmin(self.probs), self.probs.shape))
+
+def probability_matrix(game, cluster_solver=None, reduce=True, stats=None):
+    """ProbabilityMatrix of the game's current position, solved once per position:
+    the result is cached on the game keyed by its Zobrist state_hash, so the UI,
+    move selection and logging can all ask for it without solving twice. With a
+    cluster_pool enabled, large clusters are solved in parallel"""
+    if cluster_solver is None:
+        cluster_solver = csp_cluster_solver
+    key = (game.state_hash, game.squares_x, game.squares_y, game.num_bombs, game.init,
+           cluster_solver.__name__, reduce)
+    cached = getattr(game, "probability_cache", None)
+    if cached is not None and cached.key == key:
+        return cached
+
+    probs = np.full((game.squares_y, game.squares_x), np.nan)
+    hidden = [(r, c) for r in range(game.squares_y) for c in range(game.squares_x)
+              if not game.grid[r][c].is_visible and not game.grid[r][c].has_flag]
+    flagged_count = sum(1 for row in game.grid for cell in row if cell.has_flag)
+    default_prob = (game.num_bombs - flagged_count) / len(hidden) if hidden else 1.0
+    for cell in hidden:
+        probs[cell] = default_prob
+
+    clusters = []
+    if game.init:
+        with memprofile.phase('frontier'):
+            frontier = get_frontier_cells(game)
+            constraints = get_constraints(game, frontier)
+        with memprofile.phase('clusters'):
+            groups = group_frontier_by_constraints(frontier, constraints)
+        if stats is not None:
+            stats['max_cluster'] = max([stats.get('max_cluster', 0)] + [len(cluster) for cluster in groups])
+        jobs = [(cluster, get_cluster_constraints(cluster, constraints)) for cluster in groups]
+        pool = cluster_pool.active()
+        if pool is not None and not memprofile.profiling() and any(len(c) >= pool.threshold for c in groups):
+            solved = pool.solve(cluster_solver, jobs, reduce)
+        else:
+            solved = []
+            for cluster, cluster_constraints in jobs:
+                start = time.perf_counter()
+                with memprofile.phase('enumerate'):
+                    cluster_probs = cluster_solver(cluster, cluster_constraints, reduce)
+                solved.append((cluster_probs, time.perf_counter() - start))
+        for (cluster, cluster_constraints), (cluster_probs, seconds) in zip(jobs, solved):
+            for cell, prob in cluster_probs.items():
+                probs[cell] = prob
+            clusters.append({"cells": cluster, "clues": len(cluster_constraints), "seconds": seconds})
+
+    result = ProbabilityMatrix(probs, clusters, default_prob, key)
+    try:
+        game.probability_cache = result
+    except AttributeError:
+        pass
+    return result
+
+def obvious_safe_cell(constraints):
+    """A frontier cell the simple rules prove safe, or None: a clue whose mines
+    are all accounted for, after marking the cells of clues that need every
+    hidden neighbour to be a mine, or a clue containing another clue's cells
+    and needing no more mines than it"""
+    mines = set()
+    changed = True
+    while changed:
+        changed = False
+        for required, cells in constraints.values():
+            unknown = [cell for cell in cells if cell not in mines]
+            left = required - (len(cells) - len(unknown))
+            if unknown and left == 0:
+                return unknown[0]
+            if unknown and left == len(unknown):
+                mines.update(unknown)
+                changed = True
+    clues_of = {}
+    reduced = []
+    for required, cells in constraints.values():
+        unknown = frozenset(cell for cell in cells if cell not in mines)
+        reduced.append((required - (len(cells) - len(unknown)), unknown))
+        for cell in unknown:
+            clues_of.setdefault(cell, []).append(len(reduced) - 1)
+    for left, unknown in reduced:
+        for cell in unknown:
+            for other in clues_of[cell]:
+                other_left, other_unknown = reduced[other]
+                if other_left == left and unknown < other_unknown:
+                    return min(other_unknown - unknown)
+    return None
+
+def safest_cell(game, stats=None, cluster_solver=None):
+    """(cell, mine probability) of a hidden cell with the minimum mine
+    probability under probability_matrix (row-reduced clusters, the flat
+    estimate off the frontier), without working out every probability: a cell
+    the simple rules or the row reduction prove safe is returned at once,
+    cluster components are enumerated cheapest first, and one is abandoned as
+    soon as its partial counts show it cannot beat the best cell so far. Ties
+    may resolve to a different cell than ProbabilityMatrix.safest. With a cluster_pool enabled and a cluster at its
+    threshold, the position is solved by probability_matrix with cluster_solver
+    on the pool instead. None when nothing is hidden"""
+    cached = getattr(game, "probability_cache", None)
+    if (cached is not None and cached.key[6] and
+            cached.key[:5] == (game.state_hash, game.squares_x, game.squares_y, game.num_bombs, game.init)):
+        cell = cached.safest()
+        return None if cell is None else (cell, cached.get(cell))
+    hidden = [(r, c) for r in range(game.squares_y) for c in range(game.squares_x)
+              if not game.grid[r][c].is_visible and not game.grid[r][c].has_flag]
+    if not hidden:
+        return None
+    with memprofile.phase('frontier'):
+        frontier = get_frontier_cells(game)
+        constraints = get_constraints(game, frontier)
+    if stats is not None:
+        with memprofile.phase('clusters'):
+            groups = group_frontier_by_constraints(frontier, constraints)
+        stats['max_cluster'] = max([stats.get('max_cluster', 0)] + [len(cluster) for cluster in groups])
+    safe = obvious_safe_cell(constraints)
+    if safe is not None:
+        return safe, 0.0
+    if stats is None:
+        with memprofile.phase('clusters'):
+            groups = group_frontier_by_constraints(frontier, constraints)
+    pool = cluster_pool.active()
+    if pool is not None and not memprofile.profiling() and any(len(c) >= pool.threshold for c in groups):
+        # the pool solves whole clusters at once, so there is nothing to prune
+        matrix = probability_matrix(game, cluster_solver, True, stats)
+        cell = matrix.safest()
+        return None if cell is None else (cell, matrix.get(cell))
+
+    flagged_count = sum(1 for row in game.grid for cell in row if cell.has_flag)
+    interior = [cell for cell in hidden if cell not in frontier]
+    best = (interior[0], (game.num_bombs - flagged_count) / len(hidden)) if interior else (hidden[0], 1.0)
+    components = []
+    for cluster in groups:
+        system = reduce_cluster(cluster, get_cluster_constraints(cluster, constraints))
+        if system is None:
+            continue
+        for idx, val in system.forced.items():
+            if val == 0:
+                return cluster[idx], 0.0
+        components.extend((system, positions, row_ids) for positions, row_ids in system.components())
+    components.sort(key=lambda component: len(component[1]))
+    for system, positions, row_ids in components:
+        with memprofile.phase('enumerate'):
+            found = system.minimum(positions, row_ids, best[1])
+        if found is not None and found[1] < best[1]:
+            best = (system.cluster[found[0]], found[1])
+            if best[1] == 0.0:
+                break
+    return best
+
+def csp_solver(game, stats=None, reduce=True):
     hidden_cells = [
         (r, c) for r in range(game.squares_y) for c in range(game.squares_x)
         if (not game.grid[r][c].is_visible and not game.grid[r][c].has_flag)
     ]
+    from opening_book import opening_move, second_move
     if not game.init:
         if hidden_cells:
-            return random.choice(hidden_cells)
+            return opening_move(game) or random.choice(hidden_cells)
         else:
             return None
-    frontier = get_frontier_cells(game)
-    constraints = get_constraints(game, frontier)
+    if reduce:
+        found = safest_cell(game, stats)
+        if found is not None and found[1] == 0.0:
+            return found[0]
+    else:
+        matrix = probability_matrix(game, csp_cluster_solver, reduce, stats)
+        guaranteed_safe = matrix.safe_cells()
+        if guaranteed_safe:
+            return random.choice(guaranteed_safe)
+        cell = matrix.safest()
+        found = None if cell is None else (cell, matrix.get(cell))
 
-    if not frontier:
-        if hidden_cells:
-            return random.choice(hidden_cells)
-        return None
+    if found is not None:
+        move = second_move(game, found[1])
+        if move is not None:
+            return move
 
-    clusters = group_frontier_by_constraints(frontier, constraints)
-    probabilities = {}
-    for cluster in clusters:
-        cluster_constraints = get_cluster_constraints(cluster, constraints)
-        cluster_probs = csp_cluster_solver(cluster, cluster_constraints)
-        probabilities.update(cluster_probs)
-    flagged_count = sum(
-        1 for r in range(game.squares_y) for c in range(game.squares_x)
-        if game.grid[r][c].has_flag
-    )
-    total_unrevealed = len(hidden_cells)
-    default_prob = 1.0
-    if total_unrevealed > 0:
-        bombs_left = game.num_bombs - flagged_count
-        default_prob = bombs_left / total_unrevealed
-
-    for (r, c) in hidden_cells:
-        if (r, c) not in probabilities:
-            probabilities[(r, c)] = default_prob
-    guaranteed_safe = [cell for cell, prob in probabilities.items() if prob == 0.0]
-    if guaranteed_safe:
-        return random.choice(guaranteed_safe)
+    from endgame import endgame_move
+    move = endgame_move(game)
+    if move is not None:
+        return move
 
     if hidden_cells:
         return random.choice(hidden_cells)
@@ -199,7 +436,7 @@ class HeadlessGame:
             self.test = False
             self.has_flag = False
             
-        def count_bombs(self, max_rows, max_cols):
+        def count_bombs(self, max_rows, max_cols, grid):
             if not self.test:
                 self.test = True
                 if not self.has_bomb:
@@ -208,10 +445,10 @@ class HeadlessGame:
                             if (row >= 0 and row < max_rows and
                                 col >= 0 and col < max_cols and
                                 not (col == self.x and row == self.y) and
-                                game.grid[row][col].has_bomb):
+                                grid[row][col].has_bomb):
                                 self.bomb_count += 1
         
-        def open_neighbours(self, max_rows, max_cols):
+        def open_neighbours(self, max_rows, max_cols, grid, opened=None):
             col = self.x
             row = self.y
             for row_off in range(-1, 2):
@@ -219,22 +456,29 @@ class HeadlessGame:
                     if ((row_off == 0 or col_off == 0) and row_off != col_off and
                         row + row_off >= 0 and col + col_off >= 0 and
                         row + row_off < max_rows and col + col_off < max_cols):
-                        cell = game.grid[row + row_off][col + col_off]
-                        cell.count_bombs(game.squares_y, game.squares_x)
+                        cell = grid[row + row_off][col + col_off]
+                        cell.count_bombs(max_rows, max_cols, grid)
                         if (not cell.is_visible and not cell.has_bomb):
+                            if opened is not None:
+                                opened.append((cell, cell.has_flag))
                             cell.is_visible = True
                             cell.has_flag = False
                             if cell.bomb_count == 0:
-                                cell.open_neighbours(game.squares_y, game.squares_x)
+                                cell.open_neighbours(max_rows, max_cols, grid, opened)
     
-    def __init__(self, num_bombs=40):
-        self.squares_x = NSQUARES_X
-        self.squares_y = NSQUARES_Y
+    def __init__(self, num_bombs=40, config=None):
+        if config is None:
+            config = BoardConfig(NSQUARES_X, NSQUARES_Y, num_bombs, "neighborhood")
+        self.squares_x = config.width
+        self.squares_y = config.height
+        self.config = config
         self.grid = [[self.Cell(x, y) for x in range(self.squares_x)] for y in range(self.squares_y)]
+        self.zobrist = zobrist_keys(self.squares_x, self.squares_y)
+        self.state_hash = 0
         self.init = False
         self.game_lost = False
         self.game_won = False
-        self.num_bombs = num_bombs
+        self.num_bombs = config.mines
         self.flag_count = 0
     
     def place_bombs(self, row, column):
@@ -242,7 +486,7 @@ class HeadlessGame:
         while bombplaced < self.num_bombs:
             x = random.randrange(self.squares_y)
             y = random.randrange(self.squares_x)
-            if (abs(x - row) > 1 or abs(y - column) > 1) and not self.grid[x][y].has_bomb:
+            if self.config.allows_mine(row, column, x, y) and not self.grid[x][y].has_bomb:
                 self.grid[x][y].has_bomb = True
                 bombplaced += 1
         self.count_all_bombs()
@@ -250,8 +494,19 @@ class HeadlessGame:
     def count_all_bombs(self):
         for row in range(self.squares_y):
             for column in range(self.squares_x):
-                self.grid[row][column].count_bombs(self.squares_y, self.squares_x)
+                self.grid[row][column].count_bombs(self.squares_y, self.squares_x, self.grid)
     
+    def hash_opened(self, opened):
+        """Fold cells opened by a flood fill, given as (cell, had_flag), into state_hash"""
+        for cell, had_flag in opened:
+            if had_flag:
+                self.state_hash ^= self.zobrist[cell.y][cell.x][FLAG]
+            self.state_hash ^= cell_key(self.zobrist, cell)
+
+    def snapshot(self, layout=None):
+        """Copy-on-write view of the board for lookahead, see snapshot.BoardSnapshot"""
+        return BoardSnapshot(self, layout)
+
     def check_victory(self):
         count = 0
         total = self.squares_x * self.squares_y
@@ -278,20 +533,26 @@ class HeadlessGame:
                 if not self.init:
                     self.place_bombs(row, column)
                     self.init = True
+                before = cell_key(self.zobrist, self.grid[row][column])
                 self.grid[row][column].is_visible = True
                 self.grid[row][column].has_flag = False
+                self.state_hash ^= before ^ cell_key(self.zobrist, self.grid[row][column])
                 if self.grid[row][column].has_bomb:
                     self.game_lost = True
                     return False
                 if self.grid[row][column].bomb_count == 0 and not self.grid[row][column].has_bomb:
-                    self.grid[row][column].open_neighbours(self.squares_y, self.squares_x)
+                    opened = []
+                    self.grid[row][column].open_neighbours(self.squares_y, self.squares_x, self.grid, opened)
+                    self.hash_opened(opened)
                 return self.check_victory()
         elif button == RIGHT_CLICK:
             if not self.grid[row][column].has_flag:
                 if self.flag_count < self.num_bombs and not self.grid[row][column].is_visible:
                     self.grid[row][column].has_flag = True
+                    self.state_hash ^= self.zobrist[row][column][FLAG]
             else:
                 self.grid[row][column].has_flag = False
+                self.state_hash ^= self.zobrist[row][column][FLAG]
             self.count_flags()
         return False
 
@@ -303,10 +564,54 @@ class HeadlessGame:
         total_safe_cells = self.squares_x * self.squares_y - self.num_bombs
         return (visible_count / total_safe_cells) * 100 if total_safe_cells > 0 else 0
 
-def test_solver(num_games=100, num_mines=10):
-    """Test the CSP solver over multiple games"""
-    
-    global game  
+def play_game(config, seed=None, log=None):
+    """Play one game with csp_solver and return its per-game record. With a
+    movelog.MoveLog the game is appended to it"""
+    if seed is not None:
+        random.seed(seed)
+    if log is not None:
+        log.start(seed)
+    stats = {}
+    move_times = []
+    game = HeadlessGame(config=config)
+    while not game.game_won and not game.game_lost:
+        start = time.perf_counter()
+        move = csp_solver(game, stats)
+        move_times.append(time.perf_counter() - start)
+        if move is None:
+            game.game_lost = True
+            break
+        row, col = move
+        game.click_handle(row, col, LEFT_CLICK)
+        if log is not None:
+            log.move(game, row, col, LEFT_CLICK, move_times[-1])
+    if log is not None:
+        log.finish(game)
+    return {
+        "seed": seed,
+        "won": game.game_won,
+        "exploration": game.get_revealed_percentage(),
+        "moves": len(move_times),
+        "move_times": move_times,
+        "max_cluster": stats.get('max_cluster', 0)
+    }
+
+def test_solver(num_games=100, num_mines=10, config=None, log_path=None, run_id=None):
+    """Test the CSP solver over multiple games, logging every move to log_path if
+    given. With a run_id, game i uses seed i and its record is streamed to
+    results/<run_id>.jsonl; rerunning the same run_id skips finished seeds and
+    the summary is read back from that file"""
+    if config is None:
+        config = BoardConfig(NSQUARES_X, NSQUARES_Y, num_mines, "neighborhood")
+    log = MoveLog(log_path) if log_path else None
+    store = None
+    done = set()
+    if run_id is not None:
+        store = ResultStore(run_id, {"solver": "csp", "width": config.width, "height": config.height,
+                                     "mines": config.mines, "first_click": config.first_click})
+        done = store.completed_seeds()
+        if done:
+            print(f"Resuming run {run_id}: {len(done)} games already done")
     
     wins = 0
     losses = 0
@@ -316,37 +621,33 @@ def test_solver(num_games=100, num_mines=10):
     for game_num in range(1, num_games + 1):
         if game_num % 10 == 0:
             print(f"Progress: {game_num}/{num_games} games played")
+        seed = game_num - 1 if store is not None else None
+        if seed in done:
+            continue
         
-        game = HeadlessGame(num_bombs=num_mines)
-        
-        game_over = False
-        while not game_over:
-            move = csp_solver(game)
-            
-            if move is None:
-                game.game_lost = True
-                losses += 1
-                break
-                
-            row, col = move
-            victory = game.click_handle(row, col, LEFT_CLICK)
-            
-            if victory:
-                wins += 1
-                exploration_rates.append(game.get_revealed_percentage())
-                game_over = True
-            elif game.game_lost:
-                losses += 1
-                exploration_rates.append(game.get_revealed_percentage())
-                game_over = True
+        record = play_game(config, seed, log=log)
+        if store is not None:
+            store.append(game_record(record))
+        if record["won"]:
+            wins += 1
+        else:
+            losses += 1
+        exploration_rates.append(record["exploration"])
     
     end_time = time.time()
     time_taken = end_time - start_time
+    if log is not None:
+        log.close()
+    if store is not None:
+        summary = store.summary(set(range(num_games)))
+        wins, losses = summary["wins"], summary["losses"]
+        exploration_rates = [summary["avg_exploration"]]
+        time_taken = summary["time_taken"]
     
     print("----- RESULTS -----")
     print(f"Games played: {num_games}")
-    print(f"Number of mines: {num_mines}")
-    print(f"Grid size: {NSQUARES_X}x{NSQUARES_Y}")
+    print(f"Number of mines: {config.mines}")
+    print(f"Grid size: {config.width}x{config.height}")
     print(f"Wins: {wins}")
     print(f"Losses: {losses}")
     print(f"Win rate: {(wins/num_games)*100:.2f}%")
@@ -355,7 +656,7 @@ def test_solver(num_games=100, num_mines=10):
     
     return {
         "games": num_games,
-        "mines": num_mines,
+        "mines": config.mines,
         "wins": wins,
         "losses": losses,
         "win_rate": (wins/num_games)*100,
@@ -363,12 +664,20 @@ def test_solver(num_games=100, num_mines=10):
         "time_taken": time_taken
     }
 
-game = None
-
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="Test CSP solver for Minesweeper")
     parser.add_argument("--games", type=int, default=100, help="Number of games to test")
     parser.add_argument("--mines", type=int, default=10, help="Number of mines in each game")
+    parser.add_argument("--width", type=int, default=NSQUARES_X, help="Board width")
+    parser.add_argument("--height", type=int, default=NSQUARES_Y, help="Board height")
+    parser.add_argument("--log", default=None, help="Append a binary move log of every game to this file")
+    parser.add_argument("--run-id", default=None, help="Stream results to results/<run-id>.jsonl and resume it")
+    parser.add_argument("--parallel", type=int, default=0, help="Solve large clusters on this many worker processes")
+    parser.add_argument("--parallel-threshold", type=int, default=cluster_pool.PARALLEL_THRESHOLD,
+                        help="Smallest cluster sent to the workers")
     args = parser.parse_args()
-    test_solver(num_games=args.games, num_mines=args.mines)
\ No newline at end of file
+    if args.parallel:
+        cluster_pool.enable(args.parallel, args.parallel_threshold)
+    test_solver(num_games=args.games, config=BoardConfig(args.width, args.height, args.mines), log_path=args.log,
+                run_id=args.run_id)
\ No newline at end of file
@@ -1,8 +1,87 @@
+import os
 import random
+import struct
+import zipfile
+from itertools import chain
 import numpy as np
 import matplotlib.pyplot as plt
 import time
 from minesweeper_MC import Game, LEFT_CLICK
+from state_codes import encode_states, decode_states, encode_state, encode_action, decode_action
+import memprofile
+from opening_book import opening_move
+
+CHECKPOINT_EVERY = 1000
+# update_q_values_batch applies a round of visits as one vector operation
+# while it has at least this many; narrower rounds are cheaper in Python
+VECTOR_ROUND = 64
+
+
+def _atomic_savez(path, **arrays):
+    """np.savez to a temporary file beside path, fsynced and renamed over it, so
+    a crash leaves either the old checkpoint or the new one"""
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def _mmap_member(path, name):
+    """Memory-map one array of an uncompressed .npz in place"""
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(name + ".npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        return np.load(path)[name]
+    with open(path, "rb") as f:
+        f.seek(info.header_offset)
+        name_len, extra_len = struct.unpack("<HH", f.read(30)[26:30])
+        f.seek(info.header_offset + 30 + name_len + extra_len)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if not shape or shape[0] == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape, order="F" if fortran else "C")
+
+
+class MappedPolicy:
+    """Read-only policy over sorted state codes, typically memory-mapped from a
+    checkpoint: a lookup is a binary search and nothing is unpickled, so a
+    process can start using a large policy at once"""
+
+    def __init__(self, states, actions, width):
+        self.states = states
+        self.actions = actions
+        self.width = width
+
+    def _find(self, local_state):
+        try:
+            code = encode_state(local_state)
+        except ValueError:
+            return -1
+        i = int(np.searchsorted(self.states, code))
+        return i if i < len(self.states) and self.states[i] == code else -1
+
+    def __contains__(self, local_state):
+        return self._find(local_state) >= 0
+
+    def __getitem__(self, local_state):
+        i = self._find(local_state)
+        if i < 0:
+            raise KeyError(local_state)
+        return decode_action(self.actions[i], self.width)
+
+    def get(self, local_state, default=None):
+        i = self._find(local_state)
+        return default if i < 0 else decode_action(self.actions[i], self.width)
+
+    def __len__(self):
+        return len(self.states)
+
 
 class MonteCarloSolver:
     def __init__(self, game, episodes=2000, gamma=0.95):
@@ -112,8 +191,10 @@ class MonteCarloSolver:
 
     def behavior_policy(self, episode_num):
         epsilon = self.get_epsilon(episode_num)
-        state = self.observe_state()
-        if all(all(cell == -1 for cell in row) for row in state):
+        if self.game.state_hash == 0:
+            move = opening_move(self.game)
+            if move is not None and not self.game.grid[move[0]][move[1]].is_visible:
+                return move
             corners = [(0, 0), (0, self.game.squares_x-1), 
                       (self.game.squares_y-1, 0), (self.game.squares_y-1, self.game.squares_x-1)]
             for corner in corners:
@@ -221,6 +302,69 @@ class MonteCarloSolver:
             
             self.Q[sa_pair] = current_estimate + learning_rate * (G - current_estimate)
 
+    def update_q_values_batch(self, episode_histories):
+        """update_q_values over many episodes at once, with exactly the same
+        result as calling it on each in turn. Returns are computed for the
+        padded (episodes, steps) reward matrix in one backward sweep. Each
+        (state, action) pair's visits are then applied in their sequential order
+        (episode by episode, last step first): round j applies every pair's j-th
+        visit as one vector incremental-mean update"""
+        histories = [h for h in episode_histories if h]
+        if not histories:
+            return
+        width = self.game.squares_x
+        cells = self.game.squares_x * self.game.squares_y
+        lengths = np.array([len(h) for h in histories])
+        steps = np.arange(lengths.max())
+        padded = steps < lengths[:, None]
+        # visits in sequential order: each episode from its last step back
+        states, actions, step_rewards = zip(*[step for history in histories for step in reversed(history)])
+        rewards = np.zeros(padded.shape)
+        rewards[padded[:, ::-1]] = step_rewards
+        rewards = rewards[:, ::-1]
+        returns = np.zeros(padded.shape)
+        G = np.zeros(len(histories))
+        for t in range(rewards.shape[1] - 1, -1, -1):
+            G = self.gamma * G + rewards[:, t]
+            returns[:, t] = G
+        visit_returns = returns[:, ::-1][padded[:, ::-1]]
+        cells_at = np.fromiter(chain.from_iterable(actions), dtype=np.int64, count=2 * len(actions))
+        codes = encode_states(states) * cells + cells_at.reshape(-1, 2) @ np.array([width, 1])
+        keys, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
+        visits = np.bincount(inverse, minlength=len(keys))
+        order = np.argsort(inverse, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(visits)[:-1]))
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order)) - np.repeat(starts, visits)
+
+        # write back in order of first visit so new pairs enter Q as they would sequentially
+        by_first = np.argsort(first)
+        representatives = [(states[i], actions[i]) for i in first[by_first].tolist()]
+        q = np.array([self.Q.get(pair, 0) for pair in representatives], dtype=np.float64)
+        n = np.array([self.returns_count.get(pair, 0) for pair in representatives], dtype=np.int64)
+        slot = np.empty(len(keys), dtype=np.int64)
+        slot[by_first] = np.arange(len(keys))
+        target = slot[inverse]
+        by_rank = np.argsort(rank, kind="stable")
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(rank))))
+        j = 0
+        while j + 1 < len(bounds) and bounds[j + 1] - bounds[j] >= VECTOR_ROUND:
+            at = by_rank[bounds[j]:bounds[j + 1]]
+            k = target[at]
+            n[k] += 1
+            q[k] = q[k] + (1.0 / n[k]) * (visit_returns[at] - q[k])
+            j += 1
+        # the few pairs visited more often than that finish one visit at a time
+        q = q.tolist()
+        n = n.tolist()
+        tail = order[rank[order] >= j]
+        for k, G in zip(target[tail].tolist(), visit_returns[tail].tolist()):
+            n[k] += 1
+            q[k] = q[k] + (1.0 / n[k]) * (G - q[k])
+        for pair, value, count in zip(representatives, q, n):
+            self.returns_count[pair] = count
+            self.Q[pair] = value
+
     def extract_policy(self):
         self.policy = {}
         
@@ -235,19 +379,122 @@ class MonteCarloSolver:
                 best_action = max(actions, key=lambda x: x[1])[0]
                 self.policy[state] = best_action
 
-    def train(self, verbose=True):
-        if verbose:
-            print("Starting training...")
-        
+    def _policy_arrays(self, states, actions, values):
+        # extract_policy as arrays: per state the highest value, the earliest
+        # entry of Q among equal values
+        if not len(states):
+            return states, actions
+        order = np.lexsort((np.arange(len(states)), -values, states))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = states[order][1:] != states[order][:-1]
+        chosen = order[first]
+        return states[chosen], actions[chosen]
+
+    def save_checkpoint(self, path, episodes_done):
+        """Learner state as flat arrays in an uncompressed .npz: Q and the visit
+        counts by (state code, action cell), the greedy policy sorted by state
+        code, the training curves and the RNG state, written atomically"""
+        width = self.game.squares_x
+        keys = list(self.Q)
+        states = encode_states([state for state, _ in keys]) if keys else np.zeros(0, dtype=np.int64)
+        actions = np.array([encode_action(action, width) for _, action in keys], dtype=np.int32)
+        values = np.fromiter(self.Q.values(), dtype=np.float64, count=len(keys))
+        counts = np.array([self.returns_count.get(key, 0) for key in keys], dtype=np.int64)
+        policy_states, policy_actions = self._policy_arrays(states, actions, values)
+        version, internal, gauss_next = random.getstate()
+        _atomic_savez(
+            path,
+            meta=np.array([episodes_done, self.game.squares_x, self.game.squares_y, self.episodes, version]),
+            gamma=np.array(self.gamma),
+            q_states=states, q_actions=actions, q_values=values, q_counts=counts,
+            policy_states=policy_states, policy_actions=policy_actions,
+            train_results=np.array(self.train_results, dtype=np.uint8),
+            episode_lengths=np.array(self.episode_lengths, dtype=np.int32),
+            episode_rewards=np.array(self.episode_rewards, dtype=np.float64),
+            rng_state=np.array(internal, dtype=np.uint32),
+            rng_gauss=np.array(np.nan if gauss_next is None else gauss_next),
+        )
+
+    def _check_board(self, meta, path):
+        if (int(meta[1]), int(meta[2])) != (self.game.squares_x, self.game.squares_y):
+            raise ValueError(f"{path} was trained on a {meta[1]}x{meta[2]} board, "
+                             f"not {self.game.squares_x}x{self.game.squares_y}")
+
+    def load_checkpoint(self, path):
+        """Restore the learner state saved by save_checkpoint; returns the number
+        of episodes it had completed"""
+        with np.load(path) as data:
+            meta = data["meta"]
+            self._check_board(meta, path)
+            width = self.game.squares_x
+            states = decode_states(data["q_states"])
+            actions = [divmod(a, width) for a in data["q_actions"].tolist()]
+            keys = list(zip(states, actions))
+            self.Q = dict(zip(keys, data["q_values"].tolist()))
+            self.returns_count = dict(zip(keys, data["q_counts"].tolist()))
+            self.train_results = data["train_results"].tolist()
+            self.episode_lengths = data["episode_lengths"].tolist()
+            self.episode_rewards = data["episode_rewards"].tolist()
+            gauss = float(data["rng_gauss"])
+            random.setstate((int(meta[4]), tuple(data["rng_state"].tolist()), None if np.isnan(gauss) else gauss))
+        self.extract_policy()
+        return int(meta[0])
+
+    def load_policy(self, path):
+        """Use the policy of a checkpoint without loading Q: the arrays are
+        memory-mapped, so this is instant even for a very large policy"""
+        with np.load(path) as data:
+            self._check_board(data["meta"], path)
+        self.policy = MappedPolicy(_mmap_member(path, "policy_states"), _mmap_member(path, "policy_actions"),
+                                   self.game.squares_x)
+        return self.policy
+
+    def train(self, verbose=True, checkpoint_path=None, checkpoint_every=CHECKPOINT_EVERY, batch_size=1,
+              experience=None, replay=0):
+        """Run the training episodes. With checkpoint_path the learner state is
+        saved there every checkpoint_every episodes and at the end, and a run
+        finding a checkpoint there resumes after its last completed episode.
+        With batch_size > 1, episodes are generated batch_size at a time against
+        the same Q and applied with update_q_values_batch. Every episode is also
+        stored in the ExperienceBuffer experience if one is given, and replay
+        stored episodes per new one are sampled from it and learned again"""
         window_size = 100
-        win_rates = []
+        start = 1
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            start = self.load_checkpoint(checkpoint_path) + 1
+            if verbose:
+                print(f"Resuming training from episode {start} ({checkpoint_path})")
+        elif verbose:
+            print("Starting training...")
+        win_rates = [sum(self.train_results[i - window_size:i]) / window_size
+                     for i in range(window_size, start, window_size)]
+        pending = []
         
-        for ep in range(1, self.episodes + 1):
-            _, episode_history = self.generate_episode(ep)
+        for ep in range(start, self.episodes + 1):
+            with memprofile.phase('episode'):
+                _, episode_history = self.generate_episode(ep)
             
-            self.update_q_values(episode_history)
+            if experience is not None:
+                experience.add_episode(episode_history)
+            if batch_size == 1 and not replay:
+                with memprofile.phase('update'):
+                    self.update_q_values(episode_history)
+            else:
+                pending.append(episode_history)
+                if (len(pending) >= batch_size or ep == self.episodes or
+                        (checkpoint_path is not None and ep % checkpoint_every == 0)):
+                    with memprofile.phase('update'):
+                        self.update_q_values_batch(pending)
+                        if replay and experience is not None:
+                            # seeded from random so a resumed run replays the same episodes
+                            rng = np.random.default_rng(random.getrandbits(64))
+                            self.update_q_values_batch(experience.sample_episodes(replay * len(pending), rng))
+                    pending = []
             
             if ep % window_size == 0:
+                if memprofile.profiling():
+                    memprofile.record_cache('mc_Q', len(self.Q), obj=self.Q)
+                    memprofile.record_cache('mc_returns_count', len(self.returns_count), obj=self.returns_count)
                 recent_win_rate = sum(self.train_results[-window_size:]) / window_size
                 win_rates.append(recent_win_rate)
                 
@@ -255,8 +502,17 @@ class MonteCarloSolver:
                     print(f"Episode {ep}/{self.episodes} - Recent win rate: {recent_win_rate:.2f}")
                     print(f"Q table size: {len(self.Q)}")
                     print(f"Average episode length: {sum(self.episode_lengths[-window_size:]) / window_size:.1f}")
+
+            if checkpoint_path is not None and ep % checkpoint_every == 0 and ep < self.episodes:
+                self.save_checkpoint(checkpoint_path, ep)
         
         self.extract_policy()
+        if checkpoint_path is not None and start <= self.episodes:
+            self.save_checkpoint(checkpoint_path, self.episodes)
+        if memprofile.profiling():
+            memprofile.record_cache('mc_Q', len(self.Q), obj=self.Q)
+            memprofile.record_cache('mc_returns_count', len(self.returns_count), obj=self.returns_count)
+            memprofile.record_cache('mc_policy', len(self.policy), obj=self.policy)
         
         if verbose:
             print("Training completed!")
@@ -265,11 +521,14 @@ class MonteCarloSolver:
         
         return win_rates
 
-    def play_game(self, use_policy=True, max_steps=100):
+    def play_game(self, use_policy=True, max_steps=100, move_times=None, log=None):
         self.game.reset_game(keep_bombs=False)
+        if log is not None:
+            log.start()
         steps = 0
         
         while not self.game.game_lost and not self.game.game_won and steps < max_steps:
+            start = time.perf_counter()
             if use_policy:
                 found_action = False
                 unknown_cells = self.get_unknown_cells()
@@ -293,13 +552,20 @@ class MonteCarloSolver:
                         action = random.choice(border_cells) if border_cells else random.choice(unknown_cells)
             else:
                 action = self.behavior_policy(self.episodes)  
+            elapsed = time.perf_counter() - start
+            if move_times is not None:
+                move_times.append(elapsed)
             
             if action is None:
                 break
                 
             self.click_cell(*action)
+            if log is not None:
+                log.move(self.game, action[0], action[1], LEFT_CLICK, elapsed)
             steps += 1
         
+        if log is not None:
+            log.finish(self.game)
         return self.game.game_won, steps
 
     def evaluate(self, num_games=100, use_policy=True):
@@ -415,4 +681,34 @@ class MonteCarloSolver:
         plt.grid(True)
         
         plt.tight_layout()
-        plt.show()
\ No newline at end of file
+        plt.show()
+
+if __name__ == "__main__":
+    import argparse
+    from board_config import BoardConfig
+    from experience import ExperienceBuffer
+    parser = argparse.ArgumentParser(description="Train the Monte Carlo solver with checkpoints")
+    parser.add_argument("--episodes", type=int, default=2000)
+    parser.add_argument("--width", type=int, default=9)
+    parser.add_argument("--height", type=int, default=9)
+    parser.add_argument("--mines", type=int, default=10)
+    parser.add_argument("--checkpoint", default=os.path.join("results", "mc_checkpoint.npz"),
+                        help="Saved periodically; an existing one is resumed")
+    parser.add_argument("--every", type=int, default=CHECKPOINT_EVERY, help="Episodes between checkpoints")
+    parser.add_argument("--batch-size", type=int, default=1, help="Episodes generated per batched Q update")
+    parser.add_argument("--experience", default=None, help="Memory-mapped experience buffer file to append to")
+    parser.add_argument("--capacity", type=int, default=1_000_000, help="Steps the experience buffer holds")
+    parser.add_argument("--replay", type=int, default=0, help="Stored episodes replayed per new episode")
+    parser.add_argument("--evaluate", type=int, default=0, help="Games to play with the memory-mapped policy")
+    args = parser.parse_args()
+    os.makedirs(os.path.dirname(args.checkpoint) or ".", exist_ok=True)
+    solver = MonteCarloSolver(Game(use_display=False, config=BoardConfig(args.width, args.height, args.mines, "cell")),
+                              episodes=args.episodes)
+    experience = ExperienceBuffer(args.capacity, args.width, args.experience) if args.experience else None
+    solver.train(checkpoint_path=args.checkpoint, checkpoint_every=args.every, batch_size=args.batch_size,
+                 experience=experience, replay=args.replay)
+    if experience is not None:
+        experience.close()
+    if args.evaluate:
+        solver.load_policy(args.checkpoint)
+        solver.evaluate(args.evaluate)
@@ -0,0 +1,290 @@
+import ast
+import importlib
+import math
+import os
+import random
+import time
+from statistics import NormalDist
+from board_config import BoardConfig
+from watchdog import Supervisor
+from sweep import write_csv, RESULTS_DIR
+
+LEFT_CLICK = 1
+
+# short names for the built-in solvers; anything else is "module:function"
+SOLVERS = {"csp": "CSP_solver:csp_solver", "dp": "dp_solver:dp_solver"}
+
+
+def load_solver(name):
+    module, _, function = SOLVERS.get(name, name).partition(":")
+    return getattr(importlib.import_module(module), function)
+
+def parse_options(pairs):
+    """["reduce=0", "tag=fast"] -> {"reduce": 0, "tag": "fast"}"""
+    options = {}
+    for pair in pairs or []:
+        key, _, value = pair.partition("=")
+        try:
+            options[key] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            options[key] = value
+    return options
+
+def seeded_opening(config, seed):
+    """HeadlessGame after a first click at a seed-chosen cell. The mines depend
+    only on config and seed, so both arms of a pair play the same board"""
+    from CSP_solver import HeadlessGame
+    random.seed(seed)
+    game = HeadlessGame(config=config)
+    row, col = random.randrange(config.height), random.randrange(config.width)
+    game.click_handle(row, col, LEFT_CLICK)
+    return game
+
+def play_arm(driver, shadow, config, seed, max_moves=None):
+    """Play the seeded board with driver (solver, kwargs). With a shadow solver
+    each position is also handed to it, timed, and its choice compared. The
+    shadow sees the RNG state the driver saw, so equal tie-breaks are not
+    reported as divergent, and the driven game is the same as without it.
+    The game's probability cache is cleared before each timed call, so neither
+    arm is timed on a matrix the other one solved"""
+    solve, kwargs = driver
+    game = seeded_opening(config, seed)
+    random.seed(seed + 1)
+    moves = 0
+    pairs = []
+    divergent = []
+    while not game.game_won and not game.game_lost and (max_moves is None or moves < max_moves):
+        before = random.getstate()
+        game.probability_cache = None
+        start = time.perf_counter()
+        move = solve(game, **kwargs)
+        elapsed = time.perf_counter() - start
+        if move is None:
+            break
+        if shadow is not None:
+            after = random.getstate()
+            random.setstate(before)
+            game.probability_cache = None
+            start = time.perf_counter()
+            other = shadow[0](game, **shadow[1])
+            pairs.append((elapsed, time.perf_counter() - start))
+            random.setstate(after)
+            if other is not None and tuple(other) != tuple(move):
+                divergent.append({
+                    "move": moves,
+                    "state_hash": game.state_hash,
+                    "driver_cell": tuple(move),
+                    "shadow_cell": tuple(other),
+                    "driver_mine": game.grid[move[0]][move[1]].has_bomb,
+                    "shadow_mine": game.grid[other[0]][other[1]].has_bomb,
+                })
+        game.click_handle(move[0], move[1], LEFT_CLICK)
+        moves += 1
+    if max_moves is not None:
+        return game
+    return {"won": game.game_won, "moves": moves, "exploration": game.get_revealed_percentage(),
+            "pairs": pairs, "divergent": divergent}
+
+def play_pair(arm_a, arm_b, config, seed, options=None):
+    """Worker entry point: both arms on the same seeded board, each shadowed by
+    the other, so every position either arm reaches is timed under both"""
+    options = options or {}
+    a = (load_solver(arm_a[0]), arm_a[1])
+    b = (load_solver(arm_b[0]), arm_b[1])
+    shadow = options.get("shadow", True)
+    record_a = play_arm(a, b if shadow else None, config, seed)
+    record_b = play_arm(b, a if shadow else None, config, seed)
+    pairs = record_a["pairs"] + [(ta, tb) for tb, ta in record_b["pairs"]]
+    divergent = ([dict(d, driver="a", a_cell=d["driver_cell"], b_cell=d["shadow_cell"],
+                       a_mine=d["driver_mine"], b_mine=d["shadow_mine"]) for d in record_a["divergent"]] +
+                 [dict(d, driver="b", a_cell=d["shadow_cell"], b_cell=d["driver_cell"],
+                       a_mine=d["shadow_mine"], b_mine=d["driver_mine"]) for d in record_b["divergent"]])
+    for d in divergent:
+        for key in ("driver_cell", "shadow_cell", "driver_mine", "shadow_mine"):
+            del d[key]
+        d["seed"] = seed
+    return {"seed": seed, "a_won": record_a["won"], "b_won": record_b["won"],
+            "a_moves": record_a["moves"], "b_moves": record_b["moves"],
+            "a_exploration": record_a["exploration"], "b_exploration": record_b["exploration"],
+            "pairs": pairs, "divergent": divergent}
+
+def divergent_position(arm, config, seed, move):
+    """Rebuild the position of a divergence record: replay the driving arm's
+    game on its seed up to that move"""
+    return play_arm((load_solver(arm[0]), arm[1]), None, config, seed, max_moves=move)
+
+
+def mcnemar_exact(b, c):
+    """Two-sided exact McNemar p-value from the discordant pair counts"""
+    n = b + c
+    if n == 0:
+        return 1.0
+    tail = sum(math.comb(n, k) for k in range(min(b, c) + 1)) / 2 ** n
+    return min(1.0, 2 * tail)
+
+def paired_win_interval(b, c, n, alpha):
+    """Interval for win rate(B) - win rate(A) from n paired games with b games
+    won only by A and c only by B"""
+    if n == 0:
+        return -1.0, 1.0
+    diff = (c - b) / n
+    z = NormalDist().inv_cdf(1 - alpha / 2)
+    half = z * math.sqrt(max(b + c - (c - b) ** 2 / n, 0.0)) / n
+    return diff - half, diff + half
+
+def latency_interval(records, alpha):
+    """Geometric mean of B/A time on shared positions, with an interval over
+    games (positions within a game are not independent, games are)"""
+    per_game = [sum(math.log(max(tb, 1e-9) / max(ta, 1e-9)) for ta, tb in r["pairs"]) / len(r["pairs"])
+                for r in records if r["pairs"]]
+    n = len(per_game)
+    if n == 0:
+        return 1.0, 0.0, math.inf
+    mean = sum(per_game) / n
+    if n < 2:
+        return math.exp(mean), 0.0, math.inf
+    sd = math.sqrt(sum((x - mean) ** 2 for x in per_game) / (n - 1))
+    half = NormalDist().inv_cdf(1 - alpha / 2) * sd / math.sqrt(n)
+    return math.exp(mean), math.exp(mean - half), math.exp(mean + half)
+
+def summarize(records, alpha=0.05, margin=0.02):
+    finished = [r for r in records if r.get("status", "ok") == "ok"]
+    n = len(finished)
+    only_a = sum(1 for r in finished if r["a_won"] and not r["b_won"])
+    only_b = sum(1 for r in finished if r["b_won"] and not r["a_won"])
+    low, high = paired_win_interval(only_a, only_b, n, alpha)
+    ratio, ratio_low, ratio_high = latency_interval(finished, alpha)
+    divergent = [d for r in finished for d in r["divergent"]]
+    return {
+        "games": n,
+        "unfinished": len(records) - n,
+        "a_win_rate": sum(r["a_won"] for r in finished) / n if n else 0.0,
+        "b_win_rate": sum(r["b_won"] for r in finished) / n if n else 0.0,
+        "only_a_won": only_a,
+        "only_b_won": only_b,
+        "win_diff_low": low,
+        "win_diff_high": high,
+        "mcnemar_p": mcnemar_exact(only_a, only_b),
+        "b_not_worse": low > -margin,
+        "latency_ratio": ratio,
+        "latency_ratio_low": ratio_low,
+        "latency_ratio_high": ratio_high,
+        "positions": sum(len(r["pairs"]) for r in finished),
+        "divergent": len(divergent),
+        "divergent_a_mine": sum(1 for d in divergent if d["a_mine"] and not d["b_mine"]),
+        "divergent_b_mine": sum(1 for d in divergent if d["b_mine"] and not d["a_mine"]),
+    }
+
+def significant(summary):
+    """A result worth stopping on: the win rates differ, or B's latency differs
+    from A's while B's win rate is shown to be no worse"""
+    if summary["mcnemar_p"] < summary["alpha"]:
+        return True
+    latency = summary["latency_ratio_high"] < 1 or summary["latency_ratio_low"] > 1
+    return latency and summary["b_not_worse"]
+
+
+def run_ab(arm_a, arm_b, config=None, min_games=20, max_games=400, batch=20, alpha=0.05,
+           margin=0.02, workers=None, time_limit=None, rss_limit_mb=None, shadow=True,
+           out_dir=RESULTS_DIR, verbose=True):
+    """Play arms A and B, each (solver name, kwargs), on the same seeded boards
+    in supervised worker processes, batch seeds at a time, and stop at the
+    first look where the result is significant. Every look is tested at
+    alpha / (number of possible looks), so repeated looking does not inflate
+    the error rate. Writes the paired games and divergent positions to out_dir"""
+    if config is None:
+        config = BoardConfig(16, 16, 40, "neighborhood")
+    for arm in (arm_a, arm_b):
+        load_solver(arm[0])
+    look_alpha = alpha / math.ceil(max_games / batch)
+    records = []
+    next_seed = 0
+    running = 0
+    summary = None
+    start_time = time.time()
+    with Supervisor(play_pair, workers, time_limit, rss_limit_mb, seed_index=3) as supervisor:
+
+        def submit():
+            nonlocal next_seed, running
+            for seed in range(next_seed, min(next_seed + batch, max_games)):
+                supervisor.submit(seed, (arm_a, arm_b, config, seed, {"shadow": shadow}))
+                running += 1
+            next_seed = min(next_seed + batch, max_games)
+
+        submit()
+        for seed, record in supervisor.results():
+            running -= 1
+            record.setdefault("a_won", False)
+            record.setdefault("b_won", False)
+            records.append(record)
+            if verbose and record["status"] != "ok":
+                print(f"seed {seed}: {record['status']} after {record['elapsed']:.1f}s")
+            if running:
+                continue
+            summary = dict(summarize(records, look_alpha, margin), alpha=look_alpha)
+            if verbose:
+                print(f"{summary['games']:>4} games: A {summary['a_win_rate']:.3f} B {summary['b_win_rate']:.3f} "
+                      f"p={summary['mcnemar_p']:.4f} B/A time {summary['latency_ratio']:.3f} "
+                      f"[{summary['latency_ratio_low']:.3f}, {summary['latency_ratio_high']:.3f}]")
+            if len(records) >= min_games and significant(summary):
+                break
+            if next_seed < max_games:
+                submit()
+        summary = dict(summarize(records, look_alpha, margin), alpha=look_alpha)
+    summary["stopped_early"] = next_seed < max_games
+    summary["significant"] = significant(summary)
+    summary["time_taken"] = time.time() - start_time
+
+    os.makedirs(out_dir, exist_ok=True)
+    records.sort(key=lambda r: r["seed"])
+    write_csv(os.path.join(out_dir, "ab_games.csv"), [
+        {"seed": r["seed"], "status": r.get("status", "ok"), "a_won": int(r["a_won"]), "b_won": int(r["b_won"]),
+         "a_moves": r.get("a_moves", 0), "b_moves": r.get("b_moves", 0),
+         "a_ms": 1000 * sum(ta for ta, _ in r.get("pairs", [])), "b_ms": 1000 * sum(tb for _, tb in r.get("pairs", []))}
+        for r in records])
+    write_csv(os.path.join(out_dir, "ab_divergent.csv"),
+              [d for r in records for d in r.get("divergent", [])])
+
+    if verbose:
+        print("----- A/B RESULTS -----")
+        print(f"A: {arm_a[0]} {arm_a[1]}  B: {arm_b[0]} {arm_b[1]}")
+        print(f"Grid size: {config.width}x{config.height}, mines: {config.mines}")
+        print(f"Paired games: {summary['games']} ({summary['unfinished']} unfinished)")
+        print(f"Win rate A {summary['a_win_rate'] * 100:.2f}%, B {summary['b_win_rate'] * 100:.2f}%, "
+              f"B - A in [{summary['win_diff_low'] * 100:.2f}, {summary['win_diff_high'] * 100:.2f}] points")
+        print(f"Discordant games: A only {summary['only_a_won']}, B only {summary['only_b_won']}, "
+              f"McNemar p = {summary['mcnemar_p']:.4f} (tested at {look_alpha:.4f})")
+        print(f"B/A move time on {summary['positions']} shared positions: {summary['latency_ratio']:.3f} "
+              f"[{summary['latency_ratio_low']:.3f}, {summary['latency_ratio_high']:.3f}]")
+        print(f"Divergent moves: {summary['divergent']} (A hit a mine {summary['divergent_a_mine']}, "
+              f"B hit a mine {summary['divergent_b_mine']})")
+        print(f"{'Stopped early' if summary['stopped_early'] else 'Ran to max games'}, "
+              f"significant: {summary['significant']}, {summary['time_taken']:.2f} seconds, results in {out_dir}/")
+    return summary
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Paired-seed A/B comparison of two solver configurations")
+    parser.add_argument("--a", default="csp", help="csp, dp or module:function")
+    parser.add_argument("--b", default="csp")
+    parser.add_argument("--a-opt", nargs="*", default=[], help="key=value keyword arguments for A")
+    parser.add_argument("--b-opt", nargs="*", default=[])
+    parser.add_argument("--width", type=int, default=16)
+    parser.add_argument("--height", type=int, default=16)
+    parser.add_argument("--mines", type=int, default=40)
+    parser.add_argument("--first-click", choices=["none", "cell", "neighborhood"], default="neighborhood")
+    parser.add_argument("--min-games", type=int, default=20)
+    parser.add_argument("--max-games", type=int, default=400)
+    parser.add_argument("--batch", type=int, default=20)
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--margin", type=float, default=0.02, help="Largest win-rate drop still called no worse")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--time-limit", type=float, default=None, help="Kill a pair after this many seconds")
+    parser.add_argument("--rss-limit", type=int, default=None)
+    parser.add_argument("--no-shadow", action="store_true", help="Skip timing each arm on the other's positions")
+    parser.add_argument("--out", default=RESULTS_DIR)
+    args = parser.parse_args()
+    run_ab((args.a, parse_options(args.a_opt)), (args.b, parse_options(args.b_opt)),
+           BoardConfig(args.width, args.height, args.mines, args.first_click),
+           args.min_games, args.max_games, args.batch, args.alpha, args.margin, args.workers,
+           args.time_limit, args.rss_limit, not args.no_shadow, args.out)
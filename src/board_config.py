@@ -0,0 +1,51 @@
+from dataclasses import dataclass
+
+# Where the first click is guaranteed to be mine-free:
+#   "none"         - nowhere, the first click can lose (minesweeper.py, dp_solver.py)
+#   "cell"         - the clicked cell only (minesweeper_MC.py)
+#   "neighborhood" - the clicked cell and its 8 neighbours (CSP_solver.py)
+FIRST_CLICK_POLICIES = ("none", "cell", "neighborhood")
+
+
+@dataclass(frozen=True)
+class BoardConfig:
+    """Board geometry handed to the games and solver entry points, so several
+    sizes and densities can run side by side without touching module globals"""
+    width: int = 16
+    height: int = 16
+    mines: int = 40
+    first_click: str = "neighborhood"
+
+    def __post_init__(self):
+        if self.width < 1 or self.height < 1:
+            raise ValueError(f"board must be at least 1x1, got {self.width}x{self.height}")
+        if self.first_click not in FIRST_CLICK_POLICIES:
+            raise ValueError(f"first_click must be one of {FIRST_CLICK_POLICIES}, got {self.first_click!r}")
+        if not 0 <= self.mines <= self.width * self.height - self.safe_cells():
+            raise ValueError(f"{self.mines} mines do not fit on a {self.width}x{self.height} board "
+                             f"with first_click={self.first_click!r}")
+
+    @property
+    def density(self):
+        return self.mines / (self.width * self.height)
+
+    def safe_cells(self):
+        """Cells the first click keeps mine-free in the worst case"""
+        return {"none": 0, "cell": 1, "neighborhood": 9}[self.first_click]
+
+    def allows_mine(self, click_row, click_col, row, col):
+        if self.first_click == "cell":
+            return (row, col) != (click_row, click_col)
+        if self.first_click == "neighborhood":
+            return abs(row - click_row) > 1 or abs(col - click_col) > 1
+        return True
+
+    @classmethod
+    def from_game(cls, game):
+        """Current geometry of a game, which the pygame UIs can resize after creation"""
+        return cls(game.squares_x, game.squares_y, game.num_bombs, game.config.first_click)
+
+
+BEGINNER = BoardConfig(9, 9, 10)
+INTERMEDIATE = BoardConfig(16, 16, 40)
+EXPERT = BoardConfig(30, 16, 99)
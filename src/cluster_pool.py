@@ -0,0 +1,89 @@
+import atexit
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# clusters with at least this many cells go to the pool, smaller ones are
+# cheaper to solve inline than to pickle
+PARALLEL_THRESHOLD = 24
+
+_active = None
+
+
+def _solve(cluster_solver, cluster, cluster_constraints, reduce):
+    start = time.perf_counter()
+    probs = cluster_solver(cluster, cluster_constraints, reduce)
+    return probs, time.perf_counter() - start
+
+
+class ClusterPool:
+    """Persistent worker processes for solving the independent frontier clusters
+    of one position at the same time. Large clusters are submitted largest first
+    so the hardest one starts at once, and the small ones are solved inline
+    while the workers run, so a move costs about as much as its hardest cluster.
+    cluster_solver must be a module-level function (pickled by reference)"""
+
+    def __init__(self, workers=None, threshold=PARALLEL_THRESHOLD):
+        self.workers = workers or os.cpu_count() or 1
+        self.threshold = threshold
+        self.executor = None
+
+    def _executor(self):
+        if self.executor is None:
+            if mp.current_process().daemon:
+                # a supervised benchmark worker may not start processes of its own
+                return None
+            self.executor = ProcessPoolExecutor(self.workers)
+        return self.executor
+
+    def solve(self, cluster_solver, jobs, reduce=True):
+        """[(probs, seconds)] for jobs [(cluster, cluster_constraints)], in order"""
+        results = [None] * len(jobs)
+        large = sorted((i for i, (cluster, _) in enumerate(jobs) if len(cluster) >= self.threshold),
+                       key=lambda i: -len(jobs[i][0]))
+        executor = self._executor() if large else None
+        futures = {}
+        if executor is not None:
+            try:
+                for i in large:
+                    futures[i] = executor.submit(_solve, cluster_solver, jobs[i][0], jobs[i][1], reduce)
+            except BrokenProcessPool:
+                self.close()
+                futures = {}
+        for i, (cluster, cluster_constraints) in enumerate(jobs):
+            if i not in futures:
+                results[i] = _solve(cluster_solver, cluster, cluster_constraints, reduce)
+        for i, future in futures.items():
+            try:
+                results[i] = future.result()
+            except BrokenProcessPool:
+                # a worker died; this move finishes inline and the pool restarts on the next
+                self.close()
+                results[i] = _solve(cluster_solver, jobs[i][0], jobs[i][1], reduce)
+        return results
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+def enable(workers=None, threshold=PARALLEL_THRESHOLD):
+    """Solve large clusters on a shared process pool from now on"""
+    global _active
+    disable()
+    _active = ClusterPool(workers, threshold)
+    return _active
+
+def disable():
+    global _active
+    if _active is not None:
+        _active.close()
+        _active = None
+
+def active():
+    return _active
+
+atexit.register(disable)
@@ -0,0 +1,362 @@
+import os
+import random
+import time
+from math import sqrt
+import numpy as np
+from state_codes import OFFSET, POWERS
+from watchdog import Supervisor
+
+LEFT_CLICK = 1
+POLICY_PATH = os.path.join("results", "fast_policy.npz")
+# a neighbourhood is trusted when the upper Z confidence bound on its mean risk
+# is at most the tolerance. The bound counts games rather than positions, since
+# one board shows the same cell move after move. TOLERANCE holds until
+# calibrate() picks one on held-out games: the largest of TOLERANCES whose
+# answers there cost at most MAX_EXCESS mine probability each over the exact
+# solver's pick
+Z = 1.96
+TOLERANCE = 0.02
+TOLERANCES = (0.0, 0.005, 0.01, 0.02, 0.05, 0.1)
+MAX_EXCESS = 0.001
+CALIBRATION_SEED = 2_000_000
+
+# The 8 rotations/reflections of a 3x3 neighbourhood as permutations of its
+# row-major digits. Mine probabilities do not change under them, so codes are
+# canonicalised to the smallest of the 8 and share their labels.
+# SYMMETRY_POWERS[k, s] is the place value of digit k under symmetry s
+_SQUARE = np.arange(9).reshape(3, 3)
+SYMMETRIES = np.array([np.rot90(grid, k).ravel() for grid in (_SQUARE, _SQUARE.T) for k in range(4)])
+SYMMETRY_POWERS = POWERS[np.argsort(SYMMETRIES, axis=1)].T
+
+
+def neighbourhood_codes(game):
+    """(cells, codes) for the hidden unflagged cells: their (row, col) in
+    row-major order and the canonical state code of each one's 3x3
+    neighbourhood as MonteCarloSolver.get_local_state sees it (flags count as
+    hidden, off-board as -2)"""
+    height, width = game.squares_y, game.squares_x
+    padded = np.full((height + 2, width + 2), -2 + OFFSET, dtype=np.int64)
+    padded[1:-1, 1:-1] = [[cell.bomb_count + OFFSET if cell.is_visible else -1 + OFFSET for cell in row]
+                          for row in game.grid]
+    hidden = np.array([[not cell.is_visible and not cell.has_flag for cell in row] for row in game.grid])
+    digits = np.stack([padded[dr:dr + height, dc:dc + width][hidden] for dr in range(3) for dc in range(3)], axis=-1)
+    return np.argwhere(hidden), (digits @ SYMMETRY_POWERS).min(axis=-1)
+
+
+def _aggregate(codes, games, counts, risk_sums, risk_max):
+    """Merge duplicate codes: game and label counts and risk sums add up, maxima
+    take the max"""
+    keys, inverse = np.unique(codes, return_inverse=True)
+    merged_max = np.zeros(len(keys))
+    np.maximum.at(merged_max, inverse, risk_max)
+    return (keys, np.bincount(inverse, games, len(keys)).astype(np.int64),
+            np.bincount(inverse, counts, len(keys)).astype(np.int64),
+            np.bincount(inverse, risk_sums, len(keys)), merged_max)
+
+
+def upper_risk(games, mean, z=Z):
+    """Wilson upper bound on mean risk over `games` games, inf where unseen"""
+    n = np.maximum(games, 1)
+    p = np.nan_to_num(mean)
+    bound = (p + z * z / (2 * n) + z * np.sqrt(p * (1 - p) / n + z * z / (4 * n * n))) / (1 + z * z / n)
+    return np.where(games > 0, bound, np.inf)
+
+
+def label_game(config, seed, max_moves=None):
+    """Worker entry point: play a seeded game with csp_solver and label every
+    hidden cell of every position with the exact engine's mine probability.
+    Labels come back already merged per canonical neighbourhood code"""
+    from CSP_solver import HeadlessGame, csp_solver, probability_matrix
+    random.seed(seed)
+    game = HeadlessGame(config=config)
+    codes, risks = [], []
+    moves = 0
+    start = time.perf_counter()
+    while not game.game_won and not game.game_lost and (max_moves is None or moves < max_moves):
+        if game.init:
+            probs = probability_matrix(game).probs
+            cells, cell_codes = neighbourhood_codes(game)
+            codes.append(cell_codes)
+            risks.append(probs[cells[:, 0], cells[:, 1]])
+        move = csp_solver(game)
+        if move is None:
+            break
+        game.click_handle(move[0], move[1], LEFT_CLICK)
+        moves += 1
+    codes = np.concatenate(codes) if codes else np.zeros(0, dtype=np.int64)
+    risks = np.concatenate(risks) if risks else np.zeros(0)
+    keys, _, counts, risk_sums, risk_max = _aggregate(codes, np.ones(len(codes)), np.ones(len(codes)), risks, risks)
+    return {"seed": seed, "won": game.game_won, "moves": moves, "labels": len(codes),
+            "elapsed": time.perf_counter() - start, "codes": keys, "games": np.ones(len(keys), dtype=np.int64),
+            "counts": counts, "risk_sums": risk_sums, "risk_max": risk_max}
+
+
+class FastPolicy:
+    """Lookup table from canonical 3x3 neighbourhood code to the mine
+    probabilities the exact solver gave it: in how many games and positions it
+    was seen, the mean and the largest. It serves as labelled training data,
+    and confident_move() answers from it when the best cell is trusted,
+    leaving the position to the exact engine otherwise. tolerance and speedup
+    come from calibrate(); speedup is the exact solver's time over
+    fast_solver's on the held-out games, None before calibration"""
+
+    def __init__(self, codes, games, counts, risk_sums, risk_max, tolerance=TOLERANCE, speedup=None):
+        self.codes = np.asarray(codes, dtype=np.int64)
+        self.games = np.asarray(games, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.risk_sums = np.asarray(risk_sums, dtype=np.float64)
+        self.risk_max = np.asarray(risk_max, dtype=np.float64)
+        self.tolerance = tolerance
+        self.speedup = speedup
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def labels(self):
+        return int(self.counts.sum())
+
+    def lookup(self, codes):
+        """(games, mean risk, max risk) of an array of codes, games 0 and risk
+        NaN for codes never labelled"""
+        codes = np.asarray(codes, dtype=np.int64)
+        if not len(self.codes):
+            return np.zeros(codes.shape, dtype=np.int64), np.full(codes.shape, np.nan), np.full(codes.shape, np.nan)
+        at = np.minimum(np.searchsorted(self.codes, codes), len(self.codes) - 1)
+        known = self.codes[at] == codes
+        games = np.where(known, self.games[at], 0)
+        mean = np.where(known, self.risk_sums[at] / np.maximum(self.counts[at], 1), np.nan)
+        worst = np.where(known, self.risk_max[at], np.nan)
+        return games, mean, worst
+
+    def trusted(self, codes, tolerance=None):
+        """(trusted mask, mean risk) of an array of codes"""
+        games, mean, _ = self.lookup(codes)
+        return upper_risk(games, mean) <= (self.tolerance if tolerance is None else tolerance), mean
+
+    def confident_move(self, game, tolerance=None):
+        """The trusted hidden cell with the lowest mean risk (first in row-major
+        order on ties), or None when no cell is trusted"""
+        cells, codes = neighbourhood_codes(game)
+        if not len(cells):
+            return None
+        trusted, mean = self.trusted(codes, tolerance)
+        if not trusted.any():
+            return None
+        best = np.flatnonzero(trusted)[np.argmin(mean[trusted])]
+        return tuple(int(i) for i in cells[best])
+
+    def merge(self, other):
+        # new labels invalidate the calibration
+        return FastPolicy(*_aggregate(np.concatenate([self.codes, other.codes]),
+                                      np.concatenate([self.games, other.games]),
+                                      np.concatenate([self.counts, other.counts]),
+                                      np.concatenate([self.risk_sums, other.risk_sums]),
+                                      np.concatenate([self.risk_max, other.risk_max])))
+
+    def save(self, path=POLICY_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, codes=self.codes, games=self.games, counts=self.counts,
+                 risk_sums=self.risk_sums, risk_max=self.risk_max, tolerance=self.tolerance,
+                 speedup=np.nan if self.speedup is None else self.speedup)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=POLICY_PATH):
+        with np.load(path) as data:
+            tolerance = float(data["tolerance"]) if "tolerance" in data else TOLERANCE
+            speedup = float(data["speedup"]) if "speedup" in data else np.nan
+            return cls(data["codes"], data["games"], data["counts"], data["risk_sums"], data["risk_max"],
+                       tolerance, None if np.isnan(speedup) else speedup)
+
+
+_policies = {}
+
+def load_policy(path=POLICY_PATH):
+    """FastPolicy of path, read once per process"""
+    policy = _policies.get(path)
+    if policy is None:
+        policy = _policies[path] = FastPolicy.load(path)
+    return policy
+
+def fast_solver(game, stats=None, path=POLICY_PATH, tolerance=None):
+    """csp_solver behind the distilled lookup: a trusted cell from the table is
+    played at once, anything else goes to the exact engine. When calibration
+    found the lookup slower than solving, every move goes to the exact engine.
+    stats counts the two kinds of move under 'fast_moves' and 'exact_moves'"""
+    from CSP_solver import csp_solver
+    policy = load_policy(path)
+    if game.init and (policy.speedup is None or policy.speedup > 1.0):
+        move = policy.confident_move(game, tolerance)
+        if move is not None:
+            if stats is not None:
+                stats['fast_moves'] = stats.get('fast_moves', 0) + 1
+            return move
+    if stats is not None:
+        stats['exact_moves'] = stats.get('exact_moves', 0) + 1
+    return csp_solver(game, stats)
+
+
+def play_game(config, seed=None, path=POLICY_PATH, tolerance=None):
+    """Play one game with fast_solver and return its per-game record"""
+    from CSP_solver import HeadlessGame
+    if seed is not None:
+        random.seed(seed)
+    stats = {}
+    move_times = []
+    game = HeadlessGame(config=config)
+    while not game.game_won and not game.game_lost:
+        start = time.perf_counter()
+        move = fast_solver(game, stats, path, tolerance)
+        move_times.append(time.perf_counter() - start)
+        if move is None:
+            game.game_lost = True
+            break
+        game.click_handle(move[0], move[1], LEFT_CLICK)
+    return {
+        "seed": seed,
+        "won": game.game_won,
+        "exploration": game.get_revealed_percentage(),
+        "moves": len(move_times),
+        "move_times": move_times,
+        "fast_moves": stats.get('fast_moves', 0),
+        "exact_moves": stats.get('exact_moves', 0),
+        "max_cluster": stats.get('max_cluster', 0)
+    }
+
+
+def held_out_positions(config, seed):
+    """Worker entry point: play a seeded game with csp_solver and return, per
+    position, the exact mine probability and neighbourhood code of every hidden
+    cell, with the time csp_solver and neighbourhood_codes took on it"""
+    from CSP_solver import HeadlessGame, csp_solver, probability_matrix
+    random.seed(seed)
+    game = HeadlessGame(config=config)
+    risks, codes, solve_seconds, code_seconds = [], [], [], []
+    while not game.game_won and not game.game_lost:
+        if game.init:
+            game.probability_cache = None
+            start = time.perf_counter()
+            move = csp_solver(game)
+            solve_seconds.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            cells, cell_codes = neighbourhood_codes(game)
+            code_seconds.append(time.perf_counter() - start)
+            probs = probability_matrix(game).probs
+            risks.append(probs[cells[:, 0], cells[:, 1]])
+            codes.append(cell_codes)
+        else:
+            move = csp_solver(game)
+        if move is None:
+            break
+        game.click_handle(move[0], move[1], LEFT_CLICK)
+    return {"seed": seed, "risks": risks, "codes": codes, "solve_seconds": solve_seconds,
+            "code_seconds": code_seconds}
+
+def calibrate(policy, config, games=50, workers=None, time_limit=120.0, first_seed=CALIBRATION_SEED,
+              tolerances=TOLERANCES, max_excess=MAX_EXCESS, verbose=True):
+    """Pick the policy's tolerance on held-out games: for each candidate, how
+    many positions the table answers and how much riskier its cell is than the
+    exact solver's safest one. The largest tolerance within max_excess per
+    answer is kept, and its speedup over csp_solver is measured on the same
+    positions. Returns the policy with both set"""
+    from sweep import preload
+    preload(["csp"])
+    positions = []
+    with Supervisor(held_out_positions, workers, time_limit, seed_index=1) as supervisor:
+        for seed in range(first_seed, first_seed + games):
+            supervisor.submit(seed, (config, seed))
+        for seed, record in supervisor.results():
+            if record["status"] == "ok":
+                positions.extend(zip(record["risks"], record["codes"], record["solve_seconds"],
+                                     record["code_seconds"]))
+    solve_time = sum(p[2] for p in positions)
+    policy.tolerance, policy.speedup = min(tolerances), None
+    for tolerance in sorted(tolerances):
+        answered = 0
+        excess = 0.0
+        fast_time = 0.0
+        for risks, codes, solve_seconds, code_seconds in positions:
+            start = time.perf_counter()
+            trusted, mean = policy.trusted(codes, tolerance)
+            fast_time += code_seconds + time.perf_counter() - start
+            if trusted.any():
+                answered += 1
+                excess += risks[np.flatnonzero(trusted)[np.argmin(mean[trusted])]] - risks.min()
+            else:
+                fast_time += solve_seconds
+        speedup = solve_time / fast_time if fast_time else 1.0
+        ok = excess <= max_excess * answered
+        if verbose:
+            print(f"tolerance {tolerance:<6} answers {answered}/{len(positions)} positions, "
+                  f"excess risk {excess / max(answered, 1):.4f} per answer, speedup {speedup:.2f}x"
+                  + ("" if ok else " (rejected)"))
+        if ok:
+            policy.tolerance, policy.speedup = tolerance, speedup
+    if verbose and policy.speedup is not None:
+        print(f"Tolerance {policy.tolerance}: fast_solver is {policy.speedup:.2f}x csp_solver's speed"
+              + ("" if policy.speedup > 1.0 else "; the lookup does not pay off here, so fast_solver "
+                 "defers every move to csp_solver and the table serves only as labels"))
+    return policy
+
+
+def distill(config, games=100, workers=None, time_limit=120.0, path=POLICY_PATH, first_seed=0, verbose=True):
+    """Label games seeds first_seed.. with the exact solver on supervised worker
+    processes and merge the labels into the FastPolicy at path (extending the
+    one already there). Returns the policy"""
+    from sweep import preload
+    preload(["csp"])
+    policy = FastPolicy.load(path) if os.path.exists(path) else FastPolicy([], [], [], [], [])
+    labels = 0
+    failed = 0
+    start_time = time.time()
+    with Supervisor(label_game, workers, time_limit, seed_index=1) as supervisor:
+        for seed in range(first_seed, first_seed + games):
+            supervisor.submit(seed, (config, seed))
+        for seed, record in supervisor.results():
+            if record["status"] != "ok":
+                failed += 1
+                if verbose:
+                    print(f"seed {seed}: {record['status']} after {record['elapsed']:.1f}s")
+                continue
+            labels += record["labels"]
+            policy = policy.merge(FastPolicy(record["codes"], record["games"], record["counts"],
+                                             record["risk_sums"], record["risk_max"]))
+    policy.save(path)
+    if verbose:
+        trusted = int(policy.trusted(policy.codes)[0].sum())
+        print(f"Labelled {labels} cells from {games - failed} games in {time.time() - start_time:.1f} seconds")
+        print(f"Policy: {len(policy)} neighbourhoods, {policy.labels} labels, {trusted} trusted, saved to {path}")
+    return policy
+
+
+if __name__ == "__main__":
+    import argparse
+    from board_config import BoardConfig
+    parser = argparse.ArgumentParser(description="Distil the exact solver into a fast neighbourhood lookup")
+    parser.add_argument("--games", type=int, default=100, help="Games to label")
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--width", type=int, default=16)
+    parser.add_argument("--height", type=int, default=16)
+    parser.add_argument("--mines", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--time-limit", type=float, default=120.0, help="Seconds per labelled game")
+    parser.add_argument("--out", default=POLICY_PATH)
+    parser.add_argument("--calibrate", type=int, default=50, help="Held-out games to pick the tolerance on")
+    parser.add_argument("--evaluate", type=int, default=0, help="Games to play with fast_solver afterwards")
+    args = parser.parse_args()
+    from sweep import NATIVE_FIRST_CLICK
+    config = BoardConfig(args.width, args.height, args.mines, NATIVE_FIRST_CLICK["csp"])
+    if args.games:
+        distill(config, args.games, args.workers, args.time_limit, args.out, args.first_seed)
+    if args.calibrate:
+        calibrate(FastPolicy.load(args.out), config, args.calibrate, args.workers, args.time_limit).save(args.out)
+    if args.evaluate:
+        records = [play_game(config, 1_000_000 + seed, args.out) for seed in range(args.evaluate)]
+        moves = sum(r["moves"] for r in records)
+        fast = sum(r["fast_moves"] for r in records)
+        seconds = sum(sum(r["move_times"]) for r in records)
+        print(f"Win rate: {sum(r['won'] for r in records) / len(records) * 100:.2f}%")
+        print(f"Moves answered by the lookup: {fast}/{moves} ({fast / max(moves, 1) * 100:.1f}%)")
+        print(f"Mean move time: {seconds / max(moves, 1) * 1000:.3f} ms")
@@ -1,7 +1,17 @@
 import pygame
 import sys
+import random
 from random import randrange
 from functools import lru_cache
+from gauss_reduce import reduce_cluster
+from CSP_solver import probability_matrix, safest_cell
+from board_config import BoardConfig
+from snapshot import BoardSnapshot
+from zobrist import zobrist_keys, cell_key, full_hash, FLAG
+from movelog import MoveLog, log_from_argv
+from results_store import ResultStore, game_record
+import memprofile
+import cluster_pool
 
 import time
 
@@ -24,14 +34,19 @@ NSQUARES_Y = 16
 EXPERT_BOMBS = 40
 
 class Game:
-    def __init__(self):
-        self.squares_x = NSQUARES_X
-        self.squares_y = NSQUARES_Y
+    def __init__(self, config=None):
+        if config is None:
+            config = BoardConfig(NSQUARES_X, NSQUARES_Y, EXPERT_BOMBS, "none")
+        self.config = config
+        self.squares_x = config.width
+        self.squares_y = config.height
         self.grid = [[self.Cell(x, y) for x in range(self.squares_x)] for y in range(self.squares_y)]
+        self.zobrist = zobrist_keys(self.squares_x, self.squares_y)
+        self.state_hash = 0
         self.init = False
         self.game_lost = False
         self.game_won = False
-        self.num_bombs = EXPERT_BOMBS
+        self.num_bombs = config.mines
         self.resize = False
         self.flag_count = 0
 
@@ -63,6 +78,8 @@ class Game:
         if self.num_bombs > (self.squares_x * self.squares_y) // 3:
             self.num_bombs = (self.squares_x * self.squares_y) // 3
         self.grid = [[self.Cell(x, y) for x in range(self.squares_x)] for y in range(self.squares_y)]
+        self.zobrist = zobrist_keys(self.squares_x, self.squares_y)
+        self.state_hash = 0
         size = ((self.squares_x * (WIDTH + MARGIN) + MARGIN),
                 (self.squares_y * (HEIGHT + MARGIN) + MARGIN + MENU_SIZE))
         screen = pygame.display.set_mode(size, pygame.RESIZABLE)
@@ -73,6 +90,7 @@ class Game:
                 if self.grid[row][column].has_bomb:
                     self.grid[row][column].is_visible = True
                 self.grid[row][column].has_flag = False
+        self.state_hash = full_hash(self)
 
     def change_num_bombs(self, bombs):
         self.num_bombs += bombs
@@ -87,7 +105,7 @@ class Game:
         while bombplaced < self.num_bombs:
             x = randrange(self.squares_y)
             y = randrange(self.squares_x)
-            if not self.grid[x][y].has_bomb:
+            if self.config.allows_mine(row, column, x, y) and not self.grid[x][y].has_bomb:
                 self.grid[x][y].has_bomb = True
                 bombplaced += 1
         self.count_all_bombs()
@@ -95,7 +113,7 @@ class Game:
     def count_all_bombs(self):
         for row in range(self.squares_y):
             for column in range(self.squares_x):
-                self.grid[row][column].count_bombs(self.squares_y, self.squares_x)
+                self.grid[row][column].count_bombs(self.squares_y, self.squares_x, self.grid)
 
     def reset_game(self):
         for row in range(self.squares_y):
@@ -109,6 +127,18 @@ class Game:
                 self.game_lost = False
                 self.game_won = False
                 self.flag_count = 0
+        self.state_hash = 0
+
+    def hash_opened(self, opened):
+        """Fold cells opened by a flood fill, given as (cell, had_flag), into state_hash"""
+        for cell, had_flag in opened:
+            if had_flag:
+                self.state_hash ^= self.zobrist[cell.y][cell.x][FLAG]
+            self.state_hash ^= cell_key(self.zobrist, cell)
+
+    def snapshot(self, layout=None):
+        """Copy-on-write view of the board for lookahead, see snapshot.BoardSnapshot"""
+        return BoardSnapshot(self, layout)
 
     def check_victory(self):
         count = 0
@@ -123,6 +153,7 @@ class Game:
                 for column in range(self.squares_x):
                     if self.grid[row][column].has_bomb:
                         self.grid[row][column].has_flag = True
+            self.state_hash = full_hash(self)
 
     def count_flags(self):
         total_flags = 0
@@ -140,13 +171,17 @@ class Game:
                 if not self.init:
                     self.place_bombs(row, column)
                     self.init = True
+                before = cell_key(self.zobrist, self.grid[row][column])
                 self.grid[row][column].is_visible = True
                 self.grid[row][column].has_flag = False
+                self.state_hash ^= before ^ cell_key(self.zobrist, self.grid[row][column])
                 if self.grid[row][column].has_bomb:
                     self.game_over()
                     self.game_lost = True
                 if self.grid[row][column].bomb_count == 0 and not self.grid[row][column].has_bomb:
-                    self.grid[row][column].open_neighbours(self.squares_y, self.squares_x)
+                    opened = []
+                    self.grid[row][column].open_neighbours(self.squares_y, self.squares_x, self.grid, opened)
+                    self.hash_opened(opened)
                 self.check_victory()
             else:
                 self.game_lost = False
@@ -155,8 +190,10 @@ class Game:
             if not self.grid[row][column].has_flag:
                 if self.flag_count < self.num_bombs and not self.grid[row][column].is_visible:
                     self.grid[row][column].has_flag = True
+                    self.state_hash ^= self.zobrist[row][column][FLAG]
             else:
                 self.grid[row][column].has_flag = False
+                self.state_hash ^= self.zobrist[row][column][FLAG]
             self.count_flags()
 
     class Cell:
@@ -179,7 +216,7 @@ class Game:
                 screen.blit(self.text, (self.x * (WIDTH + MARGIN) + 12,
                                         self.y * (HEIGHT + MARGIN) + 10 + MENU_SIZE))
 
-        def count_bombs(self, max_rows, max_cols):
+        def count_bombs(self, max_rows, max_cols, grid):
             if not self.test:
                 self.test = True
                 if not self.has_bomb:
@@ -188,10 +225,10 @@ class Game:
                             if (row >= 0 and row < max_rows and
                                 col >= 0 and col < max_cols and
                                 not (col == self.x and row == self.y) and
-                                game.grid[row][col].has_bomb):
+                                grid[row][col].has_bomb):
                                 self.bomb_count += 1
 
-        def open_neighbours(self, max_rows, max_cols):
+        def open_neighbours(self, max_rows, max_cols, grid, opened=None):
             col = self.x
             row = self.y
             for row_off in range(-1, 2):
@@ -199,13 +236,15 @@ class Game:
                     if ((row_off == 0 or col_off == 0) and row_off != col_off and
                         row + row_off >= 0 and col + col_off >= 0 and
                         row + row_off < max_rows and col + col_off < max_cols):
-                        game.grid[row + row_off][col + col_off].count_bombs(game.squares_y, game.squares_x)
-                        if (not game.grid[row + row_off][col + col_off].is_visible and
-                            not game.grid[row + row_off][col + col_off].has_bomb):
-                            game.grid[row + row_off][col + col_off].is_visible = True
-                            game.grid[row + row_off][col + col_off].has_flag = False
-                            if game.grid[row + row_off][col + col_off].bomb_count == 0:
-                                game.grid[row + row_off][col + col_off].open_neighbours(game.squares_y, game.squares_x)
+                        grid[row + row_off][col + col_off].count_bombs(max_rows, max_cols, grid)
+                        if (not grid[row + row_off][col + col_off].is_visible and
+                            not grid[row + row_off][col + col_off].has_bomb):
+                            if opened is not None:
+                                opened.append((grid[row + row_off][col + col_off], grid[row + row_off][col + col_off].has_flag))
+                            grid[row + row_off][col + col_off].is_visible = True
+                            grid[row + row_off][col + col_off].has_flag = False
+                            if grid[row + row_off][col + col_off].bomb_count == 0:
+                                grid[row + row_off][col + col_off].open_neighbours(max_rows, max_cols, grid, opened)
 
 class Menu:
     def __init__(self):
@@ -349,7 +388,78 @@ def get_cluster_constraints(cluster, constraints):
             cluster_constraints[clue] = (req, inter)
     return cluster_constraints
 
-def dp_cluster_solver_dp(cluster, constraints):
+def dp_enumerate_component(k, rows):
+    """Memoised count of one component of a ReducedCluster. The state after the
+    first i free cells is just each row's partial sum, so assignments that reach
+    the same sums share the count of everything after them"""
+    touching = [[] for _ in range(k)]
+    rem_lo = []
+    rem_hi = []
+    for r, (_, _, terms) in enumerate(rows):
+        coef = dict(terms)
+        lo = [0] * (k + 1)
+        hi = [0] * (k + 1)
+        for i in range(k - 1, -1, -1):
+            a = coef.get(i, 0)
+            lo[i] = lo[i + 1] + min(a, 0)
+            hi[i] = hi[i + 1] + max(a, 0)
+            if a:
+                touching[i].append((r, a))
+        rem_lo.append(lo)
+        rem_hi.append(hi)
+    no_pivots = (0,) * len(rows)
+
+    def feasible(i, sums, touched):
+        # the pivot of a row, (rhs - sum) / scale, can still come out 0 or 1
+        for r, _ in touched:
+            scale, rhs, _ = rows[r]
+            if not any(rhs - sums[r] - rem_hi[r][i] <= v <= rhs - sums[r] - rem_lo[r][i] for v in (0, scale)):
+                return False
+        return True
+
+    @lru_cache(maxsize=None)
+    def dp(i, sums):
+        if i == k:
+            pivots = []
+            for (scale, rhs, _), s in zip(rows, sums):
+                if rhs - s != 0 and rhs - s != scale:
+                    return (0, (), no_pivots)
+                pivots.append(1 if rhs - s else 0)
+            return (1, (), tuple(pivots))
+
+        total = 0
+        free_counts = [0] * (k - i)
+        pivot_counts = [0] * len(rows)
+        for val in (0, 1):
+            new_sums = list(sums)
+            if val:
+                for r, a in touching[i]:
+                    new_sums[r] += a
+            if not feasible(i + 1, new_sums, touching[i]):
+                continue
+            count, sub_free, sub_pivots = dp(i + 1, tuple(new_sums))
+            total += count
+            free_counts[0] += val * count
+            for j, m in enumerate(sub_free):
+                free_counts[j + 1] += m
+            for r, m in enumerate(sub_pivots):
+                pivot_counts[r] += m
+        return (total, tuple(free_counts), tuple(pivot_counts))
+
+    total, free_counts, pivot_counts = dp(0, no_pivots)
+    if memprofile.profiling():
+        # every entry holds a key of row sums and tuples of free and pivot counts
+        entries = dp.cache_info().currsize
+        memprofile.record_cache('dp_lru', entries,
+                                entries * (2 * sys.getsizeof(no_pivots) + sys.getsizeof((0,) * k)))
+    return total, free_counts, pivot_counts
+
+def dp_cluster_solver_dp(cluster, constraints, reduce=True):
+    if reduce:
+        system = reduce_cluster(cluster, constraints)
+        if system is None:
+            return {cell: 1.0 for cell in cluster}
+        return system.probabilities(dp_enumerate_component)
     n = len(cluster)
     index_map = {cell: i for i, cell in enumerate(cluster)}
     constraints_list = []
@@ -397,6 +507,10 @@ def dp_cluster_solver_dp(cluster, constraints):
     
     initial_assignment = (-1,) * n
     total_valid, bomb_counts = dp(0, initial_assignment)
+    if memprofile.profiling():
+        # every entry holds an n-tuple key and an n-tuple of counts
+        entries = dp.cache_info().currsize
+        memprofile.record_cache('dp_lru', entries, entries * 2 * sys.getsizeof(initial_assignment))
     probabilities = {}
     if total_valid > 0:
         for i, cell in enumerate(cluster):
@@ -406,54 +520,36 @@ def dp_cluster_solver_dp(cluster, constraints):
             probabilities[cell] = 1.0
     return probabilities
 
-def dp_solver(game):
+def dp_solver(game, stats=None, reduce=True):
+    from opening_book import opening_move, second_move
     if not game.init:
+        move = opening_move(game)
+        if move is not None:
+            return move
         for r in range(game.squares_y):
             for c in range(game.squares_x):
                 if not game.grid[r][c].is_visible:
                     return (r, c)
-    frontier = get_frontier_cells(game)
-    constraints = get_constraints(game, frontier)
-    clusters = group_frontier_by_constraints(frontier, constraints)
-    
-    probabilities = {}
-    for cluster in clusters:
-        cluster_constraints = get_cluster_constraints(cluster, constraints)
-        cluster_probs = dp_cluster_solver_dp(cluster, cluster_constraints)
-        probabilities.update(cluster_probs)
-    
-    remaining_unrevealed = []
-    for r in range(game.squares_y):
-        for c in range(game.squares_x):
-            if not game.grid[r][c].is_visible and not game.grid[r][c].has_flag:
-                if (r, c) not in probabilities:
-                    remaining_unrevealed.append((r, c))
-    flagged_count = sum(1 for r in range(game.squares_y) for c in range(game.squares_x) if game.grid[r][c].has_flag)
-    total_unrevealed = sum(1 for r in range(game.squares_y) for c in range(game.squares_x)
-                           if not game.grid[r][c].is_visible and not game.grid[r][c].has_flag)
-    if total_unrevealed > 0:
-        default_prob = (game.num_bombs - flagged_count) / total_unrevealed
+    if reduce:
+        best_cell, prob = safest_cell(game, stats, dp_cluster_solver_dp) or (None, 1.0)
     else:
-        default_prob = 1.0
-    for cell in remaining_unrevealed:
-        probabilities[cell] = default_prob
-    
-    best_cell = min(probabilities, key=probabilities.get)
+        matrix = probability_matrix(game, dp_cluster_solver_dp, reduce, stats)
+        best_cell = matrix.safest()
+        prob = matrix.get(best_cell) if best_cell is not None else 1.0
+    if best_cell is not None and prob > 0.0:
+        move = second_move(game, prob)
+        if move is not None:
+            return move
+        from endgame import endgame_move
+        move = endgame_move(game)
+        if move is not None:
+            return move
     return best_cell
 
-pygame.init()
-size = (NSQUARES_X * (WIDTH + MARGIN) + MARGIN,
-        (NSQUARES_Y * (HEIGHT + MARGIN) + MARGIN) + MENU_SIZE)
-screen = pygame.display.set_mode(size, pygame.RESIZABLE)
-pygame.display.set_caption("Minesweeper  - Intermediate Level")
-font = pygame.font.Font('freesansbold.ttf', 24)
-game = Game()
-menu = Menu()
-clock = pygame.time.Clock()
-
 auto_solve = True
 last_auto_move_time = 0
 auto_move_delay = 500
+move_log = None
 
 def run_game():
     global auto_solve, last_auto_move_time
@@ -471,7 +567,10 @@ def run_game():
                 if column >= game.squares_x:
                     column = game.squares_x - 1
                 if row >= 0:
-                    game.click_handle(row, column, event.button)
+                    if move_log is not None:
+                        move_log.click(game, row, column, event.button)
+                    else:
+                        game.click_handle(row, column, event.button)
                 else:
                     menu.click_handle(game)
             elif event.type == pygame.VIDEORESIZE:
@@ -489,10 +588,14 @@ def run_game():
         
         current_time = pygame.time.get_ticks()
         if auto_solve and current_time - last_auto_move_time > auto_move_delay and not game.game_lost and not game.game_won:
+            start = time.perf_counter()
             best_move = dp_solver(game)
             if best_move is not None:
                 row, column = best_move
-                game.click_handle(row, column, LEFT_CLICK)
+                if move_log is not None:
+                    move_log.click(game, row, column, LEFT_CLICK, time.perf_counter() - start)
+                else:
+                    game.click_handle(row, column, LEFT_CLICK)
                 last_auto_move_time = current_time
         
         game.draw()
@@ -500,9 +603,59 @@ def run_game():
         clock.tick(60)
         pygame.display.flip()
 
-def test_win_rate(num_games=100):
-    global game
-    
+def exploration_rate(game):
+    total_non_mine_tiles = game.squares_x * game.squares_y - game.num_bombs
+    revealed_non_mine_tiles = 0
+    for row in range(game.squares_y):
+        for column in range(game.squares_x):
+            if game.grid[row][column].is_visible and not game.grid[row][column].has_bomb:
+                revealed_non_mine_tiles += 1
+    return (revealed_non_mine_tiles / total_non_mine_tiles) * 100
+
+def play_game(config, seed=None, log=None):
+    """Play one game with dp_solver and return its per-game record. With a
+    movelog.MoveLog the game is appended to it"""
+    if seed is not None:
+        random.seed(seed)
+    if log is not None:
+        log.start(seed)
+    stats = {}
+    move_times = []
+    game = Game(config)
+    while not game.game_won and not game.game_lost:
+        start = time.perf_counter()
+        best_move = dp_solver(game, stats)
+        move_times.append(time.perf_counter() - start)
+        if best_move is None:
+            break
+        row, column = best_move
+        game.click_handle(row, column, LEFT_CLICK)
+        if log is not None:
+            log.move(game, row, column, LEFT_CLICK, move_times[-1])
+    if log is not None:
+        log.finish(game)
+    return {
+        "seed": seed,
+        "won": game.game_won,
+        "exploration": exploration_rate(game),
+        "moves": len(move_times),
+        "move_times": move_times,
+        "max_cluster": stats.get('max_cluster', 0)
+    }
+
+def test_win_rate(num_games=100, config=None, log_path=None, run_id=None):
+    if config is None:
+        config = BoardConfig(NSQUARES_X, NSQUARES_Y, EXPERT_BOMBS, "none")
+    log = MoveLog(log_path) if log_path else None
+    store = None
+    done = set()
+    if run_id is not None:
+        store = ResultStore(run_id, {"solver": "dp", "width": config.width, "height": config.height,
+                                     "mines": config.mines, "first_click": config.first_click})
+        done = store.completed_seeds()
+        if done:
+            print(f"Resuming run {run_id}: {len(done)} games already done")
+
     import os
     os.environ['SDL_VIDEODRIVER'] = 'dummy'
     
@@ -516,33 +669,16 @@ def test_win_rate(num_games=100):
     total_exploration_rate = 0
     start_time = time.time()
     
-    num_mines = EXPERT_BOMBS
-    
     for i in range(num_games):
-
-        game = Game()
-        
-        while not game.game_won and not game.game_lost:
- 
-            best_move = dp_solver(game)
-            if best_move is not None:
-                row, column = best_move
-                game.click_handle(row, column, LEFT_CLICK)
-            else:
-                break
-        
-        total_non_mine_tiles = game.squares_x * game.squares_y - game.num_bombs
-        revealed_non_mine_tiles = 0
-        
-        for row in range(game.squares_y):
-            for column in range(game.squares_x):
-                if game.grid[row][column].is_visible and not game.grid[row][column].has_bomb:
-                    revealed_non_mine_tiles += 1
-        
-        exploration_rate = (revealed_non_mine_tiles / total_non_mine_tiles) * 100
-        total_exploration_rate += exploration_rate
+        seed = i if store is not None else None
+        if seed in done:
+            continue
+        record = play_game(config, seed, log=log)
+        if store is not None:
+            store.append(game_record(record))
+        total_exploration_rate += record["exploration"]
         
-        if game.game_won:
+        if record["won"]:
             wins += 1
         else:
             losses += 1
@@ -551,13 +687,20 @@ def test_win_rate(num_games=100):
             print(f"Progress: {i + 1}/{num_games} games played")
     
     elapsed_time = time.time() - start_time
+    if log is not None:
+        log.close()
+    if store is not None:
+        summary = store.summary(set(range(num_games)))
+        wins, losses = summary["wins"], summary["losses"]
+        total_exploration_rate = summary["avg_exploration"] * num_games
+        elapsed_time = summary["time_taken"]
     win_rate = (wins / num_games) * 100
     avg_exploration_rate = total_exploration_rate / num_games
     
     print("\n----- RESULTS -----")
     print(f"Games played: {num_games}")
-    print(f"Number of mines: {num_mines}")
-    print(f"Grid size: {NSQUARES_X}x{NSQUARES_Y}")
+    print(f"Number of mines: {config.mines}")
+    print(f"Grid size: {config.width}x{config.height}")
     print(f"Wins: {wins}")
     print(f"Losses: {losses}")
     print(f"Win rate: {win_rate:.2f}%")
@@ -577,14 +720,14 @@ if __name__ == "__main__":
             except ValueError:
                 print("Invalid number of games. Using default 100.")
         
-        pygame.init()
-        font = pygame.font.Font('freesansbold.ttf', 24)
-        game = Game()
-        menu = Menu()
-        win_rate = test_win_rate(num_games)
-        pygame.quit()
+        log_path = sys.argv[sys.argv.index("--log") + 1] if "--log" in sys.argv else None
+        run_id = sys.argv[sys.argv.index("--run-id") + 1] if "--run-id" in sys.argv else None
+        if "--parallel" in sys.argv:
+            cluster_pool.enable(int(sys.argv[sys.argv.index("--parallel") + 1]))
+        win_rate = test_win_rate(num_games, log_path=log_path, run_id=run_id)
         sys.exit()
     else:
+        move_log = log_from_argv()
         pygame.init()
         size = (NSQUARES_X * (WIDTH + MARGIN) + MARGIN,
                 (NSQUARES_Y * (HEIGHT + MARGIN) + MARGIN) + MENU_SIZE)
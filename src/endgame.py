@@ -0,0 +1,175 @@
+from itertools import combinations
+from CSP_solver import get_neighbors
+from sampler import PosteriorSampler
+
+MAX_HIDDEN = 24
+MAX_LAYOUTS = 400
+NODE_BUDGET = 5000
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def enumerate_layouts(sampler, limit):
+    """Every consistent layout as a set of flat board indices of hidden mines, or
+    None when there are more than limit of them"""
+    if not sampler.exact or sampler.layout_count() > limit:
+        return None
+    layouts = []
+    units = sampler.units
+    fixed = set(int(i) for i in sampler.fixed)
+    interior = [int(i) for i in sampler.interior]
+
+    def place(j, mines, used):
+        if j == len(units):
+            need = sampler.free_mines - used
+            if 0 <= need <= len(interior):
+                for extra in combinations(interior, need):
+                    layouts.append(mines | set(extra))
+            return
+        cells, table, counts = units[j]
+        for row, k in zip(table, counts):
+            place(j + 1, mines | set(int(c) for c, m in zip(cells, row) if m), used + int(k))
+
+    place(0, fixed, 0)
+    return layouts
+
+
+class Endgame:
+    """Exact win-probability search for the last few hidden cells. A state is the
+    set of cells opened so far plus the layouts still consistent with what they
+    showed; both are bitmasks (over hidden cells and over layouts), so a state
+    hashes as a pair of ints. Opening a cell splits the layouts by the outcome
+    the game would show, flood fill through orthogonal zeros included"""
+
+    def __init__(self, game, layouts, node_budget=NODE_BUDGET):
+        self.width = game.squares_x
+        self.hidden = [r * self.width + c for r in range(game.squares_y) for c in range(self.width)
+                       if not game.grid[r][c].is_visible and not game.grid[r][c].has_flag]
+        index = {cell: i for i, cell in enumerate(self.hidden)}
+        self.layouts = layouts
+        self.node_budget = node_budget
+        self.nodes = 0
+        self.memo = {}
+
+        n = len(self.hidden)
+        self.mine_mask = []
+        self.safe_mask = []
+        for mines in layouts:
+            mask = sum(1 << index[cell] for cell in mines if cell in index)
+            self.mine_mask.append(mask)
+            self.safe_mask.append(((1 << n) - 1) & ~mask)
+        # clue shown by each hidden cell in each layout, and its hidden orthogonal neighbours
+        flagged = set(r * self.width + c for r in range(game.squares_y) for c in range(self.width)
+                      if game.grid[r][c].has_flag)
+        self.clue = []
+        for mines in layouts:
+            all_mines = mines | flagged
+            self.clue.append([sum(1 for nr, nc in get_neighbors(cell // self.width, cell % self.width,
+                                                                 game.squares_y, self.width)
+                                  if nr * self.width + nc in all_mines)
+                              for cell in self.hidden])
+        self.orthogonal = []
+        for cell in self.hidden:
+            r, c = divmod(cell, self.width)
+            self.orthogonal.append([index[nr * self.width + nc]
+                                    for nr, nc in ((r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1))
+                                    if 0 <= nr < game.squares_y and 0 <= nc < self.width
+                                    and nr * self.width + nc in index])
+
+    def _open(self, i, layout, revealed):
+        """Cells newly opened by clicking hidden cell i in a layout where it is safe"""
+        clue = self.clue[layout]
+        mines = self.mine_mask[layout]
+        opened = 1 << i
+        stack = [i] if clue[i] == 0 else []
+        while stack:
+            j = stack.pop()
+            for k in self.orthogonal[j]:
+                bit = 1 << k
+                if not (revealed | opened) & bit and not mines & bit:
+                    opened |= bit
+                    if clue[k] == 0:
+                        stack.append(k)
+        return opened
+
+    def value(self, revealed, live):
+        """Win probability with optimal play from a state, live being the layout bitmask"""
+        key = (revealed, live)
+        if key in self.memo:
+            return self.memo[key]
+        self.nodes += 1
+        if self.nodes > self.node_budget:
+            raise BudgetExceeded()
+        ids = [l for l in range(len(self.layouts)) if live >> l & 1]
+        done = [l for l in ids if self.safe_mask[l] & ~revealed == 0]
+        if done:
+            rest = live
+            for l in done:
+                rest &= ~(1 << l)
+            result = len(done) / len(ids)
+            if rest:
+                result += (len(ids) - len(done)) / len(ids) * self.value(revealed, rest)
+        else:
+            result = self.best_move(revealed, ids)[1]
+        self.memo[key] = result
+        return result
+
+    def best_move(self, revealed, ids):
+        candidates = []
+        for i in range(len(self.hidden)):
+            if revealed >> i & 1:
+                continue
+            safe = [l for l in ids if not self.mine_mask[l] >> i & 1]
+            if safe:
+                candidates.append((len(safe), i, safe))
+        # P(safe) bounds the win probability of a move, so try the safest first
+        candidates.sort(key=lambda x: -x[0])
+        best, best_value = None, -1.0
+        for n_safe, i, safe in candidates:
+            if n_safe / len(ids) <= best_value:
+                break
+            outcomes = {}
+            for l in safe:
+                opened = self._open(i, l, revealed)
+                clues = tuple(self.clue[l][k] for k in range(len(self.hidden)) if opened >> k & 1)
+                child = outcomes.setdefault((opened, clues), [opened, 0])
+                child[1] |= 1 << l
+            total = sum(bin(live).count("1") * self.value(revealed | opened, live)
+                        for opened, live in outcomes.values()) / len(ids)
+            if total > best_value:
+                best, best_value = i, total
+            if n_safe == len(ids) or best_value >= 1.0:
+                # opening a certainly safe cell never loses information
+                break
+        return best, best_value
+
+    def solve(self):
+        """(cell, win probability) of the best opening move from the current position"""
+        i, prob = self.best_move(0, list(range(len(self.layouts))))
+        if i is None:
+            return None
+        return divmod(self.hidden[i], self.width), prob
+
+
+def solve_endgame(game, max_hidden=MAX_HIDDEN, max_layouts=MAX_LAYOUTS, node_budget=NODE_BUDGET):
+    """(cell, win probability) when the position is small enough for an exact
+    search that finishes within node_budget states, otherwise None"""
+    hidden = sum(1 for row in game.grid for cell in row if not cell.is_visible and not cell.has_flag)
+    if not game.init or hidden == 0 or hidden > max_hidden:
+        return None
+    try:
+        layouts = enumerate_layouts(PosteriorSampler(game), max_layouts)
+    except ValueError:
+        return None
+    if not layouts:
+        return None
+    try:
+        return Endgame(game, layouts, node_budget).solve()
+    except BudgetExceeded:
+        return None
+
+def endgame_move(game, **limits):
+    result = solve_endgame(game, **limits)
+    return None if result is None else result[0]
@@ -0,0 +1,230 @@
+import fcntl
+import heapq
+import os
+from contextlib import contextmanager, nullcontext
+import numpy as np
+from state_codes import encode_states, decode_states, encode_action, decode_action
+
+# One row per step. Actions are stored as cell indices row * width + col
+COLUMNS = (
+    ("states", np.int64),
+    ("actions", np.int32),
+    ("rewards", np.float64),
+    ("episodes", np.int64),
+    ("done", np.bool_),
+)
+# File header: magic, capacity, width, next row, rows filled, episodes started,
+# rows ever written
+MAGIC = 0x4D5345585032  # "MSEXP2"
+HEADER = 7
+_NEXT, _SIZE, _EPISODES, _WRITTEN = 3, 4, 5, 6
+
+
+def _layout(capacity):
+    """Byte offset of every column in a buffer file, each 8-byte aligned"""
+    offsets = {}
+    offset = HEADER * 8
+    for name, dtype in COLUMNS:
+        offsets[name] = offset
+        offset += -(-capacity * np.dtype(dtype).itemsize // 8) * 8
+    return offsets, offset
+
+
+class ExperienceBuffer:
+    """Fixed-capacity ring buffer of Monte Carlo steps kept in preallocated
+    NumPy columns, so memory use is known up front and old experience is
+    overwritten once it is full. With a path the columns are a memory-mapped
+    file that several worker processes can open and append to; each append
+    takes an flock on the file to reserve its rows"""
+
+    def __init__(self, capacity, width, path=None):
+        self.path = path
+        if path is None:
+            self.header = np.zeros(HEADER, dtype=np.int64)
+            self.header[:3] = MAGIC, capacity, width
+            self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in COLUMNS}
+            self._fd = None
+        else:
+            offsets, total = _layout(capacity)
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            with self._locked():
+                if os.fstat(self._fd).st_size == 0:
+                    os.ftruncate(self._fd, total)
+                    header = np.memmap(path, dtype=np.int64, mode="r+", shape=(HEADER,))
+                    header[:3] = MAGIC, capacity, width
+                    header.flush()
+                self.header = np.memmap(path, dtype=np.int64, mode="r+", shape=(HEADER,))
+            found = self.header[:3].tolist()
+            if found != [MAGIC, capacity, width]:
+                os.close(self._fd)
+                raise ValueError(f"{path} is not an experience buffer of capacity {capacity} "
+                                 f"for width {width} (header {found})")
+            self.columns = {name: np.memmap(path, dtype=dtype, mode="r+", offset=offsets[name], shape=(capacity,))
+                            for name, dtype in COLUMNS}
+        self.capacity = capacity
+        self.width = width
+        # episode index kept up to date from the rows written since the last
+        # look: finished episodes, unfinished ones, ids that lost rows, and a
+        # heap of (number of the first row written, id) to find lost ones
+        self._index = {}
+        self._open = {}
+        self._lost = set()
+        self._firsts = []
+        self._synced = None
+
+    @contextmanager
+    def _locked(self):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _lock(self):
+        return self._locked() if self._fd is not None else nullcontext()
+
+    def __len__(self):
+        return int(self.header[_SIZE])
+
+    def _reserve(self, rows):
+        """First row index and episode id for the next `rows` rows; the caller holds the lock"""
+        start = int(self.header[_NEXT])
+        episode = int(self.header[_EPISODES])
+        self.header[_NEXT] = (start + rows) % self.capacity
+        self.header[_SIZE] = min(int(self.header[_SIZE]) + rows, self.capacity)
+        self.header[_WRITTEN] += rows
+        self.header[_EPISODES] = episode + 1
+        return start, episode
+
+    def append(self, state, action, reward, episode, done=False):
+        """Add a single step to an episode id from new_episode()"""
+        with self._lock():
+            start = int(self.header[_NEXT])
+            self.header[_NEXT] = (start + 1) % self.capacity
+            self.header[_SIZE] = min(int(self.header[_SIZE]) + 1, self.capacity)
+            self.header[_WRITTEN] += 1
+            row = self.columns
+            row["states"][start] = encode_states([state])[0]
+            row["actions"][start] = encode_action(action, self.width)
+            row["rewards"][start] = reward
+            row["episodes"][start] = episode
+            row["done"][start] = done
+
+    def new_episode(self):
+        """Fresh episode id, unique across every process sharing the file"""
+        with self._lock():
+            episode = int(self.header[_EPISODES])
+            self.header[_EPISODES] = episode + 1
+            return episode
+
+    def add_episode(self, history):
+        """Store a whole generate_episode history [(local_state, action, reward)]
+        in contiguous rows; returns its episode id"""
+        if not history:
+            return None
+        if len(history) > self.capacity:
+            raise ValueError(f"episode of {len(history)} steps does not fit a buffer of {self.capacity}")
+        states, actions, rewards = zip(*history)
+        states = encode_states(states)
+        actions = np.array([encode_action(action, self.width) for action in actions], dtype=np.int32)
+        with self._lock():
+            start, episode = self._reserve(len(history))
+            rows = (start + np.arange(len(history))) % self.capacity
+            self.columns["states"][rows] = states
+            self.columns["actions"][rows] = actions
+            self.columns["rewards"][rows] = rewards
+            self.columns["episodes"][rows] = episode
+            self.columns["done"][rows] = False
+            self.columns["done"][rows[-1]] = True
+        return episode
+
+    def sample(self, n, rng=None):
+        """n steps drawn uniformly with replacement, as a dict of column arrays"""
+        rng = rng or np.random.default_rng()
+        rows = rng.integers(0, len(self), size=n)
+        return {name: column[rows] for name, column in self.columns.items()}
+
+    def _sync(self):
+        """Bring the episode index up to date with the header, reading only the
+        rows written since the last call, whichever process wrote them"""
+        size, total = int(self.header[_SIZE]), int(self.header[_WRITTEN])
+        if total == self._synced:
+            return
+        rebuild = self._synced is None or total - self._synced >= self.capacity
+        if rebuild:
+            # first look, or every row replaced since the last one: start over,
+            # remembering that unfinished episodes have lost their first steps
+            self._lost |= set(self._open)
+            self._index, self._open, self._firsts = {}, {}, []
+            written = size
+        else:
+            written = total - self._synced
+        # row number k of all rows ever written is gone once total passes
+        # k + capacity; an episode lost steps when its first row went
+        while self._firsts and self._firsts[0][0] < total - self.capacity:
+            _, episode = heapq.heappop(self._firsts)
+            self._index.pop(episode, None)
+            if self._open.pop(episode, None) is not None:
+                # must not come back as complete when its last steps arrive
+                self._lost.add(episode)
+        rows = (int(self.header[_NEXT]) - written + np.arange(written)) % self.capacity
+        episodes = self.columns["episodes"][rows]
+        done = self.columns["done"][rows]
+        if rebuild and total > size and written:
+            # the oldest episode may have lost its first steps
+            self._lost.add(int(episodes[0]))
+        # single-step appends from several processes interleave, so group by id
+        grouped = np.argsort(episodes, kind="stable")
+        starts = np.flatnonzero(np.r_[True, episodes[grouped][1:] != episodes[grouped][:-1]]) if written else []
+        for s, e in zip(starts, np.r_[starts[1:], written].astype(np.int64)):
+            steps = grouped[s:e]
+            episode = int(episodes[steps[0]])
+            if episode in self._lost:
+                continue
+            if episode in self._open:
+                steps = np.r_[self._open.pop(episode), rows[steps]]
+            else:
+                heapq.heappush(self._firsts, (total - written + int(steps[0]), episode))
+                steps = rows[steps]
+            if done[grouped[s:e]].any():
+                self._index[episode] = steps
+            else:
+                self._open[episode] = steps
+        self._synced = total
+
+    def complete_episodes(self):
+        """{episode id: rows in step order} for every stored episode that has
+        finished and has not been partly overwritten"""
+        with self._lock():
+            self._sync()
+        return dict(self._index)
+
+    def sample_episodes(self, n, rng=None):
+        """n complete episodes drawn without replacement, as generate_episode
+        style histories ready for MonteCarloSolver.update_q_values_batch"""
+        rng = rng or np.random.default_rng()
+        with self._lock():
+            self._sync()
+        episodes = self._index
+        if not episodes:
+            return []
+        ids = rng.choice(sorted(episodes), size=min(n, len(episodes)), replace=False)
+        histories = []
+        for episode in ids:
+            rows = episodes[int(episode)]
+            states = decode_states(self.columns["states"][rows])
+            actions = [decode_action(code, self.width) for code in self.columns["actions"][rows]]
+            histories.append(list(zip(states, actions, self.columns["rewards"][rows].tolist())))
+        return histories
+
+    def flush(self):
+        if self._fd is not None:
+            self.header.flush()
+            for column in self.columns.values():
+                column.flush()
+
+    def close(self):
+        if self._fd is not None:
+            self.flush()
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,318 @@
+from math import gcd
+
+
+def build_clue_matrix(cluster, cluster_constraints):
+    """One row per clue, one 0/1 column per cluster cell"""
+    index_map = {cell: i for i, cell in enumerate(cluster)}
+    matrix = []
+    rhs = []
+    for clue, (req, cells) in cluster_constraints.items():
+        row = [0] * len(cluster)
+        for cell in cells:
+            if cell in index_map:
+                row[index_map[cell]] = 1
+        matrix.append(row)
+        rhs.append(req)
+    return matrix, rhs
+
+def row_reduce(matrix, rhs):
+    """Reduced row echelon form kept in integers: each pivot column is zero outside
+    its own row, pivots are positive and rows are divided through by their gcd.
+    Returns (rows, pivot columns), or None if the system is inconsistent"""
+    rows = [list(row) + [b] for row, b in zip(matrix, rhs)]
+    n = len(matrix[0]) if matrix else 0
+    pivots = []
+    r = 0
+    for col in range(n):
+        if r == len(rows):
+            break
+        pivot = None
+        for i in range(r, len(rows)):
+            if rows[i][col] != 0:
+                pivot = i
+                break
+        if pivot is None:
+            continue
+        rows[r], rows[pivot] = rows[pivot], rows[r]
+        if rows[r][col] < 0:
+            rows[r] = [-v for v in rows[r]]
+        pv = rows[r][col]
+        for i in range(len(rows)):
+            if i != r and rows[i][col] != 0:
+                factor = rows[i][col]
+                row = [a * pv - factor * b for a, b in zip(rows[i], rows[r])]
+                g = gcd(*row)
+                rows[i] = [v // g for v in row] if g > 1 else row
+        pivots.append(col)
+        r += 1
+    for row in rows[r:]:
+        if row[-1] != 0:
+            return None
+    return rows[:r], pivots
+
+def forced_by_bounds(rows):
+    """Cells whose value is fixed because a row sits on its min or max over 0/1 values.
+    Returns a dict col -> value, or None if some row can never be satisfied"""
+    forced = {}
+    for row in rows:
+        b = row[-1]
+        lo = sum(a for a in row[:-1] if a < 0)
+        hi = sum(a for a in row[:-1] if a > 0)
+        if b < lo or b > hi:
+            return None
+        if b == lo or b == hi:
+            for col, a in enumerate(row[:-1]):
+                if a == 0:
+                    continue
+                val = 1 if (a > 0) == (b == hi) else 0
+                if forced.get(col, val) != val:
+                    return None
+                forced[col] = val
+    return forced
+
+
+class _Pruned(Exception):
+    pass
+
+
+class ReducedCluster:
+    def __init__(self, cluster, forced, free, pivot_rows):
+        self.cluster = cluster
+        self.forced = forced
+        self.free = free
+        # (pivot index, scale, rhs, [(free position, coefficient), ...]) with
+        # scale * x_pivot = rhs - sum(coefficient * x_free), all integers
+        self.pivot_rows = pivot_rows
+
+    def components(self):
+        """Split the free cells into groups that share no pivot row; each group
+        can be enumerated on its own. Returns (free positions, row ids) pairs"""
+        parent = list(range(len(self.free)))
+
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        for _, _, _, terms in self.pivot_rows:
+            for pos, _ in terms[1:]:
+                parent[find(pos)] = find(terms[0][0])
+        groups = {}
+        for pos in range(len(self.free)):
+            groups.setdefault(find(pos), ([], []))[0].append(pos)
+        for r, (_, _, _, terms) in enumerate(self.pivot_rows):
+            groups[find(terms[0][0])][1].append(r)
+        return list(groups.values())
+
+    def _order(self, positions, row_ids):
+        # most constrained free cell first, then whichever shares the most rows
+        # with the cells already placed, so pivot rows close early in the search
+        rows_of = {pos: set() for pos in positions}
+        for r in row_ids:
+            for pos, _ in self.pivot_rows[r][3]:
+                rows_of[pos].add(r)
+        order = []
+        touched = set()
+        remaining = set(positions)
+        while remaining:
+            best = max(remaining, key=lambda p: (len(rows_of[p] & touched), len(rows_of[p]), -p))
+            order.append(best)
+            touched |= rows_of[best]
+            remaining.remove(best)
+        return order
+
+    def search(self, on_solution, positions=None, row_ids=None):
+        """Enumerate the free assignments (2^len(positions) at most), deriving every
+        pivot cell of row_ids. on_solution receives the 0/1 assignment list in
+        cluster order, with -1 for cells outside the searched component"""
+        if positions is None:
+            positions = list(range(len(self.free)))
+            row_ids = list(range(len(self.pivot_rows)))
+        order = self._order(positions, row_ids)
+        k = len(order)
+        depth_of = {pos: d for d, pos in enumerate(order)}
+        assignment = [-1] * len(self.cluster)
+        for idx, val in self.forced.items():
+            assignment[idx] = val
+
+        rows = [self.pivot_rows[r] for r in row_ids]
+        rows_by_depth = [[] for _ in range(k)]
+        rem_lo = []
+        rem_hi = []
+        for r, (_, _, _, terms) in enumerate(rows):
+            lo = [0] * (k + 1)
+            hi = [0] * (k + 1)
+            coef = {depth_of[pos]: a for pos, a in terms}
+            for d in range(k - 1, -1, -1):
+                a = coef.get(d, 0)
+                lo[d] = lo[d + 1] + min(a, 0)
+                hi[d] = hi[d + 1] + max(a, 0)
+                if a:
+                    rows_by_depth[d].append((r, a))
+            rem_lo.append(lo)
+            rem_hi.append(hi)
+        partial = [0] * len(rows)
+
+        def feasible(depth, touched):
+            for r, _ in touched:
+                _, scale, rhs, _ = rows[r]
+                if rhs - partial[r] - rem_lo[r][depth] < 0:
+                    return False
+                if rhs - partial[r] - rem_hi[r][depth] > scale:
+                    return False
+            return True
+
+        def dfs(depth):
+            if depth == k:
+                for r, (pivot, scale, rhs, _) in enumerate(rows):
+                    val = rhs - partial[r]
+                    if val == 0:
+                        assignment[pivot] = 0
+                    elif val == scale:
+                        assignment[pivot] = 1
+                    else:
+                        return
+                on_solution(assignment)
+                return
+            idx = self.free[order[depth]]
+            touched = rows_by_depth[depth]
+            for val in (0, 1):
+                assignment[idx] = val
+                if val:
+                    for r, a in touched:
+                        partial[r] += a
+                if feasible(depth + 1, touched):
+                    dfs(depth + 1)
+                if val:
+                    for r, a in touched:
+                        partial[r] -= a
+            assignment[idx] = -1
+
+        dfs(0)
+
+    def count(self, enumerate_component=None):
+        """Number of solutions and per-cell mine counts, in cluster order. Each
+        independent component is enumerated separately and the counts multiplied.
+        enumerate_component(k, rows), if given, counts one component in place of
+        search: rows are (scale, rhs, [(free cell, coefficient), ...]) over free
+        cells 0..k-1 taken in search order, and it returns (solutions, mines per
+        free cell, mines per row's pivot cell)"""
+        n = len(self.cluster)
+        parts = []
+        for positions, row_ids in self.components():
+            positions = self._order(positions, row_ids)
+            members = [self.free[pos] for pos in positions] + [self.pivot_rows[r][0] for r in row_ids]
+            if enumerate_component is None:
+                results = {'count': 0, 'mines': [0] * len(members)}
+
+                def on_solution(assignment, results=results, members=members):
+                    results['count'] += 1
+                    for j, idx in enumerate(members):
+                        results['mines'][j] += assignment[idx]
+
+                self.search(on_solution, positions, row_ids)
+                cnt, mines = results['count'], results['mines']
+            else:
+                local = {pos: j for j, pos in enumerate(positions)}
+                rows = [(scale, rhs, [(local[pos], a) for pos, a in terms])
+                        for _, scale, rhs, terms in (self.pivot_rows[r] for r in row_ids)]
+                cnt, free_mines, pivot_mines = enumerate_component(len(positions), rows)
+                mines = list(free_mines) + list(pivot_mines)
+            if cnt == 0:
+                return 0, [0] * n
+            parts.append((cnt, mines, members))
+
+        total = 1
+        for cnt, _, _ in parts:
+            total *= cnt
+        bomb_counts = [0] * n
+        for idx, val in self.forced.items():
+            if val == 1:
+                bomb_counts[idx] = total
+        for cnt, mines, members in parts:
+            for idx, m in zip(members, mines):
+                bomb_counts[idx] = m * (total // cnt)
+        return total, bomb_counts
+
+    def minimum(self, positions, row_ids, bound=float("inf")):
+        """(cluster index, probability) of the component cell least likely to be a
+        mine, or None if none of them can get below bound. The search stops early
+        once the solutions seen so far prove that: with N solutions found, m of
+        them with a mine on a cell, and at most R left in the unexplored
+        branches, that cell's probability is at least m / (N + R)"""
+        members = [self.free[pos] for pos in positions] + [self.pivot_rows[r][0] for r in row_ids]
+        order = self._order(positions, row_ids)
+        # a branch left at 0 still has its 1 subtree to explore, of this size
+        subtree = [(self.free[pos], 1 << (len(order) - d - 1)) for d, pos in enumerate(order)]
+        mines = [0] * len(members)
+        found = [0]
+
+        def on_solution(assignment):
+            found[0] += 1
+            for j, idx in enumerate(members):
+                mines[j] += assignment[idx]
+            if bound < float("inf"):
+                left = sum(size for idx, size in subtree if assignment[idx] == 0)
+                if min(mines) >= bound * (found[0] + left):
+                    raise _Pruned()
+
+        try:
+            self.search(on_solution, positions, row_ids)
+        except _Pruned:
+            return None
+        if found[0] == 0:
+            return None
+        j = min(range(len(members)), key=mines.__getitem__)
+        return members[j], mines[j] / found[0]
+
+    def probabilities(self, enumerate_component=None):
+        total, bomb_counts = self.count(enumerate_component)
+        if total == 0:
+            return {cell: 1.0 for cell in self.cluster}
+        return {cell: bomb_counts[i] / total for i, cell in enumerate(self.cluster)}
+
+
+def reduce_cluster(cluster, cluster_constraints):
+    """Row-reduce the clue equations of a cluster and fix every cell the reduced
+    rows force. Returns a ReducedCluster, or None if the clues are contradictory"""
+    matrix, rhs = build_clue_matrix(cluster, cluster_constraints)
+    n = len(cluster)
+    forced = {}
+    while True:
+        active = [j for j in range(n) if j not in forced]
+        sub_matrix = [[row[j] for j in active] for row in matrix]
+        sub_rhs = [b - sum(row[j] * v for j, v in forced.items()) for row, b in zip(matrix, rhs)]
+        reduced = row_reduce(sub_matrix, sub_rhs)
+        if reduced is None:
+            return None
+        rows, pivots = reduced
+        original = [row + [b] for row, b in zip(sub_matrix, sub_rhs)]
+        new_forced = forced_by_bounds(original + rows)
+        if new_forced is None:
+            return None
+        if not new_forced:
+            break
+        for col, val in new_forced.items():
+            forced[active[col]] = val
+
+    pivot_set = set(pivots)
+    free = [active[col] for col in range(len(active)) if col not in pivot_set]
+    free_pos = {col: pos for pos, col in enumerate(col for col in range(len(active)) if col not in pivot_set)}
+    pivot_rows = []
+    for row, pivot in zip(rows, pivots):
+        terms = [(free_pos[col], a) for col, a in enumerate(row[:-1]) if a != 0 and col != pivot]
+        # scale * x_pivot takes values rhs - hi .. rhs - lo; it must be able to
+        # reach 0 or scale (a row like 2x = 1 with no free cells never does)
+        lo = sum(a for _, a in terms if a < 0)
+        hi = sum(a for _, a in terms if a > 0)
+        if not any(row[-1] - hi <= v <= row[-1] - lo for v in (0, row[pivot])):
+            return None
+        pivot_rows.append((active[pivot], row[pivot], row[-1], terms))
+    return ReducedCluster(cluster, forced, free, pivot_rows)
+
+def reduced_cluster_solver(cluster, cluster_constraints):
+    system = reduce_cluster(cluster, cluster_constraints)
+    if system is None:
+        return {cell: 1.0 for cell in cluster}
+    return system.probabilities()
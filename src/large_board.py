@@ -0,0 +1,311 @@
+import random
+import time
+from gauss_reduce import reduce_cluster
+
+TILE = 64
+HIDDEN = 255
+MAX_FREE = 16
+WINDOW = 64
+
+
+class LargeBoard:
+    """Board of up to thousands of cells per side. Mines are generated lazily per
+    TILE x TILE tile from the board seed and stored as one int bitmask per tile;
+    revealed values are stored only for tiles that have been opened, so memory
+    grows with the revealed area rather than the board area"""
+
+    def __init__(self, width, height, density, seed=0, tile=TILE):
+        self.squares_x = width
+        self.squares_y = height
+        self.density = density
+        self.seed = seed
+        self.tile = tile
+        self.mine_tiles = {}
+        self.value_tiles = {}
+        self.flags = set()
+        self.frontier = set()
+        self.clues = set()
+        self.dirty = set()
+        # clues a windowed cluster stopped short of, examined before a guess
+        self.cut_clues = set()
+        self.safe_zone = None
+        self.init = False
+        self.game_lost = False
+        self.revealed_count = 0
+        self.explosions = 0
+
+    def _mines(self, tr, tc):
+        mask = self.mine_tiles.get((tr, tc))
+        if mask is None:
+            rng = random.Random(f"{self.seed}:{tr}:{tc}")
+            mask = 0
+            for i in range(self.tile * self.tile):
+                if rng.random() < self.density:
+                    mask |= 1 << i
+            self.mine_tiles[(tr, tc)] = mask
+        return mask
+
+    def has_mine(self, r, c):
+        if self.safe_zone is not None and abs(r - self.safe_zone[0]) <= 1 and abs(c - self.safe_zone[1]) <= 1:
+            return False
+        t = self.tile
+        return (self._mines(r // t, c // t) >> ((r % t) * t + c % t)) & 1 == 1
+
+    def neighbors(self, r, c):
+        for dr in (-1, 0, 1):
+            for dc in (-1, 0, 1):
+                if dr == 0 and dc == 0:
+                    continue
+                nr, nc = r + dr, c + dc
+                if 0 <= nr < self.squares_y and 0 <= nc < self.squares_x:
+                    yield nr, nc
+
+    def count(self, r, c):
+        return sum(1 for nr, nc in self.neighbors(r, c) if self.has_mine(nr, nc))
+
+    def value(self, r, c):
+        """Revealed bomb count of a cell, None while it is hidden"""
+        t = self.tile
+        values = self.value_tiles.get((r // t, c // t))
+        if values is None:
+            return None
+        v = values[(r % t) * t + c % t]
+        return None if v == HIDDEN else v
+
+    def _set_value(self, r, c, v):
+        t = self.tile
+        values = self.value_tiles.get((r // t, c // t))
+        if values is None:
+            values = bytearray([HIDDEN]) * (t * t)
+            self.value_tiles[(r // t, c // t)] = values
+        values[(r % t) * t + c % t] = v
+
+    def is_hidden(self, r, c):
+        return self.value(r, c) is None and (r, c) not in self.flags
+
+    def reveal(self, r, c):
+        """Open a cell, flood-filling zeros through orthogonal neighbours like
+        Cell.open_neighbours. Returns the newly revealed cells, or None on a mine"""
+        if not self.init:
+            self.safe_zone = (r, c)
+            self.init = True
+        if not self.is_hidden(r, c):
+            return []
+        if self.has_mine(r, c):
+            self.explosions += 1
+            self.game_lost = True
+            self.flag(r, c)
+            return None
+        opened = []
+        stack = [(r, c)]
+        while stack:
+            cr, cc = stack.pop()
+            if not self.is_hidden(cr, cc):
+                continue
+            v = self.count(cr, cc)
+            self._set_value(cr, cc, v)
+            opened.append((cr, cc))
+            if v == 0:
+                for nr, nc in ((cr - 1, cc), (cr + 1, cc), (cr, cc - 1), (cr, cc + 1)):
+                    if 0 <= nr < self.squares_y and 0 <= nc < self.squares_x and self.is_hidden(nr, nc):
+                        if not self.has_mine(nr, nc):
+                            stack.append((nr, nc))
+        self.revealed_count += len(opened)
+        for cell in opened:
+            self._update_frontier(*cell)
+        return opened
+
+    def flag(self, r, c):
+        self.flags.add((r, c))
+        self.frontier.discard((r, c))
+        for nr, nc in self.neighbors(r, c):
+            if (nr, nc) in self.clues:
+                self.dirty.add((nr, nc))
+
+    def _update_frontier(self, r, c):
+        self.frontier.discard((r, c))
+        self.clues.add((r, c))
+        self.dirty.add((r, c))
+        for nr, nc in self.neighbors(r, c):
+            if self.is_hidden(nr, nc):
+                self.frontier.add((nr, nc))
+            elif (nr, nc) in self.clues:
+                self.dirty.add((nr, nc))
+
+    def constraint(self, clue):
+        """(required mines, hidden neighbours) of a revealed cell, or None once it
+        has no hidden neighbours left"""
+        hidden = []
+        flagged = 0
+        for nr, nc in self.neighbors(*clue):
+            if (nr, nc) in self.flags:
+                flagged += 1
+            elif self.value(nr, nc) is None:
+                hidden.append((nr, nc))
+        if not hidden:
+            self.clues.discard(clue)
+            return None
+        return self.value(*clue) - flagged, hidden
+
+    def memory_cells(self):
+        """Rough footprint: allocated tiles and tracked frontier/clue cells"""
+        return {
+            "mine_tiles": len(self.mine_tiles),
+            "value_tiles": len(self.value_tiles),
+            "frontier": len(self.frontier),
+            "clues": len(self.clues),
+        }
+
+
+def active_clusters(board, window=WINDOW):
+    """Clusters reachable from the clues touched since the last call; only this
+    part of the frontier is rebuilt. A cluster that grows past window cells is
+    cut off there and marked incomplete: the constraints inside it still prove
+    safe cells and mines, but its probabilities would be wrong. The clues it
+    had not reached yet are kept in board.cut_clues"""
+    seeds = [clue for clue in board.dirty if clue in board.clues]
+    board.dirty = set()
+    seen_clues = set()
+    clusters = []
+    for seed in seeds:
+        if seed in seen_clues:
+            continue
+        cells = set()
+        constraints = {}
+        complete = True
+        stack = [seed]
+        while stack:
+            clue = stack.pop()
+            if clue in seen_clues:
+                continue
+            if len(cells) >= window:
+                complete = False
+                board.cut_clues.update(stack + [clue])
+                break
+            seen_clues.add(clue)
+            con = board.constraint(clue)
+            if con is None:
+                continue
+            constraints[clue] = con
+            for cell in con[1]:
+                if cell in cells:
+                    continue
+                cells.add(cell)
+                for nr, nc in board.neighbors(*cell):
+                    if (nr, nc) in board.clues and (nr, nc) not in seen_clues:
+                        stack.append((nr, nc))
+        if cells:
+            clusters.append((list(cells), constraints, complete))
+    board.cut_clues -= seen_clues
+    return clusters
+
+def large_board_solver(board, max_free=MAX_FREE, retry=True):
+    """One streaming step over the active clusters: returns (safe cells, mine cells,
+    {cell: probability}) where the dict holds the safest cell of each cluster
+    that had to be enumerated. When that proves nothing, the clues cut off by
+    earlier windows get one more pass, so a provable cell is not guessed at"""
+    safe = []
+    mines = []
+    candidates = {}
+    for cluster, constraints, complete in active_clusters(board):
+        system = reduce_cluster(cluster, constraints)
+        if system is None:
+            continue
+        for idx, val in system.forced.items():
+            (mines if val else safe).append(cluster[idx])
+        if safe:
+            # enumeration is only needed once nothing is certain; look again next step
+            board.dirty.update(constraints)
+            continue
+        if not complete or len(system.free) > max_free:
+            continue
+        probs = system.probabilities()
+        certain = [cell for cell, prob in probs.items() if prob in (0.0, 1.0)]
+        for cell in certain:
+            (safe if probs[cell] == 0.0 else mines).append(cell)
+        if not certain:
+            cell = min(probs, key=probs.get)
+            candidates[cell] = probs[cell]
+    if retry and not safe and not mines and board.cut_clues:
+        board.dirty.update(board.cut_clues)
+        safe, mines, more = large_board_solver(board, max_free, retry=False)
+        candidates.update(more)
+    return safe, mines, candidates
+
+def random_interior_cell(board, rng, attempts=10000):
+    for _ in range(attempts):
+        r = rng.randrange(board.squares_y)
+        c = rng.randrange(board.squares_x)
+        if board.is_hidden(r, c) and (r, c) not in board.frontier:
+            return r, c
+    return None
+
+def run_large_board(width=1024, height=1024, density=0.15, seed=0, time_limit=60.0,
+                    max_explosions=None, verbose=True):
+    """Solve a large board for up to time_limit seconds, continuing past mines
+    (each one is flagged and counted), and report cells revealed per second"""
+    board = LargeBoard(width, height, density, seed)
+    rng = random.Random(seed)
+    guesses = 0
+    start_time = time.time()
+    board.reveal(height // 2, width // 2)
+    stuck = {}
+    while time.time() - start_time < time_limit:
+        if max_explosions is not None and board.explosions > max_explosions:
+            break
+        safe, mines, candidates = large_board_solver(board)
+        for cell in mines:
+            board.flag(*cell)
+        if safe:
+            for cell in safe:
+                board.reveal(*cell)
+            continue
+        stuck.update(candidates)
+        stuck = {cell: p for cell, p in stuck.items() if board.is_hidden(*cell)}
+        cell = None
+        if not stuck or min(stuck.values()) >= board.density:
+            cell = random_interior_cell(board, rng)
+        if cell is None:
+            if not stuck:
+                break
+            cell = min(stuck, key=stuck.get)
+            del stuck[cell]
+        guesses += 1
+        board.reveal(*cell)
+        if board.revealed_count + len(board.flags) >= width * height:
+            break
+    time_taken = time.time() - start_time
+    rate = board.revealed_count / time_taken if time_taken > 0 else 0.0
+
+    if verbose:
+        print("----- LARGE BOARD -----")
+        print(f"Grid size: {width}x{height}")
+        print(f"Mine density: {density:.3f}")
+        print(f"Cells revealed: {board.revealed_count}")
+        print(f"Guesses: {guesses}")
+        print(f"Explosions: {board.explosions}")
+        print(f"Tiles allocated: {len(board.value_tiles)} of {-(-width // board.tile) * -(-height // board.tile)}")
+        print(f"Throughput: {rate:.0f} cells revealed/second")
+        print(f"Time taken: {time_taken:.2f} seconds")
+
+    return {
+        "width": width,
+        "height": height,
+        "density": density,
+        "revealed": board.revealed_count,
+        "guesses": guesses,
+        "explosions": board.explosions,
+        "cells_per_second": rate,
+        "time_taken": time_taken,
+        **board.memory_cells(),
+    }
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Stress-test solving on a large board")
+    parser.add_argument("--size", type=int, default=1024, help="Board width and height")
+    parser.add_argument("--density", type=float, default=0.15, help="Mine density")
+    parser.add_argument("--seed", type=int, default=0, help="Board seed")
+    parser.add_argument("--time", type=float, default=60.0, help="Time limit in seconds")
+    args = parser.parse_args()
+    run_large_board(args.size, args.size, args.density, args.seed, args.time)
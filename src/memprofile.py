@@ -0,0 +1,172 @@
+import os
+import resource
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+_active = None
+_null = nullcontext()
+
+
+def current_rss_kb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def reset_peak_rss():
+    """Reset the kernel's peak RSS of this process so peak_rss_kb() measures
+    from here on. False where that is unsupported (non-Linux, old kernels)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peak_rss_kb():
+    """Peak RSS since the process started or the last reset_peak_rss()"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def physical_memory_kb():
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (ValueError, OSError):
+        return None
+
+def estimate_size(obj, sample=1000):
+    """Approximate deep size in bytes of a dict/list/set of nested tuples,
+    measuring at most `sample` entries and extrapolating"""
+    def deep(o):
+        size = sys.getsizeof(o)
+        if isinstance(o, (tuple, list, frozenset, set)):
+            size += sum(deep(x) for x in o)
+        return size
+
+    size = sys.getsizeof(obj)
+    n = len(obj)
+    if n == 0:
+        return size
+    items = obj.items() if isinstance(obj, dict) else obj
+    measured = 0
+    for i, item in enumerate(items):
+        if i == sample:
+            break
+        measured += deep(item[0]) + deep(item[1]) if isinstance(obj, dict) else deep(item)
+    return size + measured * n // min(n, sample)
+
+
+class MemoryProfiler:
+    """Opt-in memory instrumentation. While active, phase() blocks in the solvers
+    record their tracemalloc peak above the level they started at, record_cache()
+    tracks the largest size seen per cache structure, and a background thread
+    samples the process RSS"""
+
+    def __init__(self, sample_interval=0.005):
+        self.sample_interval = sample_interval
+        self.phases = {}
+        self.caches = {}
+        self.peak_rss_kb = 0
+        self.peak_traced = 0
+        self._stack = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        global _active
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self._base = tracemalloc.get_traced_memory()[0]
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample_rss, daemon=True)
+        self._thread.start()
+        _active = self
+        return self
+
+    def stop(self):
+        global _active
+        _active = None
+        self._stop.set()
+        self._thread.join()
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak_traced = max(self.peak_traced, peak - self._base)
+        if self._started_tracing:
+            tracemalloc.stop()
+        self.peak_rss_kb = max(self.peak_rss_kb, current_rss_kb())
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _sample_rss(self):
+        while not self._stop.wait(self.sample_interval):
+            self.peak_rss_kb = max(self.peak_rss_kb, current_rss_kb())
+
+    @contextmanager
+    def phase(self, name):
+        current, peak = tracemalloc.get_traced_memory()
+        if self._stack:
+            self._stack[-1][1] = max(self._stack[-1][1], peak)
+        tracemalloc.reset_peak()
+        frame = [current, current]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            frame[1] = max(frame[1], tracemalloc.get_traced_memory()[1])
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1][1] = max(self._stack[-1][1], frame[1])
+            self.peak_traced = max(self.peak_traced, frame[1] - self._base)
+            tracemalloc.reset_peak()
+            stats = self.phases.setdefault(name, {"calls": 0, "peak_bytes": 0})
+            stats["calls"] += 1
+            stats["peak_bytes"] = max(stats["peak_bytes"], frame[1] - frame[0])
+
+    def record_cache(self, name, entries, nbytes):
+        stats = self.caches.setdefault(name, {"entries": 0, "bytes": 0})
+        stats["entries"] = max(stats["entries"], entries)
+        stats["bytes"] = max(stats["bytes"], nbytes)
+
+    def report(self):
+        """Flat dict of the peaks, suitable for a CSV row"""
+        row = {"peak_traced_kb": self.peak_traced // 1024, "peak_rss_kb": self.peak_rss_kb}
+        for name, stats in self.phases.items():
+            row[f"phase_{name}_kb"] = stats["peak_bytes"] // 1024
+        for name, stats in self.caches.items():
+            row[f"cache_{name}_entries"] = stats["entries"]
+            row[f"cache_{name}_kb"] = stats["bytes"] // 1024
+        memory = physical_memory_kb()
+        if memory:
+            row["rss_fraction"] = round(self.peak_rss_kb / memory, 4)
+        return row
+
+
+def phase(name):
+    """Phase block for the active profiler, a no-op context when profiling is off"""
+    if _active is None:
+        return _null
+    return _active.phase(name)
+
+def record_cache(name, entries, nbytes=None, obj=None):
+    if _active is None:
+        return
+    if nbytes is None:
+        nbytes = estimate_size(obj) if obj is not None else 0
+    _active.record_cache(name, entries, nbytes)
+
+def profiling():
+    return _active is not None
@@ -1,6 +1,10 @@
 import pygame
 import sys
 from random import randrange
+from board_config import BoardConfig
+from snapshot import BoardSnapshot
+from zobrist import zobrist_keys, cell_key, full_hash, FLAG
+from movelog import log_from_argv
 
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
@@ -24,14 +28,19 @@ EXPERT_BOMBS = 99
 
       
 class Game:
-    def __init__(self):
-        self.squares_x = NSQUARES_X
-        self.squares_y = NSQUARES_Y
+    def __init__(self, config=None):
+        if config is None:
+            config = BoardConfig(NSQUARES_X, NSQUARES_Y, EXPERT_BOMBS, "none")
+        self.config = config
+        self.squares_x = config.width
+        self.squares_y = config.height
         self.grid = [[self.Cell(x, y) for x in range(self.squares_x)] for y in range(self.squares_y)]
+        self.zobrist = zobrist_keys(self.squares_x, self.squares_y)
+        self.state_hash = 0
         self.init = False
         self.game_lost = False
         self.game_won = False
-        self.num_bombs = EXPERT_BOMBS
+        self.num_bombs = config.mines
         self.resize = False
         self.flag_count = 0
 
@@ -63,6 +72,8 @@ class Game:
         if self.num_bombs > (self.squares_x * self.squares_y) // 3:
             self.num_bombs = self.squares_x * self.squares_y // 3
         self.grid = [[self.Cell(x, y) for x in range(self.squares_x)] for y in range(self.squares_y)]
+        self.zobrist = zobrist_keys(self.squares_x, self.squares_y)
+        self.state_hash = 0
         size = ((self.squares_x*(WIDTH + MARGIN) + MARGIN), (self.squares_y*(HEIGHT + MARGIN) + MARGIN + MENU_SIZE))
         screen = pygame.display.set_mode(size, pygame.RESIZABLE)
 
@@ -72,6 +83,7 @@ class Game:
                 if self.grid[row][column].has_bomb:
                     self.grid[row][column].is_visible = True
                 self.grid[row][column].has_flag = False
+        self.state_hash = full_hash(self)
 
     
     def change_num_bombs(self, bombs):
@@ -88,7 +100,7 @@ class Game:
         while bombplaced < self.num_bombs:
             x = randrange(self.squares_y)
             y = randrange(self.squares_x)
-            if not self.grid[x][y].has_bomb:
+            if self.config.allows_mine(row, column, x, y) and not self.grid[x][y].has_bomb:
                 self.grid[x][y].has_bomb = True
                 bombplaced += 1
         self.count_all_bombs()
@@ -98,7 +110,7 @@ class Game:
     def count_all_bombs(self):
         for row in range(self.squares_y):
             for column in range(self.squares_x):
-                self.grid[row][column].count_bombs(self.squares_y, self.squares_x)
+                self.grid[row][column].count_bombs(self.squares_y, self.squares_x, self.grid)
     
     
     def reset_game(self):
@@ -113,6 +125,18 @@ class Game:
                 self.game_lost = False
                 self.game_won = False
                 self.flag_count = 0
+        self.state_hash = 0
+
+    def hash_opened(self, opened):
+        """Fold cells opened by a flood fill, given as (cell, had_flag), into state_hash"""
+        for cell, had_flag in opened:
+            if had_flag:
+                self.state_hash ^= self.zobrist[cell.y][cell.x][FLAG]
+            self.state_hash ^= cell_key(self.zobrist, cell)
+
+    def snapshot(self, layout=None):
+        """Copy-on-write view of the board for lookahead, see snapshot.BoardSnapshot"""
+        return BoardSnapshot(self, layout)
 
     def check_victory(self):   
         count = 0
@@ -127,6 +151,7 @@ class Game:
                 for column in range(self.squares_x):
                     if self.grid[row][column].has_bomb:
                         self.grid[row][column].has_flag = True
+            self.state_hash = full_hash(self)
         
     def count_flags(self):
         total_flags = 0
@@ -145,13 +170,17 @@ class Game:
                 if not self.init:
                     self.place_bombs(row, column)
                     self.init = True
+                before = cell_key(self.zobrist, self.grid[row][column])
                 self.grid[row][column].is_visible = True
                 self.grid[row][column].has_flag = False
+                self.state_hash ^= before ^ cell_key(self.zobrist, self.grid[row][column])
                 if self.grid[row][column].has_bomb:
                     self.game_over()
                     self.game_lost = True
                 if self.grid[row][column].bomb_count == 0 and not self.grid[row][column].has_bomb:
-                    self.grid[row][column].open_neighbours(self.squares_y, self.squares_x)
+                    opened = []
+                    self.grid[row][column].open_neighbours(self.squares_y, self.squares_x, self.grid, opened)
+                    self.hash_opened(opened)
                 self.check_victory()
             else:
                 self.game_lost = False
@@ -161,8 +190,10 @@ class Game:
             if not self.grid[row][column].has_flag:
                 if self.flag_count < self.num_bombs and not self.grid[row][column].is_visible:
                     self.grid[row][column].has_flag = True
+                    self.state_hash ^= self.zobrist[row][column][FLAG]
             else:
                 self.grid[row][column].has_flag = False
+                self.state_hash ^= self.zobrist[row][column][FLAG]
             self.count_flags()
 
 
@@ -188,7 +219,7 @@ class Game:
                 screen.blit(self.text, (self.x * (WIDTH + MARGIN) + 12, self.y * (HEIGHT + MARGIN) + 10 + MENU_SIZE))
         
         
-        def count_bombs(self, max_rows, max_cols):
+        def count_bombs(self, max_rows, max_cols, grid):
             if not self.test:
                 self.test = True
                 if not self.has_bomb:
@@ -197,11 +228,11 @@ class Game:
                             if (row >= 0 and row < max_rows and 
                                 col >= 0 and col < max_cols and 
                                 not (col == self.x and row == self.y) and 
-                                game.grid[row][col].has_bomb):
+                                grid[row][col].has_bomb):
                                 self.bomb_count += 1
         
         
-        def open_neighbours(self, max_rows, max_cols):
+        def open_neighbours(self, max_rows, max_cols, grid, opened=None):
             col = self.x
             row = self.y
             for row_off in range(-1, 2):
@@ -209,13 +240,15 @@ class Game:
                     if ((row_off == 0 or col_off == 0) and row_off != col_off and
                         row + row_off >= 0 and col + col_off >= 0 and 
                         row + row_off < max_rows and col + col_off < max_cols):
-                        game.grid[row + row_off][col + col_off].count_bombs(game.squares_y, game.squares_x)
-                        if (not game.grid[row + row_off][col + col_off].is_visible and 
-                            not game.grid[row + row_off][col + col_off].has_bomb):  
-                            game.grid[row + row_off][col + col_off].is_visible = True
-                            game.grid[row + row_off][col + col_off].has_flag = False
-                            if game.grid[row + row_off][col + col_off].bomb_count == 0: 
-                                game.grid[row + row_off][col + col_off].open_neighbours(game.squares_y, game.squares_x)
+                        grid[row + row_off][col + col_off].count_bombs(max_rows, max_cols, grid)
+                        if (not grid[row + row_off][col + col_off].is_visible and 
+                            not grid[row + row_off][col + col_off].has_bomb):  
+                            if opened is not None:
+                                opened.append((grid[row + row_off][col + col_off], grid[row + row_off][col + col_off].has_flag))
+                            grid[row + row_off][col + col_off].is_visible = True
+                            grid[row + row_off][col + col_off].has_flag = False
+                            if grid[row + row_off][col + col_off].bomb_count == 0: 
+                                grid[row + row_off][col + col_off].open_neighbours(max_rows, max_cols, grid, opened)
 
 class Menu:
     def __init__(self):
@@ -291,6 +324,7 @@ font = pygame.font.Font('freesansbold.ttf', 24)
 game = Game()
 menu = Menu()
 clock = pygame.time.Clock()
+move_log = None
 
 def run_game():
     while True:
@@ -307,7 +341,10 @@ def run_game():
                 if column >= game.squares_x:
                     column = game.squares_x - 1
                 if row >= 0:
-                    game.click_handle(row, column, event.button)
+                    if move_log is not None:
+                        move_log.click(game, row, column, event.button)
+                    else:
+                        game.click_handle(row, column, event.button)
                 else:
                     menu.click_handle(game)
             elif event.type == pygame.VIDEORESIZE:
@@ -322,4 +359,5 @@ def run_game():
         clock.tick(60)
         pygame.display.flip()
 if __name__ == "__main__":
+    move_log = log_from_argv()
     run_game()
\ No newline at end of file
@@ -2,6 +2,10 @@ import pygame
 import sys
 import random
 from random import randrange
+from board_config import BoardConfig
+from snapshot import BoardSnapshot
+from zobrist import zobrist_keys, cell_key, full_hash, FLAG
+from movelog import log_from_argv
 
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
@@ -21,13 +25,18 @@ NSQUARES_X = 10
 NSQUARES_Y = 10  
 EXPERT_BOMBS = 5 
 class Game:
-    def __init__(self, use_display=True, num_bombs=EXPERT_BOMBS, fixed_seed=None):
+    def __init__(self, use_display=True, num_bombs=EXPERT_BOMBS, fixed_seed=None, config=None):
+        if config is None:
+            config = BoardConfig(NSQUARES_X, NSQUARES_Y, num_bombs, "cell")
         self.use_display = use_display
-        self.squares_x = NSQUARES_X
-        self.squares_y = NSQUARES_Y
-        self.num_bombs = num_bombs
+        self.config = config
+        self.squares_x = config.width
+        self.squares_y = config.height
+        self.num_bombs = config.mines
         self.fixed_seed = fixed_seed
         self.grid = [[self.Cell(x, y) for x in range(self.squares_x)] for y in range(self.squares_y)]
+        self.zobrist = zobrist_keys(self.squares_x, self.squares_y)
+        self.state_hash = 0
         self.init = False
         self.game_lost = False
         self.game_won = False
@@ -37,7 +46,7 @@ class Game:
         if self.use_display:
             pygame.init()
             global screen, font
-            size = (NSQUARES_X * (WIDTH + MARGIN) + MARGIN, (NSQUARES_Y * (HEIGHT + MARGIN) + MARGIN) + MENU_SIZE)
+            size = (self.squares_x * (WIDTH + MARGIN) + MARGIN, (self.squares_y * (HEIGHT + MARGIN) + MARGIN) + MENU_SIZE)
             screen = pygame.display.set_mode(size, pygame.RESIZABLE)
             pygame.display.set_caption("Minesweeper by Raul Vieira - Expert Level")
             font = pygame.font.Font('freesansbold.ttf', 24)
@@ -72,6 +81,8 @@ class Game:
         if self.num_bombs > (self.squares_x * self.squares_y) // 3:
             self.num_bombs = self.squares_x * self.squares_y // 3
         self.grid = [[self.Cell(x, y) for x in range(self.squares_x)] for y in range(self.squares_y)]
+        self.zobrist = zobrist_keys(self.squares_x, self.squares_y)
+        self.state_hash = 0
         size = ((self.squares_x*(WIDTH + MARGIN) + MARGIN), (self.squares_y*(HEIGHT + MARGIN) + MARGIN + MENU_SIZE))
         screen = pygame.display.set_mode(size, pygame.RESIZABLE)
 
@@ -81,6 +92,7 @@ class Game:
                 if self.grid[row][column].has_bomb:
                     self.grid[row][column].is_visible = True
                 self.grid[row][column].has_flag = False
+        self.state_hash = full_hash(self)
 
     def change_num_bombs(self, bombs):
         self.num_bombs += bombs
@@ -114,7 +126,7 @@ class Game:
         while bombplaced < self.num_bombs:
             x = randrange(self.squares_y)
             y = randrange(self.squares_x)
-            if not self.grid[x][y].has_bomb and (x, y) != (row, column):
+            if not self.grid[x][y].has_bomb and self.config.allows_mine(row, column, x, y):
                 self.grid[x][y].has_bomb = True
                 bombplaced += 1
         self.count_all_bombs()
@@ -139,12 +151,24 @@ class Game:
                 self.flag_count = 0
                 if not keep_bombs:
                     self.grid[row][column].has_bomb = False
+        self.state_hash = 0
 
         if not keep_bombs and self.fixed_seed is not None:
             self.generate_fixed_bombs(self.fixed_seed)
 
 
 
+    def hash_opened(self, opened):
+        """Fold cells opened by a flood fill, given as (cell, had_flag), into state_hash"""
+        for cell, had_flag in opened:
+            if had_flag:
+                self.state_hash ^= self.zobrist[cell.y][cell.x][FLAG]
+            self.state_hash ^= cell_key(self.zobrist, cell)
+
+    def snapshot(self, layout=None):
+        """Copy-on-write view of the board for lookahead, see snapshot.BoardSnapshot"""
+        return BoardSnapshot(self, layout)
+
     def check_victory(self):
         total_cells = self.squares_x * self.squares_y
         visible_cells = sum(1 for row in self.grid for cell in row if cell.is_visible)
@@ -170,13 +194,17 @@ class Game:
                 if not self.init:
                     self.place_bombs(row, column)
                     self.init = True
+                before = cell_key(self.zobrist, self.grid[row][column])
                 self.grid[row][column].is_visible = True
                 self.grid[row][column].has_flag = False
+                self.state_hash ^= before ^ cell_key(self.zobrist, self.grid[row][column])
                 if self.grid[row][column].has_bomb:
                     self.game_over()
                     self.game_lost = True
                 if self.grid[row][column].bomb_count == 0 and not self.grid[row][column].has_bomb:
-                    self.grid[row][column].open_neighbours(self.squares_y, self.squares_x, self.grid)
+                    opened = []
+                    self.grid[row][column].open_neighbours(self.squares_y, self.squares_x, self.grid, opened)
+                    self.hash_opened(opened)
                 self.check_victory()
             else:
                 self.game_lost = False
@@ -186,8 +214,10 @@ class Game:
             if not self.grid[row][column].has_flag:
                 if self.flag_count < self.num_bombs and not self.grid[row][column].is_visible:
                     self.grid[row][column].has_flag = True
+                    self.state_hash ^= self.zobrist[row][column][FLAG]
             else:
                 self.grid[row][column].has_flag = False
+                self.state_hash ^= self.zobrist[row][column][FLAG]
             self.count_flags()
 
 
@@ -225,7 +255,7 @@ class Game:
 
         
     
-        def open_neighbours(self, max_rows, max_cols, grid):
+        def open_neighbours(self, max_rows, max_cols, grid, opened=None):
             col = self.x
             row = self.y
             for row_off in range(-1, 2):
@@ -238,10 +268,12 @@ class Game:
                 
                         if (not grid[row + row_off][col + col_off].is_visible and 
                             not grid[row + row_off][col + col_off].has_bomb):  
+                            if opened is not None:
+                                opened.append((grid[row + row_off][col + col_off], grid[row + row_off][col + col_off].has_flag))
                             grid[row + row_off][col + col_off].is_visible = True
                             grid[row + row_off][col + col_off].has_flag = False
                             if grid[row + row_off][col + col_off].bomb_count == 0: 
-                                grid[row + row_off][col + col_off].open_neighbours(max_rows, max_cols, grid)
+                                grid[row + row_off][col + col_off].open_neighbours(max_rows, max_cols, grid, opened)
 
 
 class Menu:
@@ -311,7 +343,7 @@ class Menu:
 
 
 
-def run_game():
+def run_game(move_log=None):
     pygame.init()
     size = (NSQUARES_X * (WIDTH + MARGIN) + MARGIN, (NSQUARES_Y * (HEIGHT + MARGIN) + MARGIN) + MENU_SIZE)
     screen = pygame.display.set_mode(size, pygame.RESIZABLE)
@@ -335,7 +367,10 @@ def run_game():
                 if column >= game.squares_x:
                     column = game.squares_x - 1
                 if row >= 0:
-                    game.click_handle(row, column, event.button)
+                    if move_log is not None:
+                        move_log.click(game, row, column, event.button)
+                    else:
+                        game.click_handle(row, column, event.button)
                 else:
                     menu.click_handle(game)
 
@@ -353,4 +388,4 @@ def run_game():
 
 
 if __name__ == "__main__":
-    run_game()
\ No newline at end of file
+    run_game(log_from_argv())
\ No newline at end of file
@@ -0,0 +1,169 @@
+import random
+import numpy as np
+from board_config import BoardConfig
+from portfolio import HIDDEN, FLAGGED
+
+LEFT_CLICK = 1
+# an opened mine; the other observation codes are portfolio's HIDDEN/FLAGGED
+# and the 0-8 counts of revealed cells
+MINE = -3
+# rewards as in MonteCarloSolver.generate_episode
+WIN_REWARD = 5.0
+LOSS_REWARD = -5.0
+CELL_REWARD = 0.5
+STEP_REWARD = -0.1
+
+
+def _headless_game(config):
+    from CSP_solver import HeadlessGame
+    return HeadlessGame(config=config)
+
+
+class MinesweeperEnv:
+    """Gym-style environment over a HeadlessGame (or any game make_game(config)
+    returns, e.g. minesweeper_MC.Game without display). Actions are cell
+    indices row * width + col, each a left click.
+
+    observation is one int8 (H, W) array kept for the life of the env and
+    updated in place: only the cells a click opens are written, found through
+    the game's hash_opened hook instead of scanning the grid. action_mask marks
+    the HIDDEN cells of that array and is written in the same places. Pass out
+    and mask_out to keep both inside larger arrays (VectorEnv does)"""
+
+    def __init__(self, config=None, make_game=None, max_steps=None, out=None, mask_out=None):
+        self.config = config or BoardConfig(16, 16, 40, "neighborhood")
+        self.make_game = make_game or _headless_game
+        self.max_steps = max_steps
+        shape = (self.config.height, self.config.width)
+        self.observation = out if out is not None else np.empty(shape, dtype=np.int8)
+        if self.observation.shape != shape or self.observation.dtype != np.int8:
+            raise ValueError(f"out must be an int8 array of shape {shape}")
+        self.action_mask = mask_out if mask_out is not None else np.empty(shape, dtype=bool)
+        self._flat_mask = self.action_mask.reshape(-1)
+        self.game = None
+        self.rng = random.Random()
+        self.steps = 0
+        self.hidden = 0
+
+    @property
+    def num_actions(self):
+        return self.config.width * self.config.height
+
+    def reset(self, seed=None):
+        """New game; returns (observation, info). With a seed the board depends
+        only on it and the actions taken, not on the global random state"""
+        if seed is not None:
+            self.rng.seed(seed)
+        self.game = self.make_game(self.config)
+        opened = []
+        record = self.game.hash_opened
+
+        def hash_opened(cells):
+            opened.extend(cells)
+            record(cells)
+        self.game.hash_opened = hash_opened
+        self._opened = opened
+        self.observation.fill(HIDDEN)
+        self.action_mask.fill(True)
+        self.steps = 0
+        self.hidden = self.num_actions
+        return self.observation, {}
+
+    def _reveal(self, row, col):
+        cell = self.game.grid[row][col]
+        self.observation[row, col] = MINE if cell.has_bomb else cell.bomb_count
+        self.action_mask[row, col] = False
+        self.hidden -= 1
+
+    def _click(self, row, col):
+        if self.game.init:
+            self.game.click_handle(row, col, LEFT_CLICK)
+            return
+        # the mines are placed on the first click; draw them from this env's rng
+        saved = random.getstate()
+        random.setstate(self.rng.getstate())
+        try:
+            self.game.click_handle(row, col, LEFT_CLICK)
+        finally:
+            self.rng.setstate(random.getstate())
+            random.setstate(saved)
+
+    def step(self, action):
+        """Left-click cell action; returns (observation, reward, terminated,
+        truncated, info). A click on a revealed cell changes nothing and costs
+        STEP_REWARD, with info["invalid"] set"""
+        if self.game is None:
+            raise RuntimeError("reset() must be called before step()")
+        row, col = divmod(int(action), self.config.width)
+        if not 0 <= row < self.config.height:
+            raise ValueError(f"action {action} is outside the {self.num_actions} cells")
+        self.steps += 1
+        truncated = self.max_steps is not None and self.steps >= self.max_steps
+        if not self._flat_mask[action]:
+            return self.observation, STEP_REWARD, False, truncated, {"invalid": True}
+        hidden_before = self.hidden
+        del self._opened[:]
+        self._click(row, col)
+        if self.game.grid[row][col].is_visible:
+            self._reveal(row, col)
+        for cell, _ in self._opened:
+            self._reveal(cell.y, cell.x)
+        if self.game.game_lost:
+            # minesweeper_MC.Game's game_over() opens the other mines with plain
+            # is_visible writes that skip hash_opened, so take them from the grid
+            for r, grid_row in enumerate(self.game.grid):
+                for c, cell in enumerate(grid_row):
+                    if cell.has_bomb and self.action_mask[r, c]:
+                        self._reveal(r, c)
+            reward, terminated = LOSS_REWARD, True
+        elif self.game.game_won or self.hidden == self.game.num_bombs:
+            reward, terminated = WIN_REWARD, True
+        else:
+            reward, terminated = CELL_REWARD * (hidden_before - self.hidden) + STEP_REWARD, False
+        return self.observation, reward, terminated, truncated and not terminated, {}
+
+    def render(self):
+        symbols = {HIDDEN: ".", FLAGGED: "F", MINE: "*"}
+        return "\n".join("".join(symbols.get(v, str(v)) for v in row) for row in self.observation.tolist())
+
+
+class VectorEnv:
+    """n MinesweeperEnvs stepped together. observations is one (n, H, W) int8
+    array whose rows are the sub-envs' observation arrays, and action_masks
+    likewise holds their masks, so neither is copied per step. A finished
+    sub-env is reset at once; its last observation is in
+    info["final_observation"]"""
+
+    def __init__(self, n, config=None, make_game=None, max_steps=None):
+        config = config or BoardConfig(16, 16, 40, "neighborhood")
+        self.observations = np.empty((n, config.height, config.width), dtype=np.int8)
+        self.action_masks = np.empty((n, config.height, config.width), dtype=bool)
+        self.envs = [MinesweeperEnv(config, make_game, max_steps, self.observations[i], self.action_masks[i])
+                     for i in range(n)]
+        self.rewards = np.zeros(n)
+        self.terminated = np.zeros(n, dtype=bool)
+        self.truncated = np.zeros(n, dtype=bool)
+
+    def __len__(self):
+        return len(self.envs)
+
+    def reset(self, seed=None):
+        """Reset every sub-env, sub-env i with seed + i when a seed is given"""
+        for i, env in enumerate(self.envs):
+            env.reset(None if seed is None else seed + i)
+        return self.observations, [{} for _ in self.envs]
+
+    def step(self, actions):
+        """Step sub-env i with actions[i]; returns (observations, rewards,
+        terminated, truncated, infos) with the arrays reused between calls"""
+        infos = []
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            _, reward, terminated, truncated, info = env.step(action)
+            self.rewards[i] = reward
+            self.terminated[i] = terminated
+            self.truncated[i] = truncated
+            if terminated or truncated:
+                info = dict(info, final_observation=env.observation.copy(), won=bool(env.game.game_won))
+                env.reset()
+            infos.append(info)
+        return self.observations, self.rewards, self.terminated, self.truncated, infos
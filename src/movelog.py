@@ -0,0 +1,277 @@
+import os
+import struct
+import sys
+import time
+import numpy as np
+from board_config import BoardConfig, FIRST_CLICK_POLICIES
+
+# File: MAGIC, then per game a header record, its move records and an end record.
+#   header  'G' width:u16 height:u16 mines:u16 first_click:u8 seed:i64, mine mask (packbits, row-major)
+#   move    'M' row:u16 col:u16 button:u8 solver_time_us:u32
+#   end     'E' result:u8 (0 lost, 1 won, 2 unfinished)
+MAGIC = b"MSLG\x01"
+HEADER = struct.Struct("<cHHHBq")
+END = struct.Struct("<cB")
+MOVE = np.dtype([("tag", "S1"), ("row", "<u2"), ("col", "<u2"), ("button", "u1"), ("micros", "<u4")])
+LOST, WON, UNFINISHED = 0, 1, 2
+LEFT_CLICK = 1
+RIGHT_CLICK = 3
+
+
+class MoveLog:
+    """Append-only binary log of played games: the mine layout once the first
+    click has placed it, then 10 bytes per action. Cheap enough to leave on for
+    whole benchmark runs"""
+
+    def __init__(self, path):
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.path = path
+        self.file = open(path, "ab")
+        if new:
+            self.file.write(MAGIC)
+        self.seed = None
+        self.pending = False
+        self.open_game = False
+
+    def start(self, seed=None):
+        """Begin a new game; the header is written with its first move"""
+        if self.open_game:
+            self.file.write(END.pack(b"E", UNFINISHED))
+            self.open_game = False
+        self.seed = seed
+        self.pending = True
+
+    def _header(self, game):
+        config = BoardConfig.from_game(game)
+        mines = np.array([[cell.has_bomb for cell in row] for row in game.grid], dtype=bool)
+        seed = -1 if self.seed is None else self.seed
+        self.file.write(HEADER.pack(b"G", config.width, config.height, config.mines,
+                                    FIRST_CLICK_POLICIES.index(config.first_click), seed))
+        self.file.write(np.packbits(mines.ravel()).tobytes())
+        self.pending = False
+        self.open_game = True
+
+    def move(self, game, row, col, button, seconds=0.0):
+        """Log an action already applied to game (so its mines are placed)"""
+        if self.pending or not self.open_game:
+            self._header(game)
+        micros = min(int(seconds * 1e6), 0xFFFFFFFF)
+        record = np.array([(b"M", row, col, button, micros)], dtype=MOVE)
+        self.file.write(record.tobytes())
+
+    def finish(self, game):
+        if self.open_game:
+            result = WON if game.game_won else LOST if game.game_lost else UNFINISHED
+            self.file.write(END.pack(b"E", result))
+            self.open_game = False
+        self.file.flush()
+
+    def click(self, game, row, col, button, seconds=0.0):
+        """game.click_handle plus logging, for the interactive loops. A click that
+        only resets a finished board is not logged"""
+        finished = game.game_won or game.game_lost
+        new_game = not game.init
+        result = game.click_handle(row, col, button)
+        if finished or not game.init:
+            return result
+        if new_game and not self.pending:
+            self.start()
+        self.move(game, row, col, button, seconds)
+        if game.game_won or game.game_lost:
+            self.finish(game)
+        return result
+
+    def close(self):
+        if self.open_game:
+            self.file.write(END.pack(b"E", UNFINISHED))
+            self.open_game = False
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def log_from_argv(argv=None):
+    """MoveLog for a `--log PATH` command-line option, None without one"""
+    argv = sys.argv if argv is None else argv
+    if "--log" in argv and argv.index("--log") + 1 < len(argv):
+        return MoveLog(argv[argv.index("--log") + 1])
+    return None
+
+
+class LoggedGame:
+    def __init__(self, config, seed, mines, moves, result):
+        self.config = config
+        self.seed = seed
+        self.mines = mines
+        self.moves = moves
+        self.result = result
+
+    def __len__(self):
+        return len(self.moves)
+
+
+def read_log(path):
+    """Every game in a log file. Move records are viewed in place as a NumPy
+    structured array, so reading costs about as much as the file copy"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a move log")
+    games = []
+    pos = len(MAGIC)
+    while pos < len(data):
+        tag, width, height, mines, first_click, seed = HEADER.unpack_from(data, pos)
+        if tag != b"G":
+            raise ValueError(f"corrupt move log {path} at byte {pos}")
+        pos += HEADER.size
+        nbytes = (width * height + 7) // 8
+        mask = np.unpackbits(np.frombuffer(data, dtype=np.uint8, count=nbytes, offset=pos))
+        pos += nbytes
+        count = 0
+        while True:
+            available = (len(data) - pos) // MOVE.itemsize - count
+            chunk = np.frombuffer(data, dtype=MOVE, count=min(available, 4096), offset=pos + count * MOVE.itemsize)
+            other = np.flatnonzero(chunk["tag"] != b"M")
+            if len(other):
+                count += int(other[0])
+                break
+            count += len(chunk)
+            if len(chunk) == available:
+                break
+        moves = np.frombuffer(data, dtype=MOVE, count=count, offset=pos)
+        pos += count * MOVE.itemsize
+        result = UNFINISHED
+        if pos + END.size <= len(data) and data[pos:pos + 1] == b"E":
+            result = END.unpack_from(data, pos)[1]
+            pos += END.size
+        games.append(LoggedGame(BoardConfig(width, height, mines, FIRST_CLICK_POLICIES[first_click]),
+                                None if seed == -1 else seed,
+                                mask[:width * height].reshape(height, width).astype(bool), moves, result))
+    return games
+
+
+class ReplayBoard:
+    """Array form of a logged game with the games' click rules (orthogonal
+    flood fill included), for replaying moves without any Cell objects"""
+
+    def __init__(self, mines):
+        self.mines = mines
+        padded = np.pad(mines.astype(np.int8), 1)
+        height, width = mines.shape
+        counts = sum(padded[1 + dr:1 + dr + height, 1 + dc:1 + dc + width]
+                     for dr in (-1, 0, 1) for dc in (-1, 0, 1) if dr or dc)
+        self.counts = np.where(mines, 0, counts).astype(np.int8)
+        self.visible = np.zeros(mines.shape, dtype=bool)
+        self.flags = np.zeros(mines.shape, dtype=bool)
+        self.num_bombs = int(mines.sum())
+        self.hidden = mines.size
+        self.game_lost = False
+        self.game_won = False
+
+    def _show(self, row, col):
+        self.visible[row, col] = True
+        self.flags[row, col] = False
+        self.hidden -= 1
+
+    def apply(self, row, col, button):
+        if button == LEFT_CLICK:
+            if self.flags[row, col] or self.game_lost or self.game_won:
+                return
+            if not self.visible[row, col]:
+                self._show(row, col)
+            if self.mines[row, col]:
+                self.game_lost = True
+                return
+            stack = [(row, col)] if self.counts[row, col] == 0 else []
+            height, width = self.mines.shape
+            while stack:
+                r, c = stack.pop()
+                for nr, nc in ((r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)):
+                    if 0 <= nr < height and 0 <= nc < width and not self.visible[nr, nc] and not self.mines[nr, nc]:
+                        self._show(nr, nc)
+                        if self.counts[nr, nc] == 0:
+                            stack.append((nr, nc))
+            if self.hidden == self.num_bombs:
+                self.game_won = True
+        elif button == RIGHT_CLICK:
+            if self.flags[row, col]:
+                self.flags[row, col] = False
+            elif not self.visible[row, col] and self.flags.sum() < self.num_bombs:
+                self.flags[row, col] = True
+
+def replay(logged, upto=None):
+    """ReplayBoard after the first `upto` moves (all of them by default)"""
+    board = ReplayBoard(logged.mines)
+    for row, col, button in zip(logged.moves["row"][:upto].tolist(), logged.moves["col"][:upto].tolist(),
+                                logged.moves["button"][:upto].tolist()):
+        board.apply(row, col, button)
+    return board
+
+def board_to_game(board, config):
+    """HeadlessGame holding a replayed position, ready to hand to a solver"""
+    from CSP_solver import HeadlessGame
+    from zobrist import full_hash
+    game = HeadlessGame(config=config)
+    for r, row in enumerate(game.grid):
+        for c, cell in enumerate(row):
+            cell.has_bomb = bool(board.mines[r, c])
+            cell.bomb_count = int(board.counts[r, c])
+            cell.test = True
+            cell.is_visible = bool(board.visible[r, c])
+            cell.has_flag = bool(board.flags[r, c])
+    game.init = True
+    game.game_lost = board.game_lost
+    game.game_won = board.game_won
+    game.flag_count = int(board.flags.sum())
+    game.state_hash = full_hash(game)
+    return game
+
+def position_game(logged, move_index):
+    """The position just before logged move move_index, as a HeadlessGame"""
+    return board_to_game(replay(logged, move_index), logged.config)
+
+def profile_positions(path, solver=None, games=None):
+    """Run solver (csp_solver by default) on every logged position that led to a
+    left click and yield (game index, move index, logged seconds, seconds now)"""
+    if solver is None:
+        from CSP_solver import csp_solver as solver
+    for g, logged in enumerate(read_log(path)):
+        if games is not None and g not in games:
+            continue
+        board = ReplayBoard(logged.mines)
+        for i, (row, col, button, micros) in enumerate(zip(logged.moves["row"].tolist(), logged.moves["col"].tolist(),
+                                                           logged.moves["button"].tolist(),
+                                                           logged.moves["micros"].tolist())):
+            if button == LEFT_CLICK and i > 0:
+                game = board_to_game(board, logged.config)
+                start = time.perf_counter()
+                solver(game)
+                yield g, i, micros / 1e6, time.perf_counter() - start
+            board.apply(row, col, button)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Inspect and profile a binary move log")
+    parser.add_argument("path")
+    parser.add_argument("--game", type=int, default=None, help="Print this game's final board")
+    parser.add_argument("--profile", action="store_true", help="Re-time csp_solver on every logged position")
+    args = parser.parse_args()
+    logged_games = read_log(args.path)
+    results = {LOST: "lost", WON: "won", UNFINISHED: "unfinished"}
+    for g, logged in enumerate(logged_games):
+        total = logged.moves["micros"].sum() / 1e6
+        print(f"game {g}: {logged.config.width}x{logged.config.height} mines={logged.config.mines} "
+              f"seed={logged.seed} moves={len(logged)} solver_time={total:.3f}s {results[logged.result]}")
+    if args.game is not None:
+        board = replay(logged_games[args.game])
+        for r in range(board.mines.shape[0]):
+            print("".join("F" if board.flags[r, c] else "*" if board.visible[r, c] and board.mines[r, c]
+                          else str(board.counts[r, c]) if board.visible[r, c] else "." for c in range(board.mines.shape[1])))
+    if args.profile:
+        slowest = sorted(profile_positions(args.path), key=lambda x: -x[3])[:10]
+        for g, i, logged_s, now_s in slowest:
+            print(f"game {g} move {i}: logged {logged_s * 1000:.2f} ms, now {now_s * 1000:.2f} ms")
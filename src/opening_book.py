@@ -0,0 +1,277 @@
+import json
+import os
+import random
+import time
+import numpy as np
+from board_config import BoardConfig
+from watchdog import Supervisor
+
+LEFT_CLICK = 1
+BOOK_DIR = os.path.join("results", "opening_book")
+LAYOUTS = 2000
+GAMES = 200
+# second moves are kept for an opening clue seen in at least this many layouts
+MIN_SECOND = 20
+SECOND_MOVES = 5
+
+_books = {}
+_enabled = True
+
+
+def book_path(config, directory=BOOK_DIR):
+    return os.path.join(directory, f"{config.width}x{config.height}_{config.mines}_{config.first_click}.json")
+
+
+def symmetries(config):
+    """The board's symmetries as functions of (row, col): the flips, plus the
+    transposes on a square board. Mine layouts are equally likely under them,
+    so one cell per orbit is simulated"""
+    h, w = config.height - 1, config.width - 1
+    maps = [lambda r, c: (r, c), lambda r, c: (h - r, c), lambda r, c: (r, w - c), lambda r, c: (h - r, w - c)]
+    if config.width == config.height:
+        maps += [lambda r, c, f=f: f(c, r) for f in maps]
+    return maps
+
+def orbits(config):
+    """{representative cell: [(cell, symmetry index)]} covering every cell once"""
+    maps = symmetries(config)
+    seen = {}
+    for r in range(config.height):
+        for c in range(config.width):
+            if (r, c) not in seen:
+                for i, f in enumerate(maps):
+                    seen.setdefault(f(r, c), ((r, c), i))
+    result = {}
+    for cell, (rep, i) in seen.items():
+        result.setdefault(rep, []).append((cell, i))
+    return result
+
+
+def random_layout(config, cell, rng):
+    """Bool (H, W) mines placed uniformly where the first-click rule allows
+    them, given the first click at cell"""
+    allowed = np.array([[config.allows_mine(cell[0], cell[1], r, c) for c in range(config.width)]
+                        for r in range(config.height)])
+    mines = np.zeros(config.height * config.width, dtype=bool)
+    mines[rng.choice(np.flatnonzero(allowed.ravel()), config.mines, replace=False)] = True
+    return mines.reshape(config.height, config.width)
+
+def neighbour_counts(mines):
+    padded = np.pad(mines.astype(np.int8), 1)
+    height, width = mines.shape
+    return sum(padded[1 + dr:1 + dr + height, 1 + dc:1 + dc + width]
+               for dr in (-1, 0, 1) for dc in (-1, 0, 1) if (dr, dc) != (0, 0))
+
+def opened_areas(mines, counts):
+    """(H, W) number of cells a click opens on a fresh board: 0 on mines, 1 on
+    numbers, and for a 0 its whole opening. The games flood-fill orthogonally:
+    a 0 opens its non-mine orthogonal neighbours and the 0s among them go on"""
+    height, width = mines.shape
+    areas = np.where(mines, 0, 1)
+    done = np.zeros(mines.shape, dtype=bool)
+    for r0, c0 in zip(*np.nonzero((counts == 0) & ~mines)):
+        if done[r0, c0]:
+            continue
+        zeros = [(r0, c0)]
+        opened = {(r0, c0)}
+        done[r0, c0] = True
+        i = 0
+        while i < len(zeros):
+            r, c = zeros[i]
+            i += 1
+            for nr, nc in ((r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)):
+                if 0 <= nr < height and 0 <= nc < width and not mines[nr, nc] and (nr, nc) not in opened:
+                    opened.add((nr, nc))
+                    if counts[nr, nc] == 0:
+                        done[nr, nc] = True
+                        zeros.append((nr, nc))
+        for cell in zeros:
+            areas[cell] = len(opened)
+    return areas
+
+
+def simulate_opening(config, cell, seed, layouts=LAYOUTS, games=GAMES):
+    """Worker entry point: statistics of first click cell. Over `layouts`
+    random layouts, how often it is safe and the area it opens; when it opens
+    only itself, per clue value, how often each other cell is safe and the
+    area it would open. Then `games` csp_solver games opened at cell. Every
+    cell is simulated with the same seed, so the cells are compared on the
+    same random draws and their differences are not swamped by noise"""
+    from CSP_solver import HeadlessGame, csp_solver
+    use_books(False)
+    rng = np.random.default_rng(seed)
+    safe = 0
+    area = 0
+    second = {}
+    for _ in range(layouts):
+        mines = random_layout(config, cell, rng)
+        if mines[cell]:
+            continue
+        counts = neighbour_counts(mines)
+        areas = opened_areas(mines, counts)
+        safe += 1
+        area += int(areas[cell])
+        if areas[cell] == 1:
+            clue = int(counts[cell])
+            seen, safe_sum, area_sum = second.get(clue, (0, 0, 0))
+            second[clue] = (seen + 1, safe_sum + ~mines, area_sum + areas)
+    wins = 0
+    for g in range(games):
+        random.seed(seed * 1000 + g)
+        game = HeadlessGame(config=config)
+        game.click_handle(cell[0], cell[1], LEFT_CLICK)
+        while not game.game_won and not game.game_lost:
+            move = csp_solver(game)
+            if move is None:
+                break
+            game.click_handle(move[0], move[1], LEFT_CLICK)
+        wins += game.game_won
+    return {"seed": seed, "cell": cell, "layouts": layouts, "safe": safe, "area": area,
+            "games": games, "wins": wins, "second": second}
+
+
+class OpeningBook:
+    """First-click statistics of one board configuration: per cell the chance
+    the click is safe, the mean area it opens and the win rate of csp_solver
+    games opened there, and for openings that show a single clue the second
+    clicks opening the most cells"""
+
+    def __init__(self, data):
+        self.data = data
+        self.openings = {tuple(entry["cell"]): entry for entry in data["openings"]}
+        self.second = {(tuple(entry["cell"]), entry["clue"]): [tuple(move["cell"]) for move in entry["moves"]]
+                       for entry in data["second"]}
+        self.best = max(self.openings, key=lambda cell: (self.openings[cell]["win"],
+                                                          self.openings[cell]["safe"] * self.openings[cell]["area"]))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def second_moves(self, first, clue):
+        return self.second.get((first, clue), [])
+
+
+def use_books(enabled):
+    """Turn book moves in the solvers on or off for this process"""
+    global _enabled
+    _enabled = enabled
+
+def load_book(config, directory=BOOK_DIR):
+    """The OpeningBook of config, read from disk on first use, or None when
+    none was built. Looked up once per process"""
+    if not _enabled:
+        return None
+    key = (config, directory)
+    if key not in _books:
+        path = book_path(config, directory)
+        _books[key] = OpeningBook.load(path) if os.path.exists(path) else None
+    return _books[key]
+
+def opening_move(game):
+    """The book's first click for the game's configuration, None without a book
+    or once the game has started"""
+    if game.init:
+        return None
+    book = load_book(BoardConfig.from_game(game))
+    return None if book is None else book.best
+
+def second_move(game, risk):
+    """When exactly one cell is open, the book second click opening the most
+    cells among those no riskier than risk (the solver's best), else None"""
+    book = load_book(BoardConfig.from_game(game))
+    if book is None or not game.init:
+        return None
+    visible = [(r, c) for r, row in enumerate(game.grid) for c, cell in enumerate(row) if cell.is_visible]
+    if len(visible) != 1:
+        return None
+    from CSP_solver import probability_matrix
+    first = visible[0]
+    matrix = None
+    for r, c in book.second_moves(first, game.grid[first[0]][first[1]].bomb_count):
+        if not game.grid[r][c].is_visible and not game.grid[r][c].has_flag:
+            matrix = matrix or probability_matrix(game)
+            if matrix.get((r, c)) <= risk + 1e-12:
+                return (r, c)
+    return None
+
+
+def build_book(config, layouts=LAYOUTS, games=GAMES, workers=None, time_limit=None, directory=BOOK_DIR,
+               seed=0, verbose=True):
+    """Simulate every orbit of first clicks on supervised worker processes and
+    write the OpeningBook of config to directory"""
+    from sweep import preload
+    preload(["csp"])
+    reps = orbits(config)
+    maps = symmetries(config)
+    records = {}
+    start_time = time.time()
+    with Supervisor(simulate_opening, workers, time_limit, seed_index=2) as supervisor:
+        for cell in sorted(reps):
+            supervisor.submit(cell, (config, cell, seed, layouts, games))
+        for cell, record in supervisor.results():
+            if record["status"] != "ok":
+                if verbose:
+                    print(f"opening {cell}: {record['status']}")
+                continue
+            records[cell] = record
+    openings = []
+    second = []
+    for rep, record in sorted(records.items()):
+        entry = {"safe": record["safe"] / record["layouts"],
+                 "area": record["area"] / record["safe"] if record["safe"] else 0.0,
+                 "win": record["wins"] / record["games"] if record["games"] else 0.0,
+                 "layouts": record["layouts"], "games": record["games"]}
+        moves_of = {}
+        for clue, (seen, safe_sum, area_sum) in record["second"].items():
+            if seen < MIN_SECOND:
+                continue
+            safe_rate = safe_sum / seen
+            mean_area = area_sum / np.maximum(safe_sum, 1)
+            # the solver checks a second move's exact risk, so rank by the area it opens
+            safe_rate[rep] = -1.0
+            ranked = sorted(zip(*np.nonzero(safe_rate >= 0)), key=lambda c: (-mean_area[c], -safe_rate[c]))
+            moves_of[clue] = (seen, [(cell, float(safe_rate[cell]), float(mean_area[cell]))
+                                     for cell in ranked[:SECOND_MOVES]])
+        for cell, i in reps[rep]:
+            f = maps[i]
+            openings.append(dict(entry, cell=list(cell)))
+            for clue, (seen, moves) in sorted(moves_of.items()):
+                second.append({"cell": list(cell), "clue": clue, "layouts": seen,
+                               "moves": [{"cell": list(map(int, f(*move))), "safe": s, "area": a}
+                                         for move, s, a in moves]})
+    data = {"width": config.width, "height": config.height, "mines": config.mines,
+            "first_click": config.first_click, "layouts": layouts, "games": games,
+            "openings": sorted(openings, key=lambda e: e["cell"]), "second": second}
+    path = book_path(config, directory)
+    os.makedirs(directory, exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+    _books.pop((config, directory), None)
+    book = OpeningBook(data)
+    if verbose:
+        best = book.openings[book.best]
+        print(f"Built {path} from {len(records)} simulated openings in {time.time() - start_time:.1f} seconds")
+        print(f"Best opening {book.best}: safe {best['safe']:.3f}, area {best['area']:.1f}, "
+              f"csp win rate {best['win']:.3f}")
+    return book
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Build the first-click opening book of a board configuration")
+    parser.add_argument("--width", type=int, default=16)
+    parser.add_argument("--height", type=int, default=16)
+    parser.add_argument("--mines", type=int, default=40)
+    parser.add_argument("--first-click", default="neighborhood", choices=["none", "cell", "neighborhood"])
+    parser.add_argument("--layouts", type=int, default=LAYOUTS, help="Random layouts per opening cell")
+    parser.add_argument("--games", type=int, default=GAMES, help="csp_solver games per opening cell")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--time-limit", type=float, default=None, help="Seconds per opening cell")
+    parser.add_argument("--dir", default=BOOK_DIR)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    build_book(BoardConfig(args.width, args.height, args.mines, args.first_click), args.layouts, args.games,
+               args.workers, args.time_limit, args.dir, args.seed)
@@ -0,0 +1,319 @@
+import sys
+import time
+from math import comb
+from itertools import combinations, product
+import numpy as np
+from board_config import BoardConfig
+from movelog import ReplayBoard, board_to_game, LEFT_CLICK
+
+# Engines are checked against one of two exact answers, computed by brute force:
+#   "cluster"  fn(cluster, cluster_constraints) -> {cell: p}; p is the share of
+#              the cluster's assignments satisfying its clues (what the CSP/DP
+#              cluster solvers compute; the mine total is ignored)
+#   "global"   fn(game) -> (H, W) array, NaN on revealed cells; p is the share of
+#              full-board layouts consistent with every clue and the mine total
+ENGINES = {}
+MAX_CLUSTER = 16
+MAX_LAYOUTS = 200000
+
+# Clusters whose clues no assignment satisfies, as a wrong flag leaves them; a
+# cluster engine must answer 1.0 for every cell like exact_cluster does. The
+# first row-reduces to 2x = 1 with no free cell left
+CONTRADICTIONS = [
+    ([(0, 0), (0, 1), (0, 2)], {"a": (1, [(0, 0), (0, 1)]), "b": (1, [(0, 1), (0, 2)]), "c": (1, [(0, 0), (0, 2)])}),
+    ([(0, 0), (0, 1)], {"a": (2, [(0, 0), (0, 1)]), "b": (0, [(0, 0)])}),
+    ([(0, 0), (0, 1), (0, 2)], {"a": (3, [(0, 0), (0, 1)])}),
+]
+
+
+def register_engine(name, semantics, tolerance=1e-9):
+    """Decorator adding a probability engine to the oracle's registry"""
+    if semantics not in ("cluster", "global"):
+        raise ValueError(f"unknown semantics {semantics!r}")
+
+    def register(fn):
+        ENGINES[name] = (semantics, tolerance, fn)
+        return fn
+    return register
+
+@register_engine("csp", "cluster")
+def _csp(cluster, constraints):
+    from CSP_solver import csp_cluster_solver
+    return csp_cluster_solver(cluster, constraints)
+
+@register_engine("csp-backtrack", "cluster")
+def _csp_backtrack(cluster, constraints):
+    from CSP_solver import csp_cluster_solver
+    return csp_cluster_solver(cluster, constraints, reduce=False)
+
+@register_engine("dp", "cluster")
+def _dp(cluster, constraints):
+    from dp_solver import dp_cluster_solver_dp
+    return dp_cluster_solver_dp(cluster, constraints)
+
+@register_engine("dp-backtrack", "cluster")
+def _dp_backtrack(cluster, constraints):
+    from dp_solver import dp_cluster_solver_dp
+    return dp_cluster_solver_dp(cluster, constraints, reduce=False)
+
+@register_engine("layouts", "global")
+def _layouts(game):
+    from sampler import PosteriorSampler
+    from endgame import enumerate_layouts
+    sampler = PosteriorSampler(game)
+    layouts = enumerate_layouts(sampler, MAX_LAYOUTS)
+    counts = np.zeros(sampler.height * sampler.width)
+    for layout in layouts:
+        counts[list(layout)] += 1
+    probs = (counts / len(layouts)).reshape(sampler.height, sampler.width)
+    probs[~sampler.hidden] = np.nan
+    return probs
+
+@register_engine("sampler", "global", tolerance=0.05)
+def _sampler(game):
+    from sampler import sample_probabilities
+    return sample_probabilities(game, 4000, np.random.default_rng(0))
+
+@register_engine("sampler-mcmc", "global", tolerance=0.05)
+def _sampler_mcmc(game):
+    # max_solutions=0 sends every component to the MCMC fallback
+    from sampler import PosteriorSampler
+    sampler = PosteriorSampler(game, max_solutions=0)
+    probs = sampler.sample(8000, np.random.default_rng(0)).mean(axis=0)
+    probs[~sampler.hidden] = np.nan
+    return probs
+
+
+class Position:
+    """A true mine layout plus what the player sees of it. Any position built
+    this way is consistent, which is what lets the shrinker edit it freely"""
+
+    def __init__(self, mines, visible, flags):
+        self.mines = mines
+        self.visible = visible & ~mines
+        self.flags = flags & mines & ~self.visible
+
+    def game(self):
+        board = ReplayBoard(self.mines)
+        board.visible = self.visible.copy()
+        board.flags = self.flags.copy()
+        height, width = self.mines.shape
+        return board_to_game(board, BoardConfig(width, height, max(int(self.mines.sum()), 1), "none"))
+
+    def render(self):
+        rows = []
+        counts = ReplayBoard(self.mines).counts
+        for r in range(self.mines.shape[0]):
+            seen = "".join("F" if self.flags[r, c] else str(counts[r, c]) if self.visible[r, c] else "."
+                           for c in range(self.mines.shape[1]))
+            truth = "".join("*" if m else "-" for m in self.mines[r])
+            rows.append(f"{seen}   {truth}")
+        return "\n".join(rows)
+
+    def candidates(self):
+        """Smaller positions: a border row/column cropped, a mine, flag or
+        revealed cell removed"""
+        height, width = self.mines.shape
+        crops = []
+        if height > 1:
+            crops += [np.s_[1:, :], np.s_[:-1, :]]
+        if width > 1:
+            crops += [np.s_[:, 1:], np.s_[:, :-1]]
+        for crop in crops:
+            yield Position(self.mines[crop], self.visible[crop], self.flags[crop])
+        for r, c in zip(*np.nonzero(self.mines)):
+            if self.mines.sum() > 1:
+                mines = self.mines.copy()
+                mines[r, c] = False
+                yield Position(mines, self.visible, self.flags)
+        for mask in ("flags", "visible"):
+            for r, c in zip(*np.nonzero(getattr(self, mask))):
+                edited = getattr(self, mask).copy()
+                edited[r, c] = False
+                yield Position(self.mines, edited if mask == "visible" else self.visible,
+                               edited if mask == "flags" else self.flags)
+
+
+def random_position(rng, max_size=6):
+    """Random small board part-way through a game: some safe cells clicked
+    (flood fill included) and some mines flagged"""
+    height, width = rng.integers(2, max_size + 1, size=2)
+    mines = np.zeros(height * width, dtype=bool)
+    mines[rng.choice(height * width, size=rng.integers(1, max(2, height * width // 3)), replace=False)] = True
+    mines = mines.reshape(height, width)
+    board = ReplayBoard(mines)
+    safe = np.flatnonzero(~mines.ravel())
+    for idx in rng.choice(safe, size=rng.integers(1, len(safe) + 1), replace=False)[:rng.integers(1, 5)]:
+        board.apply(int(idx) // width, int(idx) % width, LEFT_CLICK)
+    flags = mines & (rng.random(mines.shape) < 0.3)
+    return Position(mines, board.visible, flags)
+
+
+def exact_cluster(cluster, constraints):
+    """Brute-force share of satisfying assignments in which each cell is a mine"""
+    index = {cell: i for i, cell in enumerate(cluster)}
+    rows = [(req, [index[cell] for cell in cells]) for req, cells in constraints.values()]
+    total = 0
+    mines = np.zeros(len(cluster))
+    for assignment in product((0, 1), repeat=len(cluster)):
+        if all(sum(assignment[i] for i in idx) == req for req, idx in rows):
+            total += 1
+            mines += assignment
+    if total == 0:
+        return {cell: 1.0 for cell in cluster}
+    return {cell: mines[i] / total for i, cell in enumerate(cluster)}
+
+def exact_global(position):
+    """Brute-force mine probability of every hidden unflagged cell over all
+    full-board layouts matching the clues and the mine total, NaN elsewhere"""
+    height, width = position.mines.shape
+    hidden = ~position.visible & ~position.flags
+    cells = np.flatnonzero(hidden.ravel())
+    mines_left = int(position.mines.sum() - position.flags.sum())
+    if comb(len(cells), mines_left) > MAX_LAYOUTS:
+        return None
+    counts = ReplayBoard(position.mines).counts
+    clue_rows = []
+    clue_req = []
+    column = {idx: j for j, idx in enumerate(cells)}
+    for r, c in zip(*np.nonzero(position.visible)):
+        row = np.zeros(len(cells), dtype=np.int64)
+        required = int(counts[r, c])
+        for nr in range(max(r - 1, 0), min(r + 2, height)):
+            for nc in range(max(c - 1, 0), min(c + 2, width)):
+                if (nr, nc) == (r, c):
+                    continue
+                if position.flags[nr, nc]:
+                    required -= 1
+                elif hidden[nr, nc]:
+                    row[column[nr * width + nc]] = 1
+        clue_rows.append(row)
+        clue_req.append(required)
+    chunk = []
+    kept = []
+    matrix = np.array(clue_rows, dtype=np.int64).reshape(len(clue_rows), len(cells))
+    req = np.array(clue_req, dtype=np.int64)
+
+    def flush():
+        block = np.zeros((len(chunk), len(cells)), dtype=np.int64)
+        for i, combo in enumerate(chunk):
+            block[i, list(combo)] = 1
+        kept.append(block[((block @ matrix.T) == req).all(axis=1)])
+        chunk.clear()
+
+    for combo in combinations(range(len(cells)), mines_left):
+        chunk.append(combo)
+        if len(chunk) == 8192:
+            flush()
+    flush()
+    layouts = np.concatenate(kept)
+    probs = np.full((height, width), np.nan)
+    probs.ravel()[cells] = layouts.mean(axis=0)
+    return probs
+
+
+def check(name, position):
+    """Largest error of engine name on position (inf if it raised or left a
+    cell out), or None when the position is too large to brute-force"""
+    semantics, tolerance, fn = ENGINES[name]
+    game = position.game()
+    if semantics == "global":
+        expected = exact_global(position)
+        if expected is None:
+            return None
+        try:
+            got = np.asarray(fn(game), dtype=float)
+        except Exception:
+            return float("inf")
+        if got.shape != expected.shape or not np.array_equal(np.isnan(got), np.isnan(expected)):
+            return float("inf")
+        return float(np.nan_to_num(np.abs(got - expected)).max())
+    from CSP_solver import get_frontier_cells, get_constraints, group_frontier_by_constraints, get_cluster_constraints
+    frontier = get_frontier_cells(game)
+    constraints = get_constraints(game, frontier)
+    error = 0.0
+    for cluster in group_frontier_by_constraints(frontier, constraints):
+        if len(cluster) > MAX_CLUSTER:
+            return None
+        error = max(error, cluster_error(fn, cluster, get_cluster_constraints(cluster, constraints)))
+    return error
+
+def cluster_error(fn, cluster, cluster_constraints):
+    """Largest error of cluster engine fn against exact_cluster, inf if it
+    raised or left a cell out"""
+    expected = exact_cluster(cluster, cluster_constraints)
+    try:
+        got = fn(list(cluster), dict(cluster_constraints))
+    except Exception:
+        return float("inf")
+    if set(got) != set(expected):
+        return float("inf")
+    return max(abs(got[cell] - expected[cell]) for cell in cluster)
+
+def failing(name, position):
+    error = check(name, position)
+    return error is not None and error > ENGINES[name][1]
+
+def shrink(name, position):
+    """Greedily apply size-reducing edits while engine name still fails"""
+    improved = True
+    while improved:
+        improved = False
+        for smaller in position.candidates():
+            if failing(name, smaller):
+                position = smaller
+                improved = True
+                break
+    return position
+
+
+def run_oracle(engines=None, positions=200, seed=0, max_size=6, verbose=True):
+    """Compare every engine (all registered by default) with brute force on
+    random small positions; returns {engine: shrunk failing Position, failing
+    (cluster, constraints) from CONTRADICTIONS, or None}"""
+    rng = np.random.default_rng(seed)
+    engines = engines or list(ENGINES)
+    failures = {name: None for name in engines}
+    checked = {name: 0 for name in engines}
+    start_time = time.time()
+    for name in engines:
+        semantics, tolerance, fn = ENGINES[name]
+        if semantics == "cluster":
+            for cluster, cluster_constraints in CONTRADICTIONS:
+                if failures[name] is None and cluster_error(fn, cluster, cluster_constraints) > tolerance:
+                    failures[name] = (cluster, cluster_constraints)
+    for _ in range(positions):
+        position = random_position(rng, max_size)
+        for name in engines:
+            if failures[name] is not None:
+                continue
+            error = check(name, position)
+            if error is None:
+                continue
+            checked[name] += 1
+            if error > ENGINES[name][1]:
+                failures[name] = shrink(name, position)
+    if verbose:
+        for name in engines:
+            if failures[name] is None:
+                print(f"{name:>14} ({ENGINES[name][0]}): ok on {checked[name]} positions")
+            elif isinstance(failures[name], tuple):
+                print(f"{name:>14} ({ENGINES[name][0]}): FAILED on contradictory clues {failures[name][1]}")
+            else:
+                minimal = failures[name]
+                print(f"{name:>14} ({ENGINES[name][0]}): FAILED, error {check(name, minimal):.4g}, minimal position "
+                      "(seen   truth):")
+                print(minimal.render())
+        print(f"Checked {positions} positions in {time.time() - start_time:.2f} seconds")
+    return failures
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Check probability engines against brute-force enumeration")
+    parser.add_argument("--engines", nargs="+", default=None, choices=sorted(ENGINES))
+    parser.add_argument("--positions", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-size", type=int, default=6)
+    args = parser.parse_args()
+    results = run_oracle(args.engines, args.positions, args.seed, args.max_size)
+    sys.exit(1 if any(p is not None for p in results.values()) else 0)
@@ -0,0 +1,369 @@
+import json
+import os
+import random
+import time
+import multiprocessing as mp
+from multiprocessing.connection import wait
+import numpy as np
+from board_config import BoardConfig
+
+HIDDEN = -1
+FLAGGED = -2
+DEADLINE = 1.0
+HEAD_START = 0.05
+SAMPLE_BATCHES = (500, 2000, 8000, 32000)
+FEATURES = ("clusters", "max_cluster", "frontier", "max_clues", "max_span", "fill", "hidden", "mines_left")
+
+_active = None
+
+
+def encode_position(game):
+    """int8 (H, W) array of what a solver may see: the count on revealed cells,
+    HIDDEN or FLAGGED elsewhere. Small to send to a worker, unlike the game"""
+    codes = np.full((game.squares_y, game.squares_x), HIDDEN, dtype=np.int8)
+    for r, row in enumerate(game.grid):
+        for c, cell in enumerate(row):
+            if cell.is_visible:
+                codes[r, c] = cell.bomb_count
+            elif cell.has_flag:
+                codes[r, c] = FLAGGED
+    return codes
+
+def decode_position(codes, num_bombs):
+    """HeadlessGame showing an encoded position (its mines are unknown)"""
+    from CSP_solver import HeadlessGame
+    from zobrist import full_hash
+    height, width = codes.shape
+    game = HeadlessGame(config=BoardConfig(width, height, num_bombs, "none"))
+    for r, row in enumerate(game.grid):
+        for c, cell in enumerate(row):
+            cell.test = True
+            cell.is_visible = codes[r, c] >= 0
+            cell.bomb_count = max(int(codes[r, c]), 0)
+            cell.has_flag = codes[r, c] == FLAGGED
+    game.init = True
+    game.flag_count = int((codes == FLAGGED).sum())
+    game.state_hash = full_hash(game)
+    return game
+
+
+# Engines are generators over a decoded game yielding (exact, probs, clusters,
+# quality): an exact engine yields once, an approximate one yields better
+# estimates as it goes and quality ranks them
+def _cluster_engine(cluster_solver_name, reduce):
+    def run(game):
+        import CSP_solver
+        import dp_solver
+        solver = getattr(CSP_solver, cluster_solver_name, None) or getattr(dp_solver, cluster_solver_name)
+        matrix = CSP_solver.probability_matrix(game, solver, reduce)
+        yield True, np.array(matrix.probs), matrix.clusters, 0
+    return run
+
+def _sample_engine(game):
+    from sampler import PosteriorSampler
+    sampler = PosteriorSampler(game)
+    rng = np.random.default_rng(0)
+    total = np.zeros((sampler.height, sampler.width))
+    drawn = 0
+    for batch in SAMPLE_BATCHES:
+        total += sampler.sample(batch, rng).sum(axis=0)
+        drawn += batch
+        probs = total / drawn
+        probs[~sampler.hidden] = np.nan
+        yield False, probs, [], drawn
+
+ENGINES = {
+    "gauss": _cluster_engine("csp_cluster_solver", True),
+    "backtrack": _cluster_engine("csp_cluster_solver", False),
+    "dp": _cluster_engine("dp_cluster_solver_dp", False),
+    "sample": _sample_engine,
+}
+
+
+def _engine_main(conn, name):
+    engine = ENGINES[name]
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        position_id, codes, num_bombs = task
+        try:
+            for exact, probs, clusters, quality in engine(decode_position(codes, num_bombs)):
+                conn.send((position_id, "exact" if exact else "approx", (probs, clusters, quality)))
+        except Exception as exc:
+            conn.send((position_id, "error", repr(exc)))
+        conn.send((position_id, "done", None))
+
+
+class EngineWorker:
+    """One engine in its own process. Killing it is how a losing engine is
+    cancelled; a fresh one is forked for the next position"""
+
+    def __init__(self, name):
+        self.name = name
+        self.conn, child = mp.Pipe()
+        self.process = mp.Process(target=_engine_main, args=(child, name), daemon=True)
+        self.process.start()
+        child.close()
+        self.busy = False
+
+    def send(self, task):
+        self.busy = True
+        self.conn.send(task)
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, BrokenPipeError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+def cluster_features(game):
+    """Cheap description of a position's frontier for choosing an engine"""
+    from CSP_solver import get_frontier_cells, get_constraints, group_frontier_by_constraints
+    frontier = get_frontier_cells(game)
+    constraints = get_constraints(game, frontier)
+    clusters = group_frontier_by_constraints(frontier, constraints)
+    largest = max(clusters, key=len, default=[])
+    rows = [r for r, _ in largest]
+    cols = [c for _, c in largest]
+    span = (max(rows) - min(rows) + 1, max(cols) - min(cols) + 1) if largest else (0, 0)
+    largest_set = set(largest)
+    hidden = sum(1 for row in game.grid for cell in row if not cell.is_visible and not cell.has_flag)
+    flags = sum(1 for row in game.grid for cell in row if cell.has_flag)
+    return {
+        "clusters": len(clusters),
+        "max_cluster": len(largest),
+        "frontier": len(frontier),
+        "max_clues": sum(1 for _, cells in constraints.values() if largest_set.intersection(cells)),
+        "max_span": max(span),
+        "fill": len(largest) / (span[0] * span[1]) if largest else 0.0,
+        "hidden": hidden,
+        "mines_left": game.num_bombs - flags,
+    }
+
+
+class EngineSelector:
+    """k-nearest-neighbour guess of the fastest exact engine from cluster
+    features, fitted on a portfolio winner log"""
+
+    def __init__(self, records, k=5):
+        records = [r for r in records if r["exact"]]
+        self.k = k
+        self.labels = [r["winner"] for r in records]
+        self.points = np.array([[r["features"][f] for f in FEATURES] for r in records], dtype=float)
+        self.points = self.points.reshape(len(records), len(FEATURES))
+        self.scale = self.points.std(axis=0) if len(records) else np.ones(len(FEATURES))
+        self.scale[self.scale == 0] = 1.0
+
+    @classmethod
+    def from_log(cls, path, k=5):
+        with open(path) as f:
+            return cls([json.loads(line) for line in f if line.strip()], k)
+
+    def predict(self, features):
+        """Engine names, most likely winner first"""
+        if not self.labels:
+            return list(ENGINES)
+        x = np.array([features[f] for f in FEATURES], dtype=float)
+        nearest = np.argsort((((self.points - x) / self.scale) ** 2).sum(axis=1))[:self.k]
+        votes = {}
+        for i in nearest:
+            votes[self.labels[i]] = votes.get(self.labels[i], 0) + 1
+        ranked = sorted(votes, key=lambda name: -votes[name])
+        return ranked + [name for name in ENGINES if name not in ranked]
+
+    def accuracy(self):
+        """Leave-one-out accuracy on the training log"""
+        hits = 0
+        for i in range(len(self.labels)):
+            d = (((self.points - self.points[i]) / self.scale) ** 2).sum(axis=1)
+            d[i] = np.inf
+            nearest = np.argsort(d)[:self.k]
+            votes = {}
+            for j in nearest:
+                votes[self.labels[j]] = votes.get(self.labels[j], 0) + 1
+            hits += max(votes, key=votes.get) == self.labels[i] if votes else 0
+        return hits / len(self.labels) if self.labels else 0.0
+
+
+class Portfolio:
+    """Races probability engines on a position in parallel worker processes.
+    The first exact answer wins; if none arrives by the deadline the best
+    approximate one is taken (or the first answer of any kind, if there is
+    none yet). Engines still running are killed and respawned. Each race is
+    appended to log_path as a JSON line of cluster features and the winner.
+    With a selector, its first choice runs alone for head_start seconds
+    before the others are launched"""
+
+    def __init__(self, engines=None, deadline=DEADLINE, log_path=None, selector=None, head_start=HEAD_START):
+        self.names = list(engines or ENGINES)
+        self.deadline = deadline
+        self.selector = selector
+        self.head_start = head_start
+        self.workers = {name: EngineWorker(name) for name in self.names}
+        self.log = open(log_path, "a") if log_path else None
+        self.position_id = 0
+        self.wins = {}
+
+    def _respawn(self, name):
+        self.workers[name].kill()
+        self.workers[name] = EngineWorker(name)
+
+    def solve(self, game):
+        """ProbabilityMatrix of the position with .engine and .exact set"""
+        from CSP_solver import ProbabilityMatrix
+        self.position_id += 1
+        task = (self.position_id, encode_position(game), game.num_bombs)
+        features = cluster_features(game) if self.log or self.selector else None
+        order = self.selector.predict(features) if self.selector else self.names
+        order = [name for name in order if name in self.workers]
+        pending = order[1:] if self.selector else []
+        for name in order if not self.selector else order[:1]:
+            self.workers[name].send(task)
+        start = time.perf_counter()
+        winner = None
+        best = None
+        while True:
+            elapsed = time.perf_counter() - start
+            if pending and elapsed >= self.head_start:
+                for name in pending:
+                    self.workers[name].send(task)
+                pending = []
+            busy = {self.workers[name].conn: name for name in order if self.workers[name].busy}
+            if not busy and not pending:
+                break
+            if elapsed >= self.deadline and best is not None:
+                break
+            limit = self.head_start if pending else self.deadline
+            ready = wait(list(busy), timeout=max(limit - elapsed, 0.0) if elapsed < self.deadline else None)
+            for conn in ready:
+                name = busy[conn]
+                try:
+                    position_id, kind, payload = conn.recv()
+                except EOFError:
+                    self._respawn(name)
+                    continue
+                if position_id != self.position_id:
+                    continue
+                if kind == "done":
+                    self.workers[name].busy = False
+                elif kind == "exact":
+                    winner = (name, payload)
+                elif kind == "approx" and (best is None or payload[2] > best[1][2]):
+                    best = (name, payload)
+            if winner is not None:
+                break
+        seconds = time.perf_counter() - start
+        if winner is not None:
+            worker = self.workers[winner[0]]
+            worker.conn.recv()
+            worker.busy = False
+        for name in order:
+            if self.workers[name].busy:
+                self._respawn(name)
+        if winner is None and best is None:
+            # every engine failed; fall back to solving in this process
+            from CSP_solver import probability_matrix
+            result = probability_matrix(game)
+            result.engine, result.exact = "inline", True
+            return result
+        exact = winner is not None
+        name, (probs, clusters, quality) = winner if exact else best
+        self.wins[name] = self.wins.get(name, 0) + 1
+        if self.log is not None:
+            self.log.write(json.dumps({"features": features, "winner": name, "exact": exact,
+                                       "quality": quality, "seconds": seconds}) + "\n")
+            self.log.flush()
+        hidden = ~np.isnan(probs)
+        default_prob = float(np.nanmean(probs)) if hidden.any() else 1.0
+        result = ProbabilityMatrix(probs, clusters, default_prob, None)
+        result.engine = name
+        result.exact = exact
+        return result
+
+    def close(self):
+        for worker in self.workers.values():
+            worker.stop()
+        if self.log is not None:
+            self.log.close()
+
+
+def enable(engines=None, deadline=DEADLINE, log_path=None, selector=None):
+    """Make portfolio_solver race engines on a shared Portfolio from now on"""
+    global _active
+    disable()
+    _active = Portfolio(engines, deadline, log_path, selector)
+    return _active
+
+def disable():
+    global _active
+    if _active is not None:
+        _active.close()
+        _active = None
+
+def portfolio_solver(game, stats=None):
+    """csp_solver's move rule on probabilities from the active portfolio. An
+    estimate that missed the deadline can round a cell to exactly 0 without
+    proving it, so only an exact answer is trusted to call cells safe"""
+    hidden = [(r, c) for r in range(game.squares_y) for c in range(game.squares_x)
+              if not game.grid[r][c].is_visible and not game.grid[r][c].has_flag]
+    if not game.init or not hidden:
+        return random.choice(hidden) if hidden else None
+    portfolio = _active or enable()
+    matrix = portfolio.solve(game)
+    safe = matrix.safe_cells() if matrix.exact else []
+    if safe:
+        return random.choice(safe)
+    from endgame import endgame_move
+    move = endgame_move(game)
+    if move is not None:
+        return move
+    return matrix.safest()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Play games with engines raced per position")
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--width", type=int, default=30)
+    parser.add_argument("--height", type=int, default=16)
+    parser.add_argument("--mines", type=int, default=99)
+    parser.add_argument("--engines", nargs="+", default=None, choices=sorted(ENGINES))
+    parser.add_argument("--deadline", type=float, default=DEADLINE, help="Seconds before settling for an estimate")
+    parser.add_argument("--log", default=os.path.join("results", "portfolio.jsonl"), help="Winner log")
+    parser.add_argument("--selector", action="store_true", help="Give the engine the log predicts a head start")
+    args = parser.parse_args()
+    os.makedirs(os.path.dirname(args.log) or ".", exist_ok=True)
+    selector = None
+    if args.selector and os.path.exists(args.log):
+        selector = EngineSelector.from_log(args.log)
+        print(f"Selector leave-one-out accuracy: {selector.accuracy():.2f} on {len(selector.labels)} positions")
+    portfolio = enable(args.engines, args.deadline, args.log, selector)
+    from CSP_solver import HeadlessGame, LEFT_CLICK
+    wins = 0
+    start_time = time.time()
+    for seed in range(args.games):
+        random.seed(seed)
+        game = HeadlessGame(config=BoardConfig(args.width, args.height, args.mines, "neighborhood"))
+        while not game.game_won and not game.game_lost:
+            move = portfolio_solver(game)
+            if move is None:
+                break
+            game.click_handle(move[0], move[1], LEFT_CLICK)
+        wins += game.game_won
+    print(f"Won {wins}/{args.games} in {time.time() - start_time:.2f} seconds")
+    print("Engine wins: " + ", ".join(f"{name}={count}" for name, count in sorted(portfolio.wins.items())))
+    disable()
@@ -0,0 +1,88 @@
+import json
+import os
+
+RESULTS_DIR = "results"
+
+
+class ResultStore:
+    """Append-only JSONL file of per-game benchmark records, results/<run_id>.jsonl.
+    Each record is flushed and fsynced as soon as its game finishes, so an
+    interrupted run loses at most the game in flight; reopening the same run_id
+    reports which seeds are done so the run can pick up where it stopped"""
+
+    def __init__(self, run_id, meta=None, directory=RESULTS_DIR):
+        self.run_id = run_id
+        self.meta = meta or {}
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{run_id}.jsonl")
+        self._repair()
+        for record in self.records():
+            mismatched = {k: (record.get(k), v) for k, v in self.meta.items() if record.get(k) != v}
+            if mismatched:
+                raise ValueError(f"run {run_id!r} was started with different settings: {mismatched}")
+            break
+
+    def _repair(self):
+        """Drop a half-written last line left by a crash"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def records(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def completed_seeds(self):
+        return {record["seed"] for record in self.records()}
+
+    def append(self, record):
+        line = json.dumps({**self.meta, **record}, separators=(",", ":"))
+        with open(self.path, "a") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def summary(self, seeds=None):
+        """Totals over the records on disk (optionally only the given seeds)"""
+        records = [r for r in self.records() if seeds is None or r["seed"] in seeds]
+        games = len(records)
+        wins = sum(1 for r in records if r["won"])
+        return {
+            "run_id": self.run_id,
+            **self.meta,
+            "games": games,
+            "wins": wins,
+            "losses": games - wins,
+            "win_rate": (wins / games) * 100 if games else 0.0,
+            "avg_exploration": sum(r["exploration"] for r in records) / games if games else 0.0,
+            "avg_moves": sum(r["moves"] for r in records) / games if games else 0.0,
+            "time_taken": sum(r["time"] for r in records),
+        }
+
+
+def game_record(record):
+    """The per-game fields a ResultStore keeps from a play_game record"""
+    return {
+        "seed": record["seed"],
+        "won": bool(record["won"]),
+        "exploration": record["exploration"],
+        "moves": record["moves"],
+        "time": sum(record["move_times"]),
+        "max_cluster": record.get("max_cluster", 0),
+    }
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Summarise a (possibly still running) benchmark run")
+    parser.add_argument("run_id")
+    parser.add_argument("--dir", default=RESULTS_DIR)
+    args = parser.parse_args()
+    if not os.path.exists(os.path.join(args.dir, f"{args.run_id}.jsonl")):
+        parser.error(f"no results for run {args.run_id!r} in {args.dir}/")
+    for key, value in ResultStore(args.run_id, directory=args.dir).summary().items():
+        print(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
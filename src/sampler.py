@@ -0,0 +1,397 @@
+import numpy as np
+from math import comb, lgamma, inf
+from CSP_solver import get_neighbors, group_frontier_by_constraints, get_cluster_constraints
+from gauss_reduce import reduce_cluster
+
+MAX_SOLUTIONS = 100000
+# MCMC fallback: free cells resampled together in one block update, chains run
+# side by side, and sweeps before the first sample and between samples
+BLOCK = 8
+CHAINS = 256
+BURN_IN = 50
+THIN = 2
+
+
+class TooManySolutions(Exception):
+    pass
+
+
+def neighbor_counts(layouts):
+    """Number of mines around every cell, for a (batch, H, W) bool array"""
+    padded = np.pad(layouts.astype(np.int8), ((0, 0), (1, 1), (1, 1)))
+    h, w = layouts.shape[1:]
+    counts = np.zeros(layouts.shape, dtype=np.int8)
+    for dr in (0, 1, 2):
+        for dc in (0, 1, 2):
+            if dr != 1 or dc != 1:
+                counts += padded[:, dr:dr + h, dc:dc + w]
+    return counts
+
+
+def clue_constraints(game):
+    """Frontier and constraints like get_frontier_cells/get_constraints, but zero
+    clues are kept too: the orthogonal flood fill can leave a 0 cell with hidden
+    diagonal neighbours, and those must be mine-free in every layout"""
+    frontier = set()
+    constraints = {}
+    for r in range(game.squares_y):
+        for c in range(game.squares_x):
+            cell = game.grid[r][c]
+            if not cell.is_visible or cell.has_bomb:
+                continue
+            hidden = []
+            flagged = 0
+            for nr, nc in get_neighbors(r, c, game.squares_y, game.squares_x):
+                neighbor = game.grid[nr][nc]
+                if neighbor.has_flag:
+                    flagged += 1
+                elif not neighbor.is_visible:
+                    hidden.append((nr, nc))
+            if hidden:
+                frontier.update(hidden)
+                constraints[(r, c)] = (cell.bomb_count - flagged, hidden)
+    return frontier, constraints
+
+
+class PosteriorSampler:
+    """Draws full mine layouts uniformly among those consistent with the visible
+    clues and the remaining mine count. Every frontier cluster is row-reduced and
+    split into independent components, whose solutions are tabulated by mine
+    count; the joint mine split between components and the unconstrained
+    interior is then sampled exactly with binomial weights. If a component has
+    more than max_solutions solutions, sample() falls back to MCMC: Gibbs
+    updates that only ever move between layouts satisfying every clue"""
+
+    def __init__(self, game, max_solutions=MAX_SOLUTIONS):
+        self.height = game.squares_y
+        self.width = game.squares_x
+        self.flags = np.zeros((self.height, self.width), dtype=bool)
+        self.hidden = np.zeros((self.height, self.width), dtype=bool)
+        for r in range(self.height):
+            for c in range(self.width):
+                cell = game.grid[r][c]
+                self.flags[r, c] = cell.has_flag
+                self.hidden[r, c] = not cell.is_visible and not cell.has_flag
+        self.mines_left = game.num_bombs - int(self.flags.sum())
+
+        frontier, self.constraints = clue_constraints(game)
+        self.units = []
+        # components with too many solutions to tabulate: (cluster, system, positions, row_ids)
+        self.large = []
+        fixed = []
+        self.exact = True
+        for cluster in group_frontier_by_constraints(frontier, self.constraints):
+            system = reduce_cluster(cluster, get_cluster_constraints(cluster, self.constraints))
+            if system is None:
+                raise ValueError("visible clues are contradictory")
+            fixed.extend(cluster[idx] for idx, val in system.forced.items() if val == 1)
+            for positions, row_ids in system.components():
+                members = [system.free[pos] for pos in positions] + [system.pivot_rows[r][0] for r in row_ids]
+                solutions = []
+
+                def on_solution(assignment, members=members, solutions=solutions):
+                    solutions.append([assignment[idx] for idx in members])
+                    if len(solutions) > max_solutions:
+                        raise TooManySolutions()
+
+                try:
+                    system.search(on_solution, positions, row_ids)
+                except TooManySolutions:
+                    self.exact = False
+                    self.large.append((cluster, system, positions, row_ids))
+                    continue
+                cells = np.array([cluster[idx][0] * self.width + cluster[idx][1] for idx in members])
+                table = np.array(solutions, dtype=bool).reshape(len(solutions), len(members))
+                self.units.append((cells, table, table.sum(axis=1)))
+
+        self.fixed = np.array([r * self.width + c for r, c in fixed], dtype=np.int64)
+        interior = self.hidden.copy()
+        for r, c in frontier:
+            interior[r, c] = False
+        self.interior = np.flatnonzero(interior)
+        self.free_mines = self.mines_left - len(self.fixed)
+        self._chains = None
+        if self.exact:
+            self._build_tables()
+
+    def _build_tables(self):
+        # suffix[j][s]: ways to place s mines in units j.. (exact ints)
+        suffix = [[1]]
+        for _, _, counts in reversed(self.units):
+            table = np.bincount(counts).tolist()
+            nxt = suffix[0]
+            cur = [0] * (len(nxt) + len(table) - 1)
+            for k, ways in enumerate(table):
+                if ways:
+                    for s, rest in enumerate(nxt):
+                        cur[s + k] += ways * rest
+            suffix.insert(0, cur)
+        self.suffix = suffix
+        u = len(self.interior)
+        weights = [rest * _comb(u, self.free_mines - s) for s, rest in enumerate(suffix[0])]
+        self.total_weight = sum(weights)
+        if self.total_weight == 0:
+            raise ValueError("no layout fits the clues and the remaining mine count")
+        self.total_probs = np.array([w / self.total_weight for w in weights])
+
+    def layout_count(self):
+        """Exact number of consistent layouts (exact mode only)"""
+        return self.total_weight
+
+    def sample(self, batch, rng=None):
+        """(batch, H, W) bool array of mine layouts; flagged cells count as mines"""
+        rng = np.random.default_rng(rng)
+        if not self.exact:
+            return self.mcmc(batch, rng)
+        flat = np.zeros((batch, self.height * self.width), dtype=bool)
+        flat[:, self.flags.ravel()] = True
+        flat[:, self.fixed] = True
+        remaining = rng.choice(len(self.total_probs), size=batch, p=self.total_probs)
+        for j, (cells, table, counts) in enumerate(self.units):
+            ways = np.bincount(counts)
+            rest = self.suffix[j + 1]
+            chosen = np.empty(batch, dtype=np.int64)
+            for s in np.unique(remaining):
+                idx = np.flatnonzero(remaining == s)
+                w = [int(ways[k]) * rest[s - k] if 0 <= s - k < len(rest) else 0 for k in range(len(ways))]
+                total = sum(w)
+                k = rng.choice(len(w), size=len(idx), p=[x / total for x in w])
+                chosen[idx] = k
+            # a uniformly random solution with the chosen mine count
+            order = np.argsort(counts, kind="stable")
+            starts = np.searchsorted(counts[order], chosen)
+            picks = order[starts + (rng.random(batch) * ways[chosen]).astype(np.int64)]
+            flat[:, cells] = table[picks]
+            remaining = remaining - chosen
+        interior_mines = self.free_mines - (self._frontier_mines(flat))
+        if len(self.interior):
+            ranks = rng.random((batch, len(self.interior))).argsort(axis=1).argsort(axis=1)
+            flat[:, self.interior] = ranks < interior_mines[:, None]
+        return flat.reshape(batch, self.height, self.width)
+
+    def _frontier_mines(self, flat):
+        total = np.zeros(flat.shape[0], dtype=np.int64)
+        for cells, _, _ in self.units:
+            total += flat[:, cells].sum(axis=1)
+        return total
+
+    def _initial_state(self, rng):
+        """One frontier layout satisfying every clue whose mine total leaves
+        between 0 and len(interior) mines for the interior, found by a
+        depth-first search in random value order that backtracks until the
+        total fits. Returns {cell: 0/1}"""
+        cells = sorted(set(c for _, cs in self.constraints.values() for c in cs))
+        clues_of = {cell: [] for cell in cells}
+        need = []
+        left = []
+        for k, (req, cs) in enumerate(self.constraints.values()):
+            need.append(req)
+            left.append(len(cs))
+            for cell in cs:
+                clues_of[cell].append(k)
+        low = self.mines_left - len(self.interior)
+        high = self.mines_left
+        assign = {}
+        placed = [0]
+
+        def dfs(i):
+            if placed[0] > high or placed[0] + len(cells) - i < low:
+                return False
+            if i == len(cells):
+                return True
+            cell = cells[i]
+            for val in rng.permutation(2):
+                val = int(val)
+                ok = True
+                for k in clues_of[cell]:
+                    need[k] -= val
+                    left[k] -= 1
+                    if need[k] < 0 or need[k] > left[k]:
+                        ok = False
+                assign[cell] = val
+                placed[0] += val
+                if ok and dfs(i + 1):
+                    return True
+                placed[0] -= val
+                for k in clues_of[cell]:
+                    need[k] += val
+                    left[k] += 1
+            del assign[cell]
+            return False
+
+        if not dfs(0):
+            raise ValueError("no layout fits the clues and the remaining mine count")
+        return assign
+
+    def _start_chains(self, chains, rng):
+        """Chain state, every chain starting from one _initial_state layout: the
+        solution index of each tabulated unit, the free-cell values of each
+        large component, and the frontier mine total outside the fixed cells"""
+        assign = self._initial_state(rng)
+        units = []
+        total = 0
+        for cells, table, counts in self.units:
+            values = np.array([assign[divmod(int(i), self.width)] for i in cells], dtype=bool)
+            pick = int(np.flatnonzero((table == values).all(axis=1))[0])
+            units.append(np.full(chains, pick, dtype=np.int64))
+            total += int(counts[pick])
+        large = []
+        for cluster, system, positions, row_ids in self.large:
+            free = np.array([assign[cluster[system.free[pos]]] for pos in positions], dtype=np.int32)
+            large.append(np.tile(free, (chains, 1)))
+            total += int(free.sum()) + sum(assign[cluster[system.pivot_rows[r][0]]] for r in row_ids)
+        return {"units": units, "large": large, "mines": np.full(chains, total, dtype=np.int64)}
+
+    def _large_rows(self, j):
+        """Coefficient matrix (free positions x rows), rhs and scale of the
+        pivot rows of large component j"""
+        cluster, system, positions, row_ids = self.large[j]
+        column = {pos: i for i, pos in enumerate(positions)}
+        coef = np.zeros((len(positions), len(row_ids)), dtype=np.int32)
+        for r, row in enumerate(row_ids):
+            for pos, a in system.pivot_rows[row][3]:
+                coef[column[pos], r] = a
+        rhs = np.array([system.pivot_rows[row][2] for row in row_ids], dtype=np.int32)
+        scale = np.array([system.pivot_rows[row][1] for row in row_ids], dtype=np.int32)
+        return coef, rhs, scale
+
+    def _block(self, coef, adjacent, rng):
+        """Random block of at most BLOCK free positions, grown from a random one
+        through positions that share a row with it, with the block's touched
+        rows, every 0/1 assignment of it and their effect on those rows"""
+        block = np.zeros(len(coef), dtype=bool)
+        block[rng.integers(len(coef))] = True
+        for _ in range(BLOCK - 1):
+            grow = np.flatnonzero(adjacent[block].any(axis=0) & ~block)
+            if not len(grow):
+                break
+            block[rng.choice(grow)] = True
+        block = np.flatnonzero(block)
+        touched = np.flatnonzero((coef[block] != 0).any(axis=0))
+        combos = _COMBOS[len(block)]
+        return block, touched, combos, combos @ coef[np.ix_(block, touched)], combos.sum(axis=1)
+
+    def _sweep(self, state, log_weight, rng):
+        """Heat-bath updates of every tabulated unit and of random blocks of
+        every large component. Each update redraws its part of the layout from
+        its exact conditional given the rest, among the assignments that
+        satisfy every clue, weighted by the interior placements the new mine
+        total leaves, so the chains keep the posterior invariant"""
+        chains = len(state["mines"])
+        for j, (cells, table, counts) in enumerate(self.units):
+            ways = np.bincount(counts)
+            rest = state["mines"] - counts[state["units"][j]]
+            with np.errstate(divide="ignore"):
+                logits = np.log(ways)[None, :] + log_weight[rest[:, None] + np.arange(len(ways))]
+            k = np.argmax(logits + rng.gumbel(size=logits.shape), axis=1)
+            order = np.argsort(counts, kind="stable")
+            starts = np.searchsorted(counts[order], k)
+            state["units"][j] = order[starts + (rng.random(chains) * ways[k]).astype(np.int64)]
+            state["mines"] = rest + k
+        for j, (coef, rhs, scale, adjacent) in enumerate(self._large):
+            free = state["large"][j]
+            for _ in range(-(-2 * len(coef) // BLOCK)):
+                block, touched, combos, combo_rows, combo_mines = self._block(coef, adjacent, rng)
+                current = free[:, block]
+                rest = rhs[touched] - free @ coef[:, touched] + current @ coef[np.ix_(block, touched)]
+                pivots = rest[:, None, :] - combo_rows[None, :, :]
+                mine_pivots = pivots == scale[touched]
+                valid = ((pivots == 0) | mine_pivots).all(axis=2)
+                old = current.sum(axis=1) + (rest - current @ coef[np.ix_(block, touched)] == scale[touched]).sum(axis=1)
+                new = state["mines"][:, None] - old[:, None] + combo_mines[None, :] + mine_pivots.sum(axis=2)
+                logits = np.where(valid, log_weight[np.clip(new, 0, len(log_weight) - 1)], -inf)
+                pick = np.argmax(logits + rng.gumbel(size=logits.shape), axis=1)
+                free[:, block] = combos[pick]
+                state["mines"] = new[np.arange(chains), pick]
+
+    def _layouts(self, state):
+        """(chains, H*W) frontier part of the chains' layouts, flags and fixed mines set"""
+        chains = len(state["mines"])
+        flat = np.zeros((chains, self.height * self.width), dtype=bool)
+        flat[:, self.flags.ravel()] = True
+        flat[:, self.fixed] = True
+        for (cells, table, _), picks in zip(self.units, state["units"]):
+            flat[:, cells] = table[picks]
+        for (cluster, system, positions, row_ids), (coef, rhs, scale, _), free in zip(self.large, self._large,
+                                                                                      state["large"]):
+            free_cells = [cluster[system.free[pos]] for pos in positions]
+            flat[:, [r * self.width + c for r, c in free_cells]] = free.astype(bool)
+            pivot_cells = [cluster[system.pivot_rows[row][0]] for row in row_ids]
+            flat[:, [r * self.width + c for r, c in pivot_cells]] = (rhs - free @ coef) == scale
+        return flat
+
+    def mcmc(self, batch, rng, burn_in=BURN_IN, thin=THIN):
+        """Gibbs sampler over the layouts consistent with the clues: up to
+        CHAINS chains each start from one _initial_state layout and are swept
+        burn_in times, then hand out their states every thin sweeps. Every
+        move keeps all clues satisfied. The chains persist on the sampler, so
+        later calls continue them without a new burn-in"""
+        if self._chains is None:
+            self._frontier_cells = np.array(
+                [int(i) for cells, _, _ in self.units for i in cells] +
+                [cluster[system.free[pos]][0] * self.width + cluster[system.free[pos]][1]
+                 for cluster, system, positions, _ in self.large for pos in positions] +
+                [cluster[system.pivot_rows[row][0]][0] * self.width + cluster[system.pivot_rows[row][0]][1]
+                 for cluster, system, _, row_ids in self.large for row in row_ids], dtype=np.int64)
+            self._log_weight = np.array([_log_comb(len(self.interior), self.free_mines - f)
+                                         for f in range(len(self._frontier_cells) + 1)])
+            self._large = []
+            for j in range(len(self.large)):
+                coef, rhs, scale = self._large_rows(j)
+                shares = (coef != 0).astype(np.int64)
+                self._large.append((coef, rhs, scale, (shares @ shares.T) > 0))
+            self._chains = self._start_chains(min(batch, CHAINS), rng)
+            for _ in range(burn_in):
+                self._sweep(self._chains, self._log_weight, rng)
+        state = self._chains
+        parts = []
+        drawn = 0
+        while drawn < batch:
+            for _ in range(thin):
+                self._sweep(state, self._log_weight, rng)
+            parts.append(self._layouts(state)[:batch - drawn])
+            drawn += len(parts[-1])
+        flat = np.concatenate(parts)
+        if len(self.interior):
+            interior_mines = self.free_mines - flat[:, self._frontier_cells].sum(axis=1)
+            ranks = rng.random((batch, len(self.interior))).argsort(axis=1).argsort(axis=1)
+            flat[:, self.interior] = ranks < interior_mines[:, None]
+        return flat.reshape(batch, self.height, self.width)
+
+
+# _COMBOS[n]: every 0/1 assignment of n cells, one per row
+_COMBOS = [((np.arange(1 << n)[:, None] >> np.arange(n)) & 1).astype(np.int32) for n in range(BLOCK + 1)]
+
+
+def _comb(n, k):
+    return comb(n, k) if 0 <= k <= n else 0
+
+def _log_comb(n, k):
+    return lgamma(n + 1) - lgamma(k + 1) - lgamma(n - k + 1) if 0 <= k <= n else -inf
+
+def sample_probabilities(game, batch=2000, rng=None):
+    """(H, W) mine probability estimate from sampled layouts, NaN on revealed cells"""
+    sampler = PosteriorSampler(game)
+    layouts = sampler.sample(batch, rng)
+    probs = layouts.mean(axis=0)
+    probs[~sampler.hidden] = np.nan
+    return probs
+
+def evaluate_guesses(game, cells, batch=2000, rng=None):
+    """Rollout estimate per candidate cell: (probability it is safe, entropy in
+    bits of the number it would show). Higher entropy means the reveal is more
+    likely to split the remaining layouts and settle neighbouring cells"""
+    sampler = PosteriorSampler(game)
+    layouts = sampler.sample(batch, rng)
+    counts = neighbor_counts(layouts)
+    result = {}
+    for r, c in cells:
+        safe = ~layouts[:, r, c]
+        p_safe = safe.mean()
+        entropy = 0.0
+        if safe.any():
+            freq = np.bincount(counts[safe, r, c], minlength=9) / safe.sum()
+            freq = freq[freq > 0]
+            entropy = float(-(freq * np.log2(freq)).sum())
+        result[(r, c)] = (float(p_safe), entropy)
+    return result
@@ -0,0 +1,222 @@
+from zobrist import zobrist_keys, cell_key, full_hash, FLAG
+
+LEFT_CLICK = 1
+RIGHT_CLICK = 3
+
+
+class CellState:
+    """Private copy of one cell, made the first time a snapshot changes it"""
+    __slots__ = ("x", "y", "is_visible", "has_bomb", "bomb_count", "has_flag")
+
+    def __init__(self, cell):
+        self.x = cell.x
+        self.y = cell.y
+        self.is_visible = cell.is_visible
+        self.has_bomb = cell.has_bomb
+        self.bomb_count = cell.bomb_count
+        self.has_flag = cell.has_flag
+
+
+class _Row:
+    __slots__ = ("snapshot", "row")
+
+    def __init__(self, snapshot, row):
+        self.snapshot = snapshot
+        self.row = row
+
+    def __getitem__(self, col):
+        return self.snapshot.cell(self.row, col)
+
+    def __len__(self):
+        return self.snapshot.squares_x
+
+    def __iter__(self):
+        for col in range(self.snapshot.squares_x):
+            yield self.snapshot.cell(self.row, col)
+
+
+class _Grid:
+    __slots__ = ("snapshot",)
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __getitem__(self, row):
+        if not 0 <= row < self.snapshot.squares_y:
+            raise IndexError(row)
+        return _Row(self.snapshot, row)
+
+    def __len__(self):
+        return self.snapshot.squares_y
+
+    def __iter__(self):
+        for row in range(self.snapshot.squares_y):
+            yield _Row(self.snapshot, row)
+
+
+class BoardSnapshot:
+    """Copy-on-write view of a game (or of another snapshot) for lookahead. It
+    is O(1) to create: untouched cells are read through to the base, and a cell
+    is copied only when a hypothetical click changes it. Every change is
+    journalled, so rollback(mark) undoes a what-if in time proportional to the
+    cells it touched. The snapshot has the grid/click_handle interface of the
+    games, so the solvers run on it unchanged.
+
+    If layout is given (a set of (row, col) mines or an (H, W) bool array),
+    clicks resolve against it instead of the real mines, e.g. a layout drawn by
+    sampler.PosteriorSampler. The base must not change while a snapshot of it
+    is in use"""
+
+    def __init__(self, base, layout=None):
+        self.base = base
+        self.squares_x = base.squares_x
+        self.squares_y = base.squares_y
+        self.num_bombs = base.num_bombs
+        self.config = getattr(base, "config", None)
+        self.init = base.init
+        self.game_lost = base.game_lost
+        self.game_won = base.game_won
+        self.flag_count = base.flag_count
+        self.zobrist = zobrist_keys(self.squares_x, self.squares_y)
+        self.state_hash = getattr(base, "state_hash", None)
+        if self.state_hash is None:
+            self.state_hash = full_hash(base)
+        if layout is None:
+            layout = getattr(base, "layout", None)
+        elif not isinstance(layout, (set, frozenset)):
+            layout = {(r, c) for r in range(self.squares_y) for c in range(self.squares_x) if layout[r][c]}
+        self.layout = layout
+        self.changes = {}
+        self.journal = []
+        self._visible = base._visible if isinstance(base, BoardSnapshot) else None
+        self.grid = _Grid(self)
+
+    def cell(self, row, col):
+        cell = self.changes.get((row, col))
+        if cell is None:
+            cell = self.base.grid[row][col]
+        return cell
+
+    def has_bomb(self, row, col):
+        if self.layout is not None:
+            return (row, col) in self.layout
+        return self.cell(row, col).has_bomb
+
+    def _set(self, row, col, attr, value):
+        cell = self.changes.get((row, col))
+        created = cell is None
+        if created:
+            cell = CellState(self.base.grid[row][col])
+            if self.layout is not None:
+                cell.has_bomb = (row, col) in self.layout
+            self.changes[(row, col)] = cell
+        self.journal.append(((row, col), attr, getattr(cell, attr), created))
+        setattr(cell, attr, value)
+
+    def _set_state(self, attr, value):
+        self.journal.append((None, attr, getattr(self, attr), False))
+        setattr(self, attr, value)
+
+    def mark(self):
+        """Journal position to roll back to"""
+        return len(self.journal)
+
+    def rollback(self, mark=0):
+        while len(self.journal) > mark:
+            key, attr, old, created = self.journal.pop()
+            if key is None:
+                setattr(self, attr, old)
+            elif created:
+                del self.changes[key]
+            else:
+                setattr(self.changes[key], attr, old)
+
+    def child(self, layout=None):
+        """Snapshot on top of this one; its changes never reach this snapshot"""
+        return BoardSnapshot(self, layout)
+
+    snapshot = child
+
+    def changed_cells(self):
+        return list(self.changes)
+
+    def visible_count(self):
+        if self._visible is None:
+            self._visible = sum(1 for row in self.base.grid for cell in row if cell.is_visible)
+        return self._visible
+
+    def count_bombs(self, row, col):
+        return sum(1 for r in range(row - 1, row + 2) for c in range(col - 1, col + 2)
+                   if (r, c) != (row, col) and 0 <= r < self.squares_y and 0 <= c < self.squares_x
+                   and self.has_bomb(r, c))
+
+    def _show(self, row, col, bomb_count=None):
+        self.visible_count()
+        before = cell_key(self.zobrist, self.cell(row, col))
+        if bomb_count is None:
+            bomb_count = 0 if self.has_bomb(row, col) else self.count_bombs(row, col)
+        else:
+            self._set(row, col, "has_bomb", False)
+        self._set(row, col, "is_visible", True)
+        self._set(row, col, "has_flag", False)
+        self._set(row, col, "bomb_count", bomb_count)
+        self._set_state("_visible", self._visible + 1)
+        self._set_state("state_hash", self.state_hash ^ before ^ cell_key(self.zobrist, self.cell(row, col)))
+
+    def reveal(self, row, col):
+        """Open a cell like the games do, including the flood fill through
+        orthogonal zeros. Returns the opened cells, or None if it was a mine"""
+        if not self.init:
+            raise ValueError("cannot click in a snapshot taken before the first click")
+        cell = self.cell(row, col)
+        if cell.is_visible or cell.has_flag or self.game_lost:
+            return []
+        self._show(row, col)
+        if self.has_bomb(row, col):
+            self._set_state("game_lost", True)
+            return None
+        opened = [(row, col)]
+        stack = [(row, col)] if self.cell(row, col).bomb_count == 0 else []
+        while stack:
+            r, c = stack.pop()
+            for nr, nc in ((r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)):
+                if 0 <= nr < self.squares_y and 0 <= nc < self.squares_x:
+                    if not self.cell(nr, nc).is_visible and not self.has_bomb(nr, nc):
+                        self._show(nr, nc)
+                        opened.append((nr, nc))
+                        if self.cell(nr, nc).bomb_count == 0:
+                            stack.append((nr, nc))
+        self.check_victory()
+        return opened
+
+    def reveal_as(self, row, col, bomb_count):
+        """Hypothetically show bomb_count at a hidden cell, without flood fill"""
+        self._show(row, col, bomb_count)
+
+    def toggle_flag(self, row, col):
+        cell = self.cell(row, col)
+        if cell.has_flag:
+            self._set(row, col, "has_flag", False)
+            self._set_state("flag_count", self.flag_count - 1)
+            self._set_state("state_hash", self.state_hash ^ self.zobrist[row][col][FLAG])
+        elif not cell.is_visible and self.flag_count < self.num_bombs:
+            self._set(row, col, "has_flag", True)
+            self._set_state("flag_count", self.flag_count + 1)
+            self._set_state("state_hash", self.state_hash ^ self.zobrist[row][col][FLAG])
+
+    def click_handle(self, row, column, button):
+        if button == LEFT_CLICK:
+            self.reveal(row, column)
+            return self.game_won
+        if button == RIGHT_CLICK:
+            self.toggle_flag(row, column)
+        return False
+
+    def check_victory(self):
+        if self.squares_x * self.squares_y - self.visible_count() == self.num_bombs and not self.game_lost:
+            self._set_state("game_won", True)
+        return self.game_won
+
+    def get_revealed_percentage(self):
+        total_safe_cells = self.squares_x * self.squares_y - self.num_bombs
+        return (self.visible_count() / total_safe_cells) * 100 if total_safe_cells > 0 else 0
@@ -0,0 +1,418 @@
+import asyncio
+import json
+import os
+import random
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from portfolio import encode_position, decode_position, FLAGGED
+
+# Frames in both directions: ">II" header and payload lengths, a JSON header,
+# then the payload. Requests carry the board as int8 codes (portfolio's
+# encode_position), probability replies an (H, W) float64 array
+FRAME = struct.Struct(">II")
+MAX_FRAME = 16 << 20
+SOCKET_PATH = os.path.join("results", "solver.sock")
+BATCH_WINDOW = 0.002
+MAX_BATCH = 64
+POSITION_CACHE = 4096
+CLUSTER_CACHE = 65536
+LATENCY_WINDOW = 1000
+
+# the engines a client may name: (module, move solver, cluster solver). Only
+# these are importable through the service
+ENGINES = {
+    "csp": ("CSP_solver", "csp_solver", "csp_cluster_solver"),
+    "dp": ("dp_solver", "dp_solver", "dp_cluster_solver_dp"),
+}
+
+
+def encode_message(header, payload=b""):
+    header = json.dumps(header, separators=(",", ":")).encode()
+    return FRAME.pack(len(header), len(payload)) + header + payload
+
+def decode_message(data):
+    header_len, payload_len = FRAME.unpack_from(data)
+    start = FRAME.size + header_len
+    return json.loads(data[FRAME.size:start]), data[start:start + payload_len]
+
+def _frame_lengths(prefix):
+    header_len, payload_len = FRAME.unpack(prefix)
+    if header_len + payload_len > MAX_FRAME:
+        raise ValueError(f"frame of {header_len + payload_len} bytes is over the {MAX_FRAME} limit")
+    return header_len, payload_len
+
+
+class ClusterCache:
+    """Cluster solver wrapper remembering results by the cluster's clue
+    constraints, so a cluster seen in any earlier request, from any client,
+    is not solved again. Keeps the wrapped solver's __name__ so the
+    probability_matrix cache keys stay the same"""
+
+    def __init__(self, cluster_solver, size=CLUSTER_CACHE):
+        self.cluster_solver = cluster_solver
+        self.__name__ = cluster_solver.__name__
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, cluster, cluster_constraints, reduce=True):
+        key = (reduce, frozenset((required, frozenset(cells)) for required, cells in cluster_constraints.values()))
+        probs = self.entries.get(key)
+        if probs is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return dict(probs)
+        self.misses += 1
+        probs = self.cluster_solver(cluster, cluster_constraints, reduce)
+        self.entries[key] = dict(probs)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return probs
+
+
+class SolverService:
+    """One warm solver shared by every client. Requests are queued and taken in
+    batches of up to max_batch, waiting at most batch_window seconds for a
+    batch to fill; identical positions in a batch are solved once. Solving
+    runs on a single worker thread so the position and cluster caches need no
+    locking and the event loop keeps serving sockets meanwhile"""
+
+    def __init__(self, batch_window=BATCH_WINDOW, max_batch=MAX_BATCH, cache_size=POSITION_CACHE):
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.cache_size = cache_size
+        self.positions = OrderedDict()
+        self.cluster_caches = {}
+        self.queue = None
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="solver")
+        self.started = time.monotonic()
+        self.requests = 0
+        self.batches = 0
+        self.deduplicated = 0
+        self.position_hits = 0
+        self.max_depth = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self._batcher = None
+
+    def _engine(self, name):
+        import importlib
+        if name not in ENGINES:
+            raise ValueError(f"unknown engine {name!r}, expected one of {sorted(ENGINES)}")
+        module, move_solver, cluster_solver = ENGINES[name]
+        module = importlib.import_module(module)
+        if name not in self.cluster_caches:
+            self.cluster_caches[name] = ClusterCache(getattr(module, cluster_solver))
+        return getattr(module, move_solver), self.cluster_caches[name]
+
+    def _solve(self, op, engine, codes, mines, seed):
+        """Run on the solver thread: (move or None, probs or None, cached)"""
+        from CSP_solver import probability_matrix
+        move_solver, cluster_solver = self._engine(engine)
+        key = (engine, codes.shape, codes.tobytes(), mines)
+        game = decode_position(codes, mines)
+        matrix = self.positions.get(key)
+        cached = matrix is not None
+        if cached:
+            self.positions.move_to_end(key)
+            self.position_hits += 1
+            game.probability_cache = matrix
+        else:
+            matrix = probability_matrix(game, cluster_solver)
+            self.positions[key] = matrix
+            if len(self.positions) > self.cache_size:
+                self.positions.popitem(last=False)
+        if op == "probabilities":
+            return None, matrix.probs, cached
+        if seed is not None:
+            random.seed(seed)
+        move = move_solver(game)
+        return (None if move is None else [int(move[0]), int(move[1])]), None, cached
+
+    def _solve_batch(self, batch):
+        results = {}
+        for key, _ in batch:
+            if key in results:
+                self.deduplicated += 1
+                continue
+            try:
+                results[key] = ("ok", self._solve(*key[:2], np.frombuffer(key[3], dtype=np.int8).reshape(key[2]),
+                                                  *key[4:]))
+            except Exception as exc:
+                results[key] = ("error", f"{type(exc).__name__}: {exc}")
+        return results
+
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.batches += 1
+            results = await loop.run_in_executor(self.executor, self._solve_batch, batch)
+            for key, future in batch:
+                if not future.done():
+                    future.set_result(results[key])
+
+    def _ensure_started(self):
+        if self._batcher is None:
+            self.queue = asyncio.Queue()
+            self._batcher = asyncio.get_running_loop().create_task(self._run_batches())
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(q):
+            return latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000 if latencies else None
+
+        clusters = list(self.cluster_caches.values())
+        return {
+            "uptime": time.monotonic() - self.started,
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "max_queue_depth": self.max_depth,
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch": self.requests / self.batches if self.batches else 0.0,
+            "deduplicated": self.deduplicated,
+            "latency_ms_p50": percentile(0.5),
+            "latency_ms_p95": percentile(0.95),
+            "position_cache": len(self.positions),
+            "position_hits": self.position_hits,
+            "cluster_cache": sum(len(c.entries) for c in clusters),
+            "cluster_hits": sum(c.hits for c in clusters),
+            "cluster_misses": sum(c.misses for c in clusters),
+        }
+
+    async def dispatch(self, header, payload):
+        """Reply (header, payload) to one request"""
+        reply = {"id": header.get("id")}
+        op = header.get("op")
+        if op == "stats":
+            return dict(reply, ok=True, stats=self.stats()), b""
+        try:
+            if op not in ("move", "probabilities"):
+                raise ValueError(f"unknown op {op!r}")
+            height, width = (int(n) for n in header["shape"])
+            codes = np.frombuffer(payload, dtype=np.int8)
+            if codes.size != height * width or codes.size == 0:
+                raise ValueError(f"board of {codes.size} cells does not match shape {height}x{width}")
+            if codes.min() < FLAGGED or codes.max() > 8:
+                raise ValueError("board codes must be counts 0-8, HIDDEN or FLAGGED")
+            seed = header.get("seed")
+            key = (op, header.get("engine", "csp"), (height, width), payload,
+                   int(header["mines"]), None if seed is None else int(seed))
+        except (KeyError, TypeError, ValueError) as exc:
+            return dict(reply, ok=False, error=f"bad request: {exc}"), b""
+        self._ensure_started()
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((key, future))
+        self.requests += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        status, result = await future
+        self.latencies.append(time.perf_counter() - start)
+        if status != "ok":
+            return dict(reply, ok=False, error=result), b""
+        move, probs, cached = result
+        if op == "move":
+            return dict(reply, ok=True, move=move, cached=cached), b""
+        return dict(reply, ok=True, shape=list(probs.shape), cached=cached), probs.astype(np.float64).tobytes()
+
+    async def _serve_connection(self, reader, writer):
+        lock = asyncio.Lock()
+
+        async def answer(header, payload):
+            reply = encode_message(*await self.dispatch(header, payload))
+            async with lock:
+                writer.write(reply)
+                await writer.drain()
+
+        tasks = set()
+        try:
+            while True:
+                prefix = await reader.readexactly(FRAME.size)
+                header_len, payload_len = _frame_lengths(prefix)
+                header = json.loads(await reader.readexactly(header_len))
+                payload = await reader.readexactly(payload_len)
+                task = asyncio.create_task(answer(header, payload))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def serve(self, path=None, host="127.0.0.1", port=None, ready=None):
+        """Serve on the Unix socket path, or on host:port when a port is given,
+        until cancelled. ready (a threading.Event) is set once listening"""
+        self._ensure_started()
+        if port is not None:
+            server = await asyncio.start_server(self._serve_connection, host, port)
+        else:
+            path = path or SOCKET_PATH
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            if os.path.exists(path):
+                os.remove(path)
+            server = await asyncio.start_unix_server(self._serve_connection, path)
+        if ready is not None:
+            ready.set()
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self._batcher is not None:
+            self._batcher.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _board(board, mines):
+    """(int8 codes, mines) of a game or of an encoded board"""
+    if hasattr(board, "grid"):
+        return encode_position(board), board.num_bombs if mines is None else mines
+    if mines is None:
+        raise ValueError("mines is needed with an encoded board")
+    return np.ascontiguousarray(board, dtype=np.int8), mines
+
+
+class _Client:
+    """Request helpers shared by the socket and loopback clients; subclasses
+    provide _request(header, payload) -> (header, payload)"""
+
+    def __init__(self):
+        self._ids = 0
+        self._id_lock = threading.Lock()
+
+    def _call(self, header, payload=b""):
+        with self._id_lock:
+            self._ids += 1
+            header = dict(header, id=self._ids)
+        reply, payload = self._request(header, payload)
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error", "solver service error"))
+        return reply, payload
+
+    def move(self, board, mines=None, engine="csp", seed=None):
+        """The engine's move for a game or int8 board, None when it has none"""
+        codes, mines = _board(board, mines)
+        reply, _ = self._call({"op": "move", "engine": engine, "shape": list(codes.shape), "mines": mines,
+                               "seed": seed}, codes.tobytes())
+        return None if reply["move"] is None else tuple(reply["move"])
+
+    def probabilities(self, board, mines=None, engine="csp"):
+        """(H, W) mine probabilities, NaN on revealed and flagged cells"""
+        codes, mines = _board(board, mines)
+        reply, payload = self._call({"op": "probabilities", "engine": engine, "shape": list(codes.shape),
+                                     "mines": mines}, codes.tobytes())
+        return np.frombuffer(payload, dtype=np.float64).reshape(reply["shape"])
+
+    def stats(self):
+        return self._call({"op": "stats"})[0]["stats"]
+
+
+class SolverClient(_Client):
+    """Blocking client of a running service, for the UI, notebooks and scripts.
+    Connects to the Unix socket path, or to host:port when a port is given.
+    Safe to share between threads (one request on the wire at a time)"""
+
+    def __init__(self, path=None, host="127.0.0.1", port=None, timeout=None):
+        super().__init__()
+        if port is not None:
+            self.sock = socket.create_connection((host, port), timeout)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(timeout)
+            self.sock.connect(path or SOCKET_PATH)
+        self._lock = threading.Lock()
+
+    def _read(self, n):
+        data = bytearray()
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError("solver service closed the connection")
+            data += chunk
+        return bytes(data)
+
+    def _request(self, header, payload):
+        with self._lock:
+            self.sock.sendall(encode_message(header, payload))
+            while True:
+                header_len, payload_len = _frame_lengths(self._read(FRAME.size))
+                reply = json.loads(self._read(header_len))
+                data = self._read(payload_len)
+                if reply.get("id") == header["id"]:
+                    return reply, data
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LoopbackClient(_Client):
+    """Stand-in for SolverClient without a socket: messages are encoded and
+    decoded exactly as on the wire and handed to a SolverService running on
+    an event loop in a background thread. Concurrent calls from several
+    threads are batched like those of separate socket clients"""
+
+    def __init__(self, service=None):
+        super().__init__()
+        self.service = service or SolverService()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def _request(self, header, payload):
+        request = encode_message(header, payload)
+        future = asyncio.run_coroutine_threadsafe(self.service.dispatch(*decode_message(request)), self.loop)
+        return decode_message(encode_message(*future.result()))
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.service.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve moves and mine probabilities to local clients")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="Unix socket path")
+    parser.add_argument("--port", type=int, default=None, help="Listen on localhost TCP instead")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--batch-window", type=float, default=BATCH_WINDOW, help="Seconds to wait for a batch")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    args = parser.parse_args()
+    service = SolverService(args.batch_window, args.max_batch)
+    where = f"{args.host}:{args.port}" if args.port is not None else args.socket
+    print(f"Solver service listening on {where}")
+    try:
+        asyncio.run(service.serve(args.socket, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
@@ -0,0 +1,48 @@
+from itertools import chain
+import numpy as np
+
+# A 3x3 local state (MonteCarloSolver.get_local_state) holds 9 values in
+# -2..8: -2 off the board, -1 hidden, 0-8 a revealed count. Shifted by 2 they
+# are base-11 digits, so a state is one int64 below 11**9, row-major with the
+# top-left cell as the least significant digit
+BASE = 11
+OFFSET = 2
+CELLS = 9
+POWERS = BASE ** np.arange(CELLS, dtype=np.int64)
+
+
+def encode_state(local_state):
+    code = 0
+    power = 1
+    for row in local_state:
+        for value in row:
+            code += (value + OFFSET) * power
+            power *= BASE
+    if power != BASE ** CELLS:
+        raise ValueError("only 3x3 local states can be encoded")
+    return code
+
+def decode_state(code):
+    values = []
+    code = int(code)
+    for _ in range(CELLS):
+        code, digit = divmod(code, BASE)
+        values.append(digit - OFFSET)
+    return tuple(tuple(values[i:i + 3]) for i in range(0, CELLS, 3))
+
+def encode_states(local_states):
+    """int64 codes of many local states at once"""
+    values = chain.from_iterable(chain.from_iterable(local_states))
+    digits = np.fromiter(values, dtype=np.int64, count=len(local_states) * CELLS).reshape(-1, CELLS) + OFFSET
+    return digits @ POWERS
+
+def encode_action(action, width):
+    return action[0] * width + action[1]
+
+def decode_action(code, width):
+    return divmod(int(code), width)
+
+def decode_states(codes):
+    """Local-state tuples of many codes at once"""
+    digits = (np.asarray(codes, dtype=np.int64)[:, None] // POWERS) % BASE - OFFSET
+    return [tuple(tuple(row[i:i + 3]) for i in range(0, CELLS, 3)) for row in digits.tolist()]
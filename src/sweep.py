@@ -0,0 +1,261 @@
+import csv
+import math
+import os
+import random
+import time
+from board_config import BoardConfig
+from memprofile import MemoryProfiler, current_rss_kb, peak_rss_kb, reset_peak_rss
+from watchdog import Supervisor, outlier_seeds
+
+RESULTS_DIR = "results"
+
+# first-click rule each solver's own game uses when no override is given
+NATIVE_FIRST_CLICK = {"csp": "neighborhood", "dp": "none", "mc": "cell"}
+
+_mc_solvers = {}
+
+
+def wilson_interval(wins, games, z=1.96):
+    if games == 0:
+        return 0.0, 1.0
+    p = wins / games
+    denom = 1 + z * z / games
+    center = (p + z * z / (2 * games)) / denom
+    half = z * math.sqrt(p * (1 - p) / games + z * z / (4 * games * games)) / denom
+    return max(0.0, center - half), min(1.0, center + half)
+
+def mc_play_game(config, seed=None, train_episodes=0):
+    """MonteCarloSolver.play_game as a per-game record. One solver (trained once
+    if train_episodes > 0) is kept per config in each worker"""
+    from minesweeper_MC import Game
+    from MC_Solver import MonteCarloSolver
+    solver = _mc_solvers.get((config, train_episodes))
+    if solver is None:
+        solver = MonteCarloSolver(Game(use_display=False, config=config), episodes=max(train_episodes, 1))
+        if train_episodes:
+            solver.train(verbose=False)
+        _mc_solvers[(config, train_episodes)] = solver
+    if seed is not None:
+        random.seed(seed)
+    move_times = []
+    won, steps = solver.play_game(move_times=move_times)
+    game = solver.game
+    visible = sum(1 for row in game.grid for cell in row if cell.is_visible and not cell.has_bomb)
+    return {
+        "seed": seed,
+        "won": won,
+        "exploration": visible / (game.squares_x * game.squares_y - game.num_bombs) * 100,
+        "moves": steps,
+        "move_times": move_times,
+        "max_cluster": 0
+    }
+
+def preload(solvers):
+    """Import the solver modules up front so forked workers start warm"""
+    import importlib
+    modules = {"csp": ["CSP_solver"], "dp": ["dp_solver"], "mc": ["minesweeper_MC", "MC_Solver"]}
+    for solver in solvers:
+        for name in modules[solver]:
+            importlib.import_module(name)
+
+def play_one(solver, config, seed, options=None):
+    """Worker entry point: one game of the named solver on a seeded board. With
+    options["memory"] the game runs under a MemoryProfiler and its peaks per
+    solver phase and cache structure are added to the record. peak_rss_kb is
+    the worker's peak during this game alone, not over the worker's life"""
+    options = options or {}
+    if options.get("memory"):
+        with MemoryProfiler() as profiler:
+            record = play_one(solver, config, seed, dict(options, memory=False))
+        record.update(profiler.report())
+        return record
+    # workers play many games; without a reset every game would report the
+    # largest peak of any earlier one
+    measured = reset_peak_rss()
+    start_rss = current_rss_kb()
+    if solver == "csp":
+        from CSP_solver import play_game
+        record = play_game(config, seed)
+    elif solver == "dp":
+        from dp_solver import play_game
+        record = play_game(config, seed)
+    elif solver == "mc":
+        record = mc_play_game(config, seed, options.get("train_episodes", 0))
+    else:
+        raise ValueError(f"unknown solver {solver!r}")
+    record["peak_rss_kb"] = peak_rss_kb() if measured else max(start_rss, current_rss_kb())
+    return record
+
+class SweepPoint:
+    def __init__(self, solver, config):
+        self.solver = solver
+        self.config = config
+        self.records = []
+        self.next_seed = 0
+        self.running = 0
+
+    def converged(self, min_games, max_games, ci_width):
+        n = len(self.records)
+        if n >= max_games:
+            return True
+        if n < min_games:
+            return False
+        lo, hi = wilson_interval(sum(r["won"] for r in self.records), n)
+        return hi - lo <= ci_width
+
+    def summary(self):
+        n = len(self.records)
+        wins = sum(r["won"] for r in self.records)
+        lo, hi = wilson_interval(wins, n)
+        times = sorted(t for r in self.records for t in r["move_times"])
+        return {
+            "solver": self.solver,
+            "width": self.config.width,
+            "height": self.config.height,
+            "cells": self.config.width * self.config.height,
+            "mines": self.config.mines,
+            "density": round(self.config.density, 4),
+            "first_click": self.config.first_click,
+            "games": n,
+            "unfinished": sum(1 for r in self.records if r.get("status", "ok") != "ok"),
+            "win_rate": wins / n if n else 0.0,
+            "ci_low": lo,
+            "ci_high": hi,
+            "avg_exploration": sum(r["exploration"] for r in self.records) / n if n else 0.0,
+            "avg_moves": sum(r["moves"] for r in self.records) / n if n else 0.0,
+            "mean_move_ms": 1000 * sum(times) / len(times) if times else 0.0,
+            "p95_move_ms": 1000 * times[int(0.95 * (len(times) - 1))] if times else 0.0,
+            "max_move_ms": 1000 * times[-1] if times else 0.0,
+            "max_cluster": max((r["max_cluster"] for r in self.records), default=0),
+            "peak_rss_kb": max((r["peak_rss_kb"] for r in self.records), default=0),
+            **self.memory_summary(),
+        }
+
+    def memory_summary(self):
+        keys = sorted({k for r in self.records for k in r
+                       if k.startswith(("phase_", "cache_", "peak_traced", "rss_fraction"))})
+        return {k: max(r.get(k, 0) for r in self.records) for k in keys}
+
+
+def sweep_configs(sizes, densities, first_click):
+    for size in sizes:
+        width, height = (size, size) if isinstance(size, int) else size
+        for density in densities:
+            config = BoardConfig(width, height, 1, first_click)
+            mines = max(1, round(density * width * height))
+            mines = min(mines, width * height - config.safe_cells())
+            yield BoardConfig(width, height, mines, first_click)
+
+def run_sweep(solvers=("csp", "dp"), sizes=(8, 12, 16), densities=(0.1, 0.15, 0.2),
+              min_games=20, max_games=200, ci_width=0.1, batch=10, workers=None,
+              first_click=None, out_dir=RESULTS_DIR, options=None, verbose=True):
+    """Run every solver over sizes x densities in supervised worker processes. Each
+    point plays batches of seeded games until its 95% win-rate interval is
+    narrower than ci_width (or max_games is reached). options["time_limit"] and
+    options["rss_limit_mb"] bound each game; a game that breaches them counts as
+    a loss with status timeout/oom. Writes tidy CSVs and plots to out_dir"""
+    points = []
+    for solver in solvers:
+        policy = first_click or NATIVE_FIRST_CLICK[solver]
+        for config in sweep_configs(sizes, densities, policy):
+            points.append(SweepPoint(solver, config))
+
+    options = options or {}
+    preload(solvers)
+    start_time = time.time()
+    with Supervisor(play_one, workers, options.get("time_limit"), options.get("rss_limit_mb")) as supervisor:
+
+        def submit(point):
+            for seed in range(point.next_seed, point.next_seed + batch):
+                supervisor.submit(point, (point.solver, point.config, seed, options))
+            point.next_seed += batch
+            point.running += batch
+
+        for point in points:
+            submit(point)
+        for point, record in supervisor.results():
+            point.running -= 1
+            point.records.append(record)
+            if point.running:
+                continue
+            if not point.converged(min_games, max_games, ci_width):
+                submit(point)
+            elif verbose:
+                s = point.summary()
+                print(f"{s['solver']:>4} {s['width']}x{s['height']} mines={s['mines']:<4} "
+                      f"games={s['games']:<4} win={s['win_rate']:.2f} "
+                      f"[{s['ci_low']:.2f}, {s['ci_high']:.2f}] move={s['mean_move_ms']:.2f}ms")
+
+    summaries = [point.summary() for point in points]
+    os.makedirs(out_dir, exist_ok=True)
+    write_csv(os.path.join(out_dir, "sweep_summary.csv"), summaries)
+    write_csv(os.path.join(out_dir, "sweep_games.csv"), [
+        {"solver": p.solver, "width": p.config.width, "height": p.config.height, "mines": p.config.mines,
+         "seed": r["seed"], "status": r.get("status", "ok"), "won": int(r["won"]), "exploration": r["exploration"], "moves": r["moves"],
+         "total_move_ms": 1000 * sum(r["move_times"]), "max_cluster": r["max_cluster"]}
+        for p in points for r in sorted(p.records, key=lambda r: r["seed"])
+    ])
+    plot_sweep(summaries, out_dir)
+    if verbose:
+        for point in points:
+            failed, _ = outlier_seeds(point.records)
+            if failed:
+                print(f"{point.solver} {point.config.width}x{point.config.height} mines={point.config.mines} "
+                      "unfinished seeds: " + ", ".join(f"{seed} ({status})" for seed, status in failed))
+        print(f"Sweep of {len(points)} points took {time.time() - start_time:.2f} seconds, results in {out_dir}/")
+    return summaries
+
+def write_csv(path, rows):
+    if not rows:
+        return
+    with open(path, "w", newline="") as f:
+        fieldnames = list(dict.fromkeys(k for row in rows for k in row))
+        writer = csv.DictWriter(f, fieldnames=fieldnames, restval=0)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def plot_sweep(summaries, out_dir=RESULTS_DIR):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    metrics = [("win_rate", "Win Rate"), ("mean_move_ms", "Mean Move Latency (ms)"),
+               ("max_cluster", "Peak Cluster Size"), ("peak_rss_kb", "Peak RSS (KB)")]
+    solvers = sorted({s["solver"] for s in summaries})
+    fig, axes = plt.subplots(len(solvers), len(metrics), figsize=(5 * len(metrics), 4 * len(solvers)), squeeze=False)
+    for i, solver in enumerate(solvers):
+        rows = [s for s in summaries if s["solver"] == solver]
+        for width, height in sorted({(s["width"], s["height"]) for s in rows}):
+            line = sorted((s for s in rows if (s["width"], s["height"]) == (width, height)), key=lambda s: s["density"])
+            for j, (key, title) in enumerate(metrics):
+                axes[i][j].plot([s["density"] for s in line], [s[key] for s in line], '-o', label=f"{width}x{height}")
+        for j, (key, title) in enumerate(metrics):
+            axes[i][j].set_title(f"{solver.upper()} - {title}")
+            axes[i][j].set_xlabel("Mine Density")
+            axes[i][j].grid(True)
+            axes[i][j].legend()
+    plt.tight_layout()
+    plt.savefig(os.path.join(out_dir, "sweep.png"))
+    plt.close(fig)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Sweep solvers over board sizes and mine densities")
+    parser.add_argument("--solvers", nargs="+", default=["csp", "dp"], choices=sorted(NATIVE_FIRST_CLICK))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[8, 12, 16], help="Square board sizes")
+    parser.add_argument("--densities", nargs="+", type=float, default=[0.1, 0.15, 0.2])
+    parser.add_argument("--min-games", type=int, default=20)
+    parser.add_argument("--max-games", type=int, default=200)
+    parser.add_argument("--ci-width", type=float, default=0.1, help="Stop once the 95%% interval is this narrow")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--first-click", choices=["none", "cell", "neighborhood"], default=None)
+    parser.add_argument("--mc-train-episodes", type=int, default=0)
+    parser.add_argument("--memory", action="store_true", help="Profile memory per solver phase (slower)")
+    parser.add_argument("--time-limit", type=float, default=None, help="Kill a game after this many seconds")
+    parser.add_argument("--rss-limit", type=int, default=None, help="Kill a game whose worker passes this many MB")
+    parser.add_argument("--out", default=RESULTS_DIR)
+    args = parser.parse_args()
+    run_sweep(args.solvers, args.sizes, args.densities, args.min_games, args.max_games, args.ci_width,
+              workers=args.workers, first_click=args.first_click, out_dir=args.out,
+              options={"train_episodes": args.mc_train_episodes, "memory": args.memory,
+                       "time_limit": args.time_limit, "rss_limit_mb": args.rss_limit})
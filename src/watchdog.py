@@ -0,0 +1,258 @@
+import os
+import time
+import multiprocessing as mp
+from multiprocessing.connection import wait
+
+POLL_INTERVAL = 0.05
+
+
+def rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def failure_record(seed, status, elapsed, peak_rss_kb=0):
+    """Stand-in for the record of a game that did not finish, counted as a loss"""
+    return {
+        "seed": seed,
+        "status": status,
+        "won": False,
+        "exploration": 0.0,
+        "moves": 0,
+        "move_times": [],
+        "max_cluster": 0,
+        "elapsed": elapsed,
+        "peak_rss_kb": peak_rss_kb,
+    }
+
+def _worker_main(conn, target):
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        args = task
+        try:
+            conn.send(("ok", target(*args)))
+        except MemoryError:
+            conn.send(("oom", None))
+        except Exception as exc:
+            conn.send(("error", repr(exc)))
+
+
+class SupervisedWorker:
+    """One worker process fed tasks over a pipe, so it can be killed and replaced
+    without disturbing the others"""
+
+    def __init__(self, target):
+        self.target = target
+        self.conn, child = mp.Pipe()
+        self.process = mp.Process(target=_worker_main, args=(child, target), daemon=True)
+        self.process.start()
+        child.close()
+        self.task = None
+        self.started = 0.0
+        self.peak_rss_kb = 0
+
+    def send(self, key, args):
+        self.task = (key, args)
+        self.started = time.monotonic()
+        self.peak_rss_kb = 0
+        self.conn.send(args)
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, BrokenPipeError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class Supervisor:
+    """Runs target(*args) tasks on `workers` processes. A task running longer than
+    time_limit seconds, or whose worker's RSS passes rss_limit_mb, is killed and
+    reported as "timeout"/"oom" and the worker is replaced; the other workers
+    keep going. target must be picklable by reference (module level); the seed
+    for failure records is args[seed_index]"""
+
+    def __init__(self, target, workers=None, time_limit=None, rss_limit_mb=None,
+                 seed_index=2, poll_interval=POLL_INTERVAL):
+        self.target = target
+        self.size = workers or os.cpu_count() or 1
+        self.time_limit = time_limit
+        self.rss_limit_kb = rss_limit_mb * 1024 if rss_limit_mb else None
+        self.seed_index = seed_index
+        self.poll_interval = poll_interval
+        self.queue = []
+        self.workers = [SupervisedWorker(target) for _ in range(self.size)]
+        self.restarts = 0
+
+    def submit(self, key, args):
+        self.queue.append((key, args))
+
+    def pending(self):
+        return len(self.queue) + sum(1 for w in self.workers if w.task is not None)
+
+    def _replace(self, worker):
+        worker.kill()
+        self.workers[self.workers.index(worker)] = SupervisedWorker(self.target)
+        self.restarts += 1
+
+    def _fail(self, worker, status):
+        key, args = worker.task
+        record = failure_record(args[self.seed_index], status, time.monotonic() - worker.started, worker.peak_rss_kb)
+        self._replace(worker)
+        return key, record
+
+    def results(self):
+        """Yield (key, record) for every submitted task as it completes or fails,
+        including tasks submitted while iterating"""
+        while self.pending():
+            for worker in self.workers:
+                if worker.task is None and self.queue:
+                    worker.send(*self.queue.pop(0))
+            busy = [w for w in self.workers if w.task is not None]
+            ready = wait([w.conn for w in busy], timeout=self.poll_interval)
+            now = time.monotonic()
+            for worker in busy:
+                if worker.conn in ready:
+                    try:
+                        status, result = worker.conn.recv()
+                    except EOFError:
+                        yield self._fail(worker, "crashed")
+                        continue
+                    key, args = worker.task
+                    worker.task = None
+                    if status == "ok":
+                        result.setdefault("status", "ok")
+                        yield key, result
+                    else:
+                        record = failure_record(args[self.seed_index], status, now - worker.started)
+                        if status == "error":
+                            record["error"] = result
+                        self._replace(worker)
+                        yield key, record
+                    continue
+                if self.time_limit is not None and now - worker.started > self.time_limit:
+                    yield self._fail(worker, "timeout")
+                    continue
+                if self.rss_limit_kb is not None:
+                    worker.peak_rss_kb = max(worker.peak_rss_kb, rss_kb(worker.process.pid))
+                    if worker.peak_rss_kb > self.rss_limit_kb:
+                        yield self._fail(worker, "oom")
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def outlier_seeds(records, top=5):
+    """Seeds worth profiling offline: every game that did not finish, plus the
+    slowest finished ones"""
+    failed = [(r["seed"], r["status"]) for r in records if r.get("status", "ok") != "ok"]
+    finished = sorted((r for r in records if r.get("status", "ok") == "ok"),
+                      key=lambda r: -sum(r["move_times"]))
+    slow = [(r["seed"], f"{sum(r['move_times']):.2f}s") for r in finished[:top]]
+    return failed, slow
+
+def run_benchmark(solver="csp", config=None, num_games=100, workers=None, time_limit=60.0,
+                  rss_limit_mb=None, run_id=None, options=None, verbose=True):
+    """test_solver/test_win_rate in supervised worker processes: game i uses
+    seed i, and a game breaching time_limit or rss_limit_mb is killed and
+    recorded as timeout/oom. With run_id the records stream to a ResultStore
+    and finished seeds are skipped on a rerun"""
+    from board_config import BoardConfig
+    from results_store import ResultStore, game_record
+    from sweep import play_one, preload, NATIVE_FIRST_CLICK
+    preload([solver])
+    if config is None:
+        config = BoardConfig(16, 16, 40, NATIVE_FIRST_CLICK[solver])
+    store = None
+    done = set()
+    if run_id is not None:
+        store = ResultStore(run_id, {"solver": solver, "width": config.width, "height": config.height,
+                                     "mines": config.mines, "first_click": config.first_click})
+        done = store.completed_seeds()
+    records = []
+    start_time = time.time()
+    with Supervisor(play_one, workers, time_limit, rss_limit_mb) as supervisor:
+        for seed in range(num_games):
+            if seed not in done:
+                supervisor.submit(seed, (solver, config, seed, options))
+        for seed, record in supervisor.results():
+            records.append(record)
+            if store is not None:
+                store.append({**game_record(record), "status": record["status"]})
+            if verbose and record["status"] != "ok":
+                print(f"seed {seed}: {record['status']} after {record['elapsed']:.1f}s")
+        restarts = supervisor.restarts
+    time_taken = time.time() - start_time
+    if store is not None:
+        records = [r for r in store.records() if r["seed"] < num_games]
+        for r in records:
+            r.setdefault("move_times", [r["time"]])
+    statuses = {}
+    for r in records:
+        statuses[r.get("status", "ok")] = statuses.get(r.get("status", "ok"), 0) + 1
+    wins = sum(1 for r in records if r["won"])
+    failed, slow = outlier_seeds(records)
+
+    if verbose:
+        print("----- RESULTS -----")
+        print(f"Solver: {solver}")
+        print(f"Games played: {len(records)}")
+        print(f"Grid size: {config.width}x{config.height}, mines: {config.mines}")
+        print(f"Win rate: {wins / len(records) * 100 if records else 0:.2f}%")
+        print("Outcomes: " + ", ".join(f"{k}={v}" for k, v in sorted(statuses.items())))
+        print(f"Worker restarts: {restarts}")
+        print(f"Time taken: {time_taken:.2f} seconds")
+        if failed:
+            print("Unfinished seeds: " + ", ".join(f"{seed} ({status})" for seed, status in failed))
+        print("Slowest seeds: " + ", ".join(f"{seed} ({t})" for seed, t in slow))
+
+    return {
+        "games": len(records),
+        "wins": wins,
+        "win_rate": wins / len(records) * 100 if records else 0.0,
+        "statuses": statuses,
+        "unfinished_seeds": failed,
+        "slowest_seeds": slow,
+        "time_taken": time_taken,
+    }
+
+if __name__ == "__main__":
+    import argparse
+    from board_config import BoardConfig
+    parser = argparse.ArgumentParser(description="Benchmark a solver with per-game time and memory limits")
+    parser.add_argument("--solver", choices=["csp", "dp", "mc"], default="csp")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--width", type=int, default=16)
+    parser.add_argument("--height", type=int, default=16)
+    parser.add_argument("--mines", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--time-limit", type=float, default=60.0, help="Seconds per game")
+    parser.add_argument("--rss-limit", type=int, default=None, help="MB per worker process")
+    parser.add_argument("--run-id", default=None)
+    args = parser.parse_args()
+    from sweep import NATIVE_FIRST_CLICK
+    config = BoardConfig(args.width, args.height, args.mines, NATIVE_FIRST_CLICK[args.solver])
+    run_benchmark(args.solver, config, args.games, args.workers, args.time_limit, args.rss_limit, args.run_id)
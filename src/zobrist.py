@@ -0,0 +1,37 @@
+import random
+from functools import lru_cache
+
+# a visible cell hashes as its bomb count (0-8), or MINE once a mine is shown;
+# a hidden cell hashes as FLAG when flagged and contributes nothing otherwise
+FLAG = 9
+MINE = 10
+TOKENS = 11
+
+
+@lru_cache(maxsize=None)
+def zobrist_keys(width, height):
+    """keys[row][col][token]: fixed random 64-bit keys, the same in every process"""
+    rng = random.Random(f"zobrist:{width}x{height}")
+    return tuple(tuple(tuple(rng.getrandbits(64) for _ in range(TOKENS)) for _ in range(width))
+                 for _ in range(height))
+
+def cell_token(cell):
+    if cell.is_visible:
+        return MINE if cell.has_bomb else cell.bomb_count
+    if cell.has_flag:
+        return FLAG
+    return None
+
+def cell_key(keys, cell):
+    token = cell_token(cell)
+    return 0 if token is None else keys[cell.y][cell.x][token]
+
+def full_hash(game):
+    """Hash of the visible state from scratch; the games keep game.state_hash equal
+    to this by xoring keys in and out as cells are revealed or flagged"""
+    keys = zobrist_keys(game.squares_x, game.squares_y)
+    state_hash = 0
+    for row in game.grid:
+        for cell in row:
+            state_hash ^= cell_key(keys, cell)
+    return state_hash